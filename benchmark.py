@@ -0,0 +1,289 @@
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+import io_utils
+import processes
+from logger import Logger
+
+
+def generate_volume(directory, shape, dtype, tubes=12, seed=0, slab_size=32):
+    """
+    writes a synthetic scan to disk: a cylindrical body of bright tissue crossed by dark, winding tubes running along
+    the X-Axis, with gaussian noise. Also writes a mask of the body and a binary image of the tubes.
+    :param directory: the directory the files are written to
+    :param shape: the shape of the volume
+    :param dtype: the data type of the volume, 'uint8' or 'uint16'
+    :param tubes: the number of tubes
+    :param seed: the seed of the random number generator
+    :param slab_size: the number of slices generated at a time
+    :return: a dict of the file locations ('volume', 'mask', 'tubes'), and a seed point (x, y, z) inside the first tube
+    """
+    rng = np.random.default_rng(seed)
+    dtype = np.dtype(dtype)
+    unit = 1 if dtype.itemsize == 1 else 256  # grey values are defined on the 8-bit scale
+    center = np.array(shape[1:]) / 2
+    body_radius = 0.45 * np.array(shape[1:])
+
+    angles = rng.uniform(0, 2 * np.pi, tubes)
+    distances = np.sqrt(rng.uniform(0, 0.5, tubes))  # the first tube always starts near the center of the body
+    distances[0] = 0
+    starts = center + (distances * body_radius[:, None] * [np.cos(angles), np.sin(angles)]).T
+    drift = rng.uniform(-0.15, 0.15, (tubes, 2)) * shape[1:]
+    amplitude = rng.uniform(0, 0.05, (tubes, 2)) * shape[1:]
+    frequency = rng.uniform(0.5, 2, (tubes, 1))
+    phase = rng.uniform(0, 2 * np.pi, (tubes, 2))
+    radii = rng.uniform(1.5, max(2.0, min(shape[1:]) / 40), tubes)
+
+    files = {name: os.path.join(directory, f"{name}.hdf5") for name in ['volume', 'mask', 'tubes']}
+    y, z = np.ogrid[:shape[1], :shape[2]]
+    inside = ((y - center[0]) / body_radius[0]) ** 2 + ((z - center[1]) / body_radius[1]) ** 2 <= 1
+    with h5py.File(files['volume'], 'w') as volume_file, h5py.File(files['mask'], 'w') as mask_file, \
+            h5py.File(files['tubes'], 'w') as tube_file:
+        volume = volume_file.create_dataset('data', shape=shape, dtype=dtype)
+        mask = mask_file.create_dataset('data', shape=shape, dtype=np.uint8)
+        tube_image = tube_file.create_dataset('data', shape=shape, dtype=dtype)
+        for slab_start in range(0, shape[0], slab_size):
+            x = np.arange(slab_start, min(slab_start + slab_size, shape[0]))
+            t = x / max(1, shape[0] - 1)
+            in_tube = np.zeros((len(x),) + tuple(shape[1:]), dtype=bool)
+            for i in range(tubes):
+                path = starts[i] + drift[i] * t[:, None] + amplitude[i] * np.sin(2 * np.pi * frequency[i] * t[:, None]
+                                                                                 + phase[i])
+                in_tube |= ((y - path[:, 0, None, None]) ** 2 + (z - path[:, 1, None, None]) ** 2) <= radii[i] ** 2
+            in_tube &= inside
+
+            values = np.where(in_tube, 30.0, 110.0) + rng.normal(0, 8, in_tube.shape)
+            values = np.clip(np.where(inside, values, 0) * unit, 0, np.iinfo(dtype).max)
+            volume[x[0]:x[-1] + 1] = values.astype(dtype)
+            mask[x[0]:x[-1] + 1] = np.broadcast_to(inside, in_tube.shape)
+            tube_image[x[0]:x[-1] + 1] = (in_tube * 255 * unit).astype(dtype)
+
+    first_path = starts[0] + amplitude[0] * np.sin(phase[0])
+    return files, [int(round(first_path[1])), int(round(first_path[0])), 0]
+
+
+def define_process_benchmarks(files, seed_point, dtype, rescaling_factor):
+    """
+    defines a representative configuration of every process in processes.py, and the image it is applied to
+    :return: a dict of tuples (input location, process definition) by process name. Processes that do not apply to
+        the rescaling factor are left out.
+    """
+    unit = 1 if np.dtype(dtype).itemsize == 1 else 256
+    benchmarks = {
+        'SmoothingGaussianFilter': (files['volume'], {'sigma': 2}),
+        'ConnectedThresholding': (files['volume'], {'lower': 0, 'upper': 55 * unit, 'seeds': [seed_point],
+                                                    'replacevalue': 255}),
+        'ConnectedComponents': (files['tubes'], {}),
+        'InvertIntensity': (files['volume'], {}),
+        'MaskImage': (files['volume'], {'mask_location': files['mask'], 'mask_downscale': rescaling_factor}),
+        'BinaryErosion': (files['tubes'], {'radius': 2}),
+        'BinaryDilation': (files['tubes'], {'radius': 2}),
+        'BinaryOpening': (files['tubes'], {'radius': 2}),
+        'BinaryClosing': (files['tubes'], {'radius': 2}),
+        'MeanFilter': (files['volume'], {'radius': 2}),
+        'OtsuThresholding': (files['volume'], {}),
+        'RescaleToOriginal': (files['volume'], {}),
+        'AppendImages': (files['volume'], {'images': [files['tubes']]}),
+        'Thresholding': (files['volume'], {'lower': 0, 'upper': 55 * unit}),
+        'GrayScaleDilation': (files['volume'], {'radius': 2}),
+        'GrayScaleErosion': (files['volume'], {'radius': 2}),
+        'LogicalOr': (files['tubes'], {'image_location': files['tubes']}),
+        'LogicalAnd': (files['tubes'], {'image_location': files['tubes']}),
+        'Quantification': (files['tubes'], {'table': os.path.splitext(files['tubes'])[0] + '.csv'}),
+    }
+    if rescaling_factor == 1:
+        del benchmarks['RescaleToOriginal']
+    else:
+        del benchmarks['AppendImages']  # appended images are always read at their original scale
+    return benchmarks
+
+
+def get_process_names():
+    """
+    :return: the names of all processes defined in processes.py
+    """
+    return [name for name, cls in inspect.getmembers(processes, inspect.isclass)
+            if issubclass(cls, processes.Process) and cls is not processes.Process]
+
+
+def run_process(directory, input_location, process, rescaling_factor, chunksize):
+    """
+    computes a single process with compute_from_json.py and reads the time spent in the process from its trace
+    :return: a dict of the time spent in the process and the time of the entire run (in seconds)
+    """
+    configuration = {'input_dir': input_location, 'image_dir': os.path.join(directory, 'out', ''),
+                     'temp_dir': os.path.join(directory, 'temp', ''), 'file_name': 'benchmark',
+                     'rescaling_factor': rescaling_factor, 'chunking': chunksize > 0,
+                     'chunksize': chunksize or 1, 'halo': chunksize > 0, 'processes': [process],
+                     'trace': os.path.join(directory, 'trace.jsonl')}
+    for subdirectory in ['out', 'temp']:
+        os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+    location = os.path.join(directory, 'benchmark.json')
+    with open(location, 'w') as configuration_file:
+        json.dump(configuration, configuration_file)
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compute_from_json.py')
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, script, location, '--noconfirm', '--nodisplay'], capture_output=True,
+                            text=True)
+    total = time.perf_counter() - start
+    if result.returncode != 0 or 'Error' in result.stdout:
+        raise RuntimeError(f"{process['type']} failed:\n{result.stdout[-2000:]}{result.stderr[-2000:]}")
+    os.remove(os.path.join(directory, 'out', 'benchmark.hdf5'))
+
+    with open(configuration['trace']) as trace:
+        records = [json.loads(line) for line in trace if line.strip()]
+    return {'process': sum(r['wall'] for r in records if r['cat'] == 'process'), 'total': total}
+
+
+def run_io(directory, files, rescaling_factors, chunksizes):
+    """
+    times the reading, writing and reassembly of images with the IOHandler
+    :return: a dict of the time (in seconds) by benchmark name
+    """
+    handler = io_utils.IOHandler(True, Logger())
+    results = {}
+
+    def measure(name, function, *args):
+        start = time.perf_counter()
+        value = function(*args)
+        results[name] = time.perf_counter() - start
+        return value
+
+    for rescaling_factor in rescaling_factors:
+        for mode in (['decimate'] if rescaling_factor == 1 else handler.downsampling_modes):
+            measure(f"load_array_from_file/scale{rescaling_factor}/{mode}", handler.load_array_from_file,
+                    files['volume'], rescaling_factor, 0, None, mode)
+            handler.close_files()
+
+    volume = handler.load_array_from_file(files['volume'], 1)
+    tubes = handler.load_array_from_file(files['tubes'], 1)
+    handler.close_files()
+    # the .hdf5 benchmarks keep their names, so baselines of earlier runs stay comparable
+    for storage_format, suffix in [('hdf5', ''), ('npy', '/npy')]:
+        extension = handler.get_format_extension(storage_format)
+        location = os.path.join(directory, f"written{extension}")
+        measure(f"write_array_to_file/grayscale{suffix}", handler.write_array_to_file, volume, location, {})
+        measure(f"write_array_to_file/binary{suffix}", handler.write_array_to_file, tubes, location, {})
+        handler.delete_file(location)
+
+        for chunksize in chunksizes:
+            if chunksize <= 0:
+                continue
+            chunk_files = []
+            for i, start in enumerate(range(0, len(volume), chunksize)):
+                chunk_files.append(os.path.join(directory, f"chunk_{i}{extension}"))
+                handler.write_array_to_file(volume[start:start + chunksize], chunk_files[-1], {})
+            measure(f"reassemble_chunks/chunk{chunksize}{suffix}", handler.reassemble_chunks, chunk_files)
+            for chunk_file in chunk_files:
+                handler.delete_file(chunk_file)
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    :param results: the times of this run by benchmark name
+    :param baseline: the times of a previous run by benchmark name
+    :param tolerance: the relative change of a time that is reported as a regression or an improvement
+    :return: a table as a string, and the names of all benchmarks that regressed
+    """
+    lines = [f"{'benchmark':<58}{'time [s]':>10}{'baseline [s]':>14}{'ratio':>8}"]
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline:
+            lines.append(f"{name:<58}{value:>10.3f}{'-':>14}{'-':>8}")
+            continue
+        ratio = value / baseline[name] if baseline[name] > 0 else 1
+        verdict = ''
+        if ratio > 1 + tolerance:
+            verdict = '  slower'
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            verdict = '  faster'
+        lines.append(f"{name:<58}{value:>10.3f}{baseline[name]:>14.3f}{ratio:>8.2f}{verdict}")
+    return '\n'.join(lines), regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='times every process and the file operations on a synthetic volume, '
+                                                 'and compares the times with a stored baseline.')
+    parser.add_argument('--shape', type=int, nargs=3, default=[256, 256, 256],
+                        help='the shape of the synthetic volume')
+    parser.add_argument('--dtype', default='uint8', choices=['uint8', 'uint16'],
+                        help='the data type of the synthetic volume')
+    parser.add_argument('--chunksizes', type=int, nargs='+', default=[0, 64],
+                        help='the chunk sizes to be benchmarked, 0 computes the volume without chunking')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 2],
+                        help='the rescaling factors to be benchmarked')
+    parser.add_argument('--processes', nargs='+', default=None,
+                        help='the processes to be benchmarked. Defaults to all processes')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='the number of repetitions of every benchmark, the fastest one is reported')
+    parser.add_argument('--baseline', default=None,
+                        help='a .json file of a previous run, that the results are compared with')
+    parser.add_argument('--save', default=None,
+                        help='the location the results are saved to, to serve as a baseline for later runs')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='the relative change of a time that is reported as a regression or an improvement')
+    parser.add_argument('--workdir', default=None,
+                        help='the directory the synthetic volume is written to. Defaults to a temporary directory')
+    args = parser.parse_args()
+
+    logger = Logger()
+    names = args.processes or get_process_names()
+    with tempfile.TemporaryDirectory(dir=args.workdir) as directory:
+        logger.log_started(f"generating a synthetic volume of shape {tuple(args.shape)} ({args.dtype})")
+        files, seed_point = generate_volume(directory, tuple(args.shape), args.dtype)
+        logger.log_completed("volume generation")
+
+        results = {}
+        for repetition in range(args.repeat):
+            logger.log_timestamp(f"repetition {repetition + 1} of {args.repeat}")
+            with contextlib.redirect_stdout(io.StringIO()):
+                times = run_io(directory, files, args.scales, args.chunksizes)
+            for scale in args.scales:
+                benchmarks = define_process_benchmarks(files, seed_point, args.dtype, scale)
+                for name in names:
+                    if name not in benchmarks:
+                        if repetition == 0:
+                            logger.log_warning(f"no benchmark defined for {name} at scale {scale}, skipping")
+                        continue
+                    input_location, definition = benchmarks[name]
+                    for chunksize in args.chunksizes:
+                        measured = run_process(directory, input_location, dict(definition, type=name), scale,
+                                               chunksize)
+                        label = f"{name}/scale{scale}/{f'chunk{chunksize}' if chunksize > 0 else 'whole'}"
+                        times[f"{label}/process"] = measured['process']
+                        times[f"{label}/total"] = measured['total']
+            for key, value in times.items():
+                results[key] = min(value, results.get(key, value))
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    table, regressions = compare_to_baseline(results, baseline, args.tolerance)
+    print(table)
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump({'environment': {'shape': args.shape, 'dtype': args.dtype, 'python': platform.python_version(),
+                                       'numpy': np.__version__, 'machine': platform.machine(),
+                                       'processor_count': os.cpu_count()},
+                       'results': results}, results_file, indent=2)
+        logger.log_timestamp(f"results saved to: {args.save}")
+    if regressions:
+        logger.log_warning(f"{len(regressions)} benchmarks are more than {args.tolerance:.0%} slower than the baseline")
+        sys.exit(1)
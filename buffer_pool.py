@@ -0,0 +1,64 @@
+import threading
+import weakref
+
+import numpy as np
+
+
+class BufferPool:
+    """
+    hands out numpy arrays for the images passed along the pipeline, and takes them back once their content has been
+    copied elsewhere (e.g. into a SimpleITK image), so chunks of the same shape reuse the same allocations instead of
+    allocating new ones for every chunk.
+
+    Attributes:
+        max_free (int): the maximum number of returned arrays kept for reuse. Defaults to 2.
+        free (list): the returned arrays, in order of their return
+        issued (WeakValueDictionary): the arrays handed out by this pool that are still in use, by id. Only these can
+            be returned, so arrays owned by anything else are never reused.
+    """
+
+    def __init__(self, max_free=2):
+        self.max_free = max_free
+        self.free = []
+        self.issued = weakref.WeakValueDictionary()
+        self.lock = threading.Lock()  # arrays are acquired and released by the reader and writer threads as well
+
+    def acquire(self, shape, dtype):
+        """
+        :param shape: the shape of the array
+        :param dtype: the data type of the array
+        :return: an uninitialized, writeable array, reusing a returned array of the same shape and type if possible
+        """
+        shape, dtype = tuple(int(n) for n in shape), np.dtype(dtype)
+        with self.lock:
+            for i, buffer in enumerate(self.free):
+                if buffer.shape == shape and buffer.dtype == dtype:
+                    del self.free[i]
+                    break
+            else:
+                buffer = np.empty(shape, dtype=dtype)
+            self.issued[id(buffer)] = buffer
+        return buffer
+
+    def release(self, array):
+        """
+        returns an array (or a view of it) to the pool. The array must not be used by the caller afterwards. Arrays
+        that were not handed out by this pool are ignored.
+        :param array: the array to be returned
+        """
+        if not isinstance(array, np.ndarray):
+            return
+        buffer = array if array.base is None else array.base
+        with self.lock:
+            if self.issued.get(id(buffer)) is not buffer:
+                return
+            del self.issued[id(buffer)]
+            buffer.flags.writeable = True
+            self.free.append(buffer)
+            if len(self.free) > self.max_free:
+                self.free.pop(0)
+
+    def clear(self):
+        with self.lock:
+            self.free.clear()
+            self.issued.clear()
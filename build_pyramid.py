@@ -0,0 +1,22 @@
+import argparse
+
+import io_utils
+from logger import Logger
+
+if __name__ == "__main__":
+    handler = io_utils.IOHandler(False, Logger())
+
+    parser = argparse.ArgumentParser(description='stores downscaled versions of a .hdf5 file next to it, which are used '
+                                                 'for all following reads with a matching rescaling factor.')
+    parser.add_argument('infile',
+                        help=f'a valid .hdf5 file that contains a dataset by the key of either: {handler.valid_dataset_identifiers}')
+
+    parser.add_argument('--l', '--levels', type=int, nargs='+', default=[2, 4, 8],
+                        help='the rescaling factors of the levels to be built')
+
+    parser.add_argument('--m', '--mode', default='decimate', choices=handler.downsampling_modes,
+                        help='the method used for downscaling')
+
+    args = parser.parse_args()
+
+    handler.build_pyramid(args.infile, args.l, args.m)
@@ -1,10 +1,22 @@
 import os
 import json
+import math
 import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
 
 import io_utils
 from logger import Logger
+from pipelined_executor import PipelinedExecutor
+from preview import PreviewRenderer
 from process_handler import ProcessHandler
+from result_cache import ResultCache
+from run_planner import RunPlanner
+from thread_scheduler import ThreadScheduler, get_available_cores
+from tracer import Tracer
 
 
 class JsonInterpreter:
@@ -20,17 +32,76 @@ class JsonInterpreter:
         file_identifier (str, optional): an identifier that will be used for naming output and temporary files.
             Defaults to 'visualization'
         output_name (str): the full file location and name for the final output
+        output_format (str, optional): the storage format of the output, 'hdf5' or 'npy' (a memory-mapped .npy file,
+            see storage.py). Defaults to 'hdf5'.
         temp_name (str): the full file location and name for temporary files. contains a space for formatting an
             index before the file extension
+        temp_format (str, optional): the storage format of the temporary files, 'hdf5' or 'npy'. Defaults to 'hdf5'.
         rescaling_factor (int, optional): the amount of downscaling to be applied to the original image (taking every
             n-th value along all axes). Defaults to 1.
+        downsampling (str, optional): the method used to downscale the input when rescaling_factor is not 1, one of
+            'decimate' (taking every n-th value), 'mean', 'max' or 'min' (reducing blocks of n*n*n values).
+            Defaults to 'decimate'.
+        output_storage (dict, optional): overrides the storage layout of the output dataset (see
+            IOHandler.storage_options). Defaults to a layout chosen depending on whether the output is binary.
+        slab_cache_mb (int, optional): the maximum amount of memory (in MiB) used to keep sections of secondary images
+            (e.g. masks) that are read more than once per chunk. Defaults to 1024.
+        fuse_pointwise (bool, optional): if True, runs of consecutive pointwise processes (e.g. Thresholding,
+            MaskImage, LogicalAnd) are executed in a single pass over the image. Defaults to True.
+        fuse_morphology (bool, optional): if True, a BinaryErosion directly followed by a BinaryDilation with the same
+            parameters is replaced by a BinaryOpening, the reverse by a BinaryClosing. Defaults to True.
+        cache_dir (str, optional): if defined, the intermediate results of the process list are stored in this
+            directory, and following runs resume from the longest stored prefix of their process list
+        cache_size_gb (float, optional): the maximum size of the result cache. Defaults to 20.
+        trace (str or bool, optional): the location of a file the cost of every process, chunk and file operation is
+            recorded in (as JSON lines), summarized at the end of the run. True places the trace next to the output.
+            Defaults to False.
+        tracer (Tracer): records the trace, if enabled
         input_shape_unscaled (int): the shape of the entire input file before rescaling
         start_index, end_index (int, optional): the range of the input file (before scaling) to be computed.
             Defaults to None (loading the entire dataset).
         handler (ProcessHandler): creates and manages the pipeline of processes to be applied to the input image
         chunking (bool, optional): if True, the the dataset is read in chunks. Every chunk will be transformed
             according to the instructions and saved to disk for later reassembly. Defaults to True.
-        chunks (list(tuple), optional): the indices describing all chunks (before scaling) to be computed
+        chunksize (int or str, optional): the number of slices (before scaling) of every chunk, or "auto" to choose
+            the largest chunk size that fits into memory (see RunPlanner). Defaults to 500.
+        memory_limit_gb (float, optional): the memory the computation may use when planning the chunk size. Defaults
+            to 80% of the memory available at the start of the run.
+        planner (RunPlanner): estimates the memory and time needed by the computation
+        brick_size (int or list(int), optional): if defined, the image is cut into bricks of this size (before
+            scaling) along all three axes instead of slabs of whole slices, e.g. [256, 256, 256]. Every size is rounded
+            up to a multiple of the rescaling factor. Processes that depend on the order of the chunks or merge chunks
+            can not be computed in bricks. Defaults to None (slabs of chunksize slices).
+        chunks (list(tuple), optional): the boxes of all chunks (before scaling) to be computed, as start and end
+            indices along the X-, Y- and Z-Axis
+        halo (bool or int, optional): if True, every chunk is read with enough additional slices on either side to
+            cover the kernel reach of all processes (along every axis the chunk does not span entirely). The halo is
+            cropped before the chunk is saved. An integer defines the halo (in slices before scaling) explicitly.
+            Defaults to False.
+        workers (int or str, optional): the number of processes computing chunks in parallel, or "auto" to choose the
+            number with the highest throughput from the calibrated scaling of the processes (see ThreadScheduler).
+            Pipelines containing processes that depend on the previous chunk are always computed serially. Defaults
+            to 1.
+        threads (int, optional): the number of threads used by the SimpleITK filters of all workers together.
+            Defaults to the number of available cores.
+        thread_profile (str, optional): the file the scaling of the processes is stored in by a run with --calibrate.
+            Defaults to a file named after file_name in image_dir.
+        thread_scheduler (ThreadScheduler): sets the number of threads of every stage
+        preview_dir (str, optional): if defined, projections and slices of the output are written to this directory
+            as .png files after the computation (see PreviewRenderer). Defaults to None.
+        direct_write (bool, optional): if True, the output file is created at its final shape and every chunk is
+            written into it as soon as it is computed, instead of being saved to a temporary file. Defaults to False.
+        pipeline_depth (int, optional): if greater than 0, chunks that are computed serially are read and saved by
+            background threads while the current chunk is computed. Defines how many chunks may wait to be computed
+            or saved at a time. Defaults to 0.
+        chunk_summaries (dict): the summaries of computed chunks needed by a final process that merges chunks
+        chunk_checkpoints (dict): the signature and the state of the order-dependent processes of every computed chunk
+            that is still to be saved to a temporary file, saved with it so an interrupted run can be resumed
+        resume (bool): if True, chunks saved to temporary files by an interrupted run of the same configuration are
+            not computed again
+        output_offsets (list(tuple)): the indices (x, y, z) of the output, at which each chunk is written
+        output_sizes (list(tuple)): the shape of every computed chunk expected by the output layout
+        output_shape ((int, int, int)): the shape of the complete output
     """
     def __init__(self):
         parser = argparse.ArgumentParser(description='performs computations defined in an input file.')
@@ -47,6 +118,18 @@ class JsonInterpreter:
         parser.add_argument('-ns', '--nosave', action='store_true',
                             help='Calculation output will not be saved to disc')
 
+        parser.add_argument('--plan', action='store_true',
+                            help='prints the chunks and the estimated memory and time of the computation without '
+                                 'computing it')
+
+        parser.add_argument('--resume', action='store_true',
+                            help='continues an interrupted computation, skipping all chunks that were completely saved '
+                                 'to temporary files by a run of the same configuration')
+
+        parser.add_argument('--calibrate', action='store_true',
+                            help='measures the time of every process with increasing numbers of threads on the first '
+                                 'chunk, and stores it for the thread scheduling of following runs')
+
         self.args = parser.parse_args()
 
         self.logger = Logger()
@@ -58,18 +141,69 @@ class JsonInterpreter:
         # retrieve all parameters needed for the computation from the input file and save them to class variables
         self.input_dir = self.get_attr_by_name('input_dir')
         self.file_identifier = self.get_attr_by_name('file_name', 'result')
-        self.output_name = self.io_handler.define_out_name(self.get_attr_by_name('image_dir'), self.file_identifier)
-        self.temp_name = "{}_{{}}.hdf5".format(self.get_attr_by_name('temp_dir') + self.file_identifier)
+        self.output_name = self.io_handler.define_out_name(
+            self.get_attr_by_name('image_dir'), self.file_identifier,
+            self.io_handler.get_format_extension(self.get_attr_by_name('output_format', 'hdf5')))
+        trace = self.get_attr_by_name('trace', False)
+        if trace is True:
+            trace = f"{os.path.splitext(self.output_name)[0]}.trace.jsonl"
+        # a planning run keeps the trace of the previous run to estimate the computation time from it
+        self.tracer = Tracer(None if self.args.plan else trace or None, self.logger)
+        self.io_handler.tracer = self.tracer
+        self.temp_name = "{}_{{}}{}".format(self.get_attr_by_name('temp_dir') + self.file_identifier,
+                                            self.io_handler.get_format_extension(
+                                                self.get_attr_by_name('temp_format', 'hdf5')))
         self.rescaling_factor = self.get_attr_by_name('rescaling_factor', 1)
+        self.io_handler.set_downsampling(self.get_attr_by_name('downsampling', 'decimate'))
+        self.io_handler.storage_options = self.get_attr_by_name('output_storage', {})
+        self.io_handler.slab_cache_bytes = self.get_attr_by_name('slab_cache_mb', 1024) * 2 ** 20
         self.input_shape_unscaled = self.io_handler.get_original_shape(self.input_dir)
         self.start_index = self.get_attr_by_name('start_index', 0)
         self.end_index = self.get_attr_by_name('end_index', self.input_shape_unscaled[0])
 
         self.handler = ProcessHandler(self, self.get_attr_by_name('processes'))
+        self.handler.define_stages(self.get_attr_by_name('fuse_pointwise', True),
+                                   self.get_attr_by_name('fuse_morphology', True))
+        # a planning run does not compute anything, so it neither reads nor evicts cached results
+        if 'cache_dir' in self.configuration and not self.args.plan:
+            self.handler.result_cache = ResultCache(self.configuration['cache_dir'],
+                                                    int(self.get_attr_by_name('cache_size_gb', 20) * 2 ** 30),
+                                                    self.logger)
+        profile = f"{self.get_attr_by_name('image_dir')}{self.file_identifier}.threads.json"  # shared by all runs
+        self.thread_scheduler = ThreadScheduler(self.get_attr_by_name('threads', get_available_cores()),
+                                                self.get_attr_by_name('thread_profile', profile), self.logger)
+        self.handler.thread_scheduler = self.thread_scheduler
+        self.workers = self.get_attr_by_name('workers', 1)
+        if self.workers == 'auto':
+            self.workers = self.thread_scheduler.choose_workers(self.handler.processes)
+        self.thread_scheduler.set_workers(self.workers)
+        self.direct_write = self.get_attr_by_name('direct_write', False)
+        self.pipeline_depth = self.get_attr_by_name('pipeline_depth', 0)
+        self.preview_dir = self.configuration.get('preview_dir')
+        self.planner = RunPlanner(self, self.configuration.get('memory_limit_gb'), trace or None)
         self.chunking = self.get_attr_by_name('chunking', False)
+        self.brick_size = self.configuration.get('brick_size')
         if self.chunking:
-            self.chunks = define_chunks(self.start_index, self.end_index, self.get_attr_by_name('chunksize', 500))
+            self.handler.configure_halo(self.get_attr_by_name('halo', False))
+            if self.brick_size is not None:
+                self.check_bricks()
+                self.chunks = define_bricks(self.get_full_box(), self.brick_size, self.rescaling_factor)
+            else:
+                chunksize = self.get_attr_by_name('chunksize', 500)
+                if chunksize == 'auto':
+                    chunksize = self.planner.choose_chunksize()
+                whole = self.get_full_box()[1:]
+                self.chunks = [(chunk,) + whole for chunk in define_chunks(self.start_index, self.end_index, chunksize)]
             self.logger.log_timestamp(f"chunk generation complete, {len(self.chunks)} chunks defined.")
+        self.output_created = False
+        self.chunk_summaries = {}
+        self.chunk_checkpoints = {}
+        self.resume = self.args.resume and self.chunking
+        if self.resume and self.direct_write:
+            self.logger.log_warning("chunks written directly to the output can not be resumed, computing all chunks")
+            self.resume = False
+        if self.chunking:
+            self.define_output_layout()
 
         self.logger.log_successful("input file validation")
 
@@ -78,42 +212,327 @@ class JsonInterpreter:
             self.logger.log_timestamp('No image Operations defined. Displaying unedited input image.')
             self.io_handler.show_3D_array(self.io_handler.load_array_from_file(self.input_dir, self.rescaling_factor,
                                                                                self.start_index, self.end_index))
+            self.tracer.close()
             return
 
         if not self.chunking or len(self.chunks) == 1:
-            self.handler.set_indices(self.start_index, self.end_index, self.input_dir)
-            working_array = self.io_handler.load_array_from_file(self.input_dir, self.rescaling_factor,
-                                                                 self.start_index, self.end_index)
+            self.handler.set_indices(self.get_full_box())
+            working_array = self.load_box(self.get_full_box())
             working_array = self.handler.execute_process_list(working_array)
             self.io_handler.write_array_to_file(working_array, self.output_name, self.configuration)
 
+        elif self.direct_write:
+            self.merge_chunks(self.execute_chunks())
+            working_array = None
+
         else:
-            temp_image_dirs = []
-
-            for i in range(len(self.chunks)):
-                chunk = self.chunks[i]
-                self.handler.current_chunk = i
-                self.handler.set_indices(chunk[0], chunk[1], self.input_dir)
-
-                self.logger.log_started(f"loading chunk No. {i} from index {chunk[0]} to {chunk[1]}")
-                working_array = self.io_handler.load_array_from_file(self.input_dir, self.rescaling_factor, chunk[0], chunk[1])
-                working_array = self.handler.execute_process_list(working_array, True)
-                self.logger.log_completed(f"processing chunk from index {chunk[0]} to {chunk[1]}")
-                current_temp_name = self.temp_name.format(str(i).zfill(3))
-                self.io_handler.write_array_to_file(working_array, current_temp_name, self.configuration)
-                temp_image_dirs.append(current_temp_name)
-
-            working_array = self.io_handler.reassemble_chunks(temp_image_dirs)
+            temp_image_dirs = self.execute_chunks()
+            self.merge_chunks(temp_image_dirs)
+
+            working_array = self.reassemble_output(temp_image_dirs)
             self.io_handler.write_array_to_file(working_array, self.output_name, self.configuration)
 
             if self.io_handler.askyesno("delete temporary files?", True):
                 for file in temp_image_dirs:
                     self.logger.log_timestamp(f"deleting: {file}")
-                    os.unlink(file)
+                    self.io_handler.delete_file(file)
+
+        if self.preview_dir is not None:
+            PreviewRenderer(self.io_handler, self.logger).render(self.output_name, self.preview_dir)
 
         if not self.args.nodisplay:
             if self.io_handler.askyesno("\ndisplay output?", True):
+                if working_array is None:
+                    working_array = self.io_handler.load_array_from_file(self.output_name, 1)
                 self.io_handler.show_3D_array(working_array)
+        self.io_handler.close_files()
+        self.tracer.close()
+
+    def calibrate(self):
+        """
+        measures the scaling of every process with the number of threads on the first chunk (or the whole range, if
+        chunking is disabled), and stores it for the thread scheduling of following runs
+        """
+        chunk = self.chunks[0] if self.chunking else self.get_full_box()
+        box = self.handler.set_chunk(0, chunk)
+        self.logger.log_started(f"calibrating the thread scaling of all processes on {describe_box(chunk)} with up "
+                                f"to {self.thread_scheduler.budget} threads")
+        working_array = self.load_box(box)
+        self.thread_scheduler.calibrate(self.handler, working_array)
+        self.logger.log_completed("calibrating the thread scaling")
+        self.io_handler.close_files()
+
+    def execute_chunks(self):
+        """
+        computes all chunks, either one after another or distributed over a pool of worker processes
+        :return: the list of files the computed chunks were saved to, in order
+        """
+        workers = min(self.workers, len(self.chunks))
+        if workers > 1:
+            dependent = [p.name for p in self.handler.processes if p.order_dependent]
+            if dependent:
+                self.logger.log_warning(f"{', '.join(dependent)} depends on the order of chunks, "
+                                        f"ignoring workers and computing chunks serially")
+                workers = 1
+        self.thread_scheduler.set_workers(workers)
+
+        if workers <= 1:
+            locations = self.execute_chunks_serially(range(len(self.chunks)))
+            if any(p.backward_sweep for p in self.handler.processes):
+                self.logger.log_started("backward sweep over all chunks")
+                self.handler.sweep_backward = True
+                locations = self.execute_chunks_serially(reversed(range(len(self.chunks))), locations)
+                self.handler.sweep_backward = False
+                self.logger.log_completed("backward sweep over all chunks")
+            return locations
+
+        locations = [None] * len(self.chunks)
+        remaining = self.skip_completed_chunks(list(range(len(self.chunks))), locations)
+        self.logger.log_timestamp(f"computing {len(remaining)} chunks with {workers} worker processes")
+        # the workers inherit the interpreter by forking, which is not the default start method on every platform
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=_init_worker, initargs=(self,)) as pool:
+            if not self.direct_write:
+                for i, (location, summary) in zip(remaining, pool.map(_execute_chunk_in_worker, remaining)):
+                    locations[i] = location
+                    self.chunk_summaries[i] = summary
+                return locations
+
+            # a .hdf5 file can only be written by one process at a time, so the workers return their chunks instead.
+            # only a few chunks are submitted ahead, so computed chunks do not pile up before they are written
+            pending = iter(remaining)
+            futures = {pool.submit(_compute_chunk_in_worker, i): i for i in itertools.islice(pending, 2 * workers)}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = futures.pop(future)
+                    working_array, self.chunk_summaries[i] = future.result()
+                    locations[i] = self.store_chunk(i, working_array)
+                    del working_array
+                    for following in itertools.islice(pending, 1):
+                        futures[pool.submit(_compute_chunk_in_worker, following)] = following
+            return locations
+
+    def execute_chunks_serially(self, order, locations=None):
+        """
+        computes chunks one after another
+        :param order: the indices of the chunks in the order they are to be computed
+        :param locations: the files of the chunks saved by a previous pass, if any
+        :return: the list of files the computed chunks were saved to, ordered by chunk index
+        """
+        locations = list(locations) if locations is not None else [None] * len(self.chunks)
+        order = self.skip_completed_chunks(list(order), locations)
+        if self.pipeline_depth > 0:
+            for i, location in enumerate(PipelinedExecutor(self, self.pipeline_depth).execute(order)):
+                if location is not None:
+                    locations[i] = location
+            return locations
+
+        for i in order:
+            locations[i] = self.execute_chunk(i)
+        return locations
+
+    def skip_completed_chunks(self, order, locations):
+        """
+        with --resume, finds the chunks saved by an interrupted run of the same configuration, which are not computed
+        again. Pipelines with order-dependent processes continue after the leading run of saved chunks, restoring the
+        state saved with each of them.
+        :param order: the indices of the chunks in the order they are to be computed
+        :param locations: the list of files of the chunks, filled in for the saved chunks
+        :return: the indices of the chunks that still need to be computed, in order
+        """
+        if not self.resume:
+            return order
+        dependent = any(p.order_dependent for p in self.handler.processes)
+        remaining = []
+        for i in order:
+            checkpoint = None
+            if not (dependent and remaining):
+                self.handler.set_chunk(i, self.chunks[i])
+                signatures = [self.handler.get_chunk_signature()]
+                if not self.handler.sweep_backward:  # chunks saved by the backward sweep have completed the first pass
+                    self.handler.sweep_backward = True
+                    signatures.append(self.handler.get_chunk_signature())
+                    self.handler.sweep_backward = False
+                location = self.temp_name.format(str(i).zfill(3))
+                checkpoint = self.io_handler.read_chunk_checkpoint(location, signatures)
+            if checkpoint is None:
+                remaining.append(i)
+                continue
+            self.handler.restore_checkpoint(checkpoint)
+            if self.handler.processes[-1].merges_chunks:
+                self.chunk_summaries[i] = self.handler.summarize_chunk(self.io_handler.load_array_from_file(location, 1))
+            locations[i] = location
+        self.logger.log_timestamp(f"resuming: {len(order) - len(remaining)} of {len(order)} chunks were already "
+                                  f"computed")
+        return remaining
+
+    def execute_chunk(self, i):
+        """
+        loads, computes and saves a single chunk
+        :param i: the index of the chunk to be computed
+        :return: the location of the file the computed chunk was saved to
+        """
+        return self.store_chunk(i, self.compute_chunk(i))
+
+    def compute_chunk(self, i):
+        """
+        loads and computes a single chunk
+        :param i: the index of the chunk to be computed
+        :return: the computed chunk, without its halo
+        """
+        return self.process_chunk(i, self.load_chunk(i))
+
+    def load_chunk(self, i):
+        """
+        loads a single chunk, including its halo, from the input file
+        :param i: the index of the chunk to be loaded
+        :return: the loaded chunk
+        """
+        chunk = self.chunks[i]
+        self.tracer.set_chunk(i)
+        self.logger.log_started(f"loading chunk No. {i} from {describe_box(chunk)}")
+        return self.load_box(self.handler.get_read_range(chunk))
+
+    def load_box(self, box):
+        """
+        :param box: start and end indices (before scaling) along every axis of the part of the input to be read
+        :return: the part of the input, in an array of the buffer pool
+        """
+        (start, end), *window = box
+        return self.io_handler.load_array_from_file(self.input_dir, self.rescaling_factor, start, end, pooled=True,
+                                                    window=window)
+
+    def get_full_box(self):
+        """
+        :return: the box of the computed range of the input, as start and end indices along every axis
+        """
+        shape = self.input_shape_unscaled
+        return (self.start_index, self.end_index), (0, shape[1]), (0, shape[2])
+
+    def check_bricks(self):
+        """
+        stops the run if the process list can not be computed in bricks
+        """
+        for p in self.handler.processes:
+            if p.order_dependent or p.merges_chunks:
+                self.logger.log_error(f"{p.name} passes information between chunks along the X-Axis and can not be "
+                                      f"computed in bricks, remove \"brick_size\" to compute it in slabs")
+
+    def process_chunk(self, i, working_array):
+        """
+        applies the process list to a loaded chunk
+        :param i: the index of the chunk
+        :param working_array: the chunk as returned by load_chunk
+        :return: the computed chunk, without its halo
+        """
+        chunk = self.chunks[i]
+        self.handler.set_chunk(i, chunk)
+        self.tracer.set_chunk(i)
+        with self.tracer.span('chunk', 'chunk', voxels=working_array.size):
+            working_array = self.handler.crop_halo(self.handler.execute_process_list(working_array, True))
+            self.chunk_summaries[i] = self.handler.summarize_chunk(working_array)
+            if not self.direct_write:
+                self.chunk_checkpoints[i] = (self.handler.get_chunk_signature(), self.handler.get_checkpoint())
+        self.logger.log_completed(f"processing chunk {describe_box(chunk)}")
+        return working_array
+
+    def store_chunk(self, i, working_array):
+        """
+        saves a computed chunk, either to its own temporary file or directly into its section of the output file.
+        The chunk is returned to the buffer pool afterwards.
+        :param i: the index of the chunk
+        :param working_array: the computed chunk
+        :return: the location of the file the chunk was saved to
+        """
+        self.tracer.set_chunk(i)
+        if self.direct_write:
+            if not self.output_created:
+                self.io_handler.create_output_file(self.output_name, self.output_shape, working_array.dtype,
+                                                   self.configuration, self.io_handler.is_binary(working_array))
+                self.output_created = True
+            self.io_handler.write_array_to_slab(working_array, self.output_name, self.output_offsets[i])
+            location = self.output_name
+        else:
+            location = self.temp_name.format(str(i).zfill(3))
+            self.io_handler.write_array_to_file(working_array, location, self.get_chunk_meta(i))
+            self.io_handler.write_chunk_checkpoint(location, *self.chunk_checkpoints.pop(i))
+        self.io_handler.buffer_pool.release(working_array)
+        return location
+
+    def get_chunk_meta(self, i):
+        """
+        :param i: the index of a chunk
+        :return: the metadata of the temporary file of the chunk: the configuration, the position of the chunk in the
+            output and the shape of the output, so the files can be reassembled without the chunk layout
+        """
+        return dict(self.configuration, chunk_offset=list(self.output_offsets[i]), output_shape=list(self.output_shape))
+
+    def merge_chunks(self, locations):
+        """
+        if the last process reconciles the chunks after they are computed (e.g. ConnectedComponents), merges the
+        summaries of all chunks and rewrites every saved chunk with the reconciled result
+        :param locations: the files the computed chunks were saved to, ordered by chunk index
+        """
+        process = self.handler.processes[-1]
+        if not process.merges_chunks:
+            return
+
+        self.logger.log_started(f"merging chunks for {process.name}")
+        process.merge_chunk_summaries([self.chunk_summaries[i] for i in range(len(self.chunks))])
+        for i, location in enumerate(locations):
+            if self.direct_write:
+                start = self.output_offsets[i][0]
+                end = self.output_offsets[i + 1][0] if i + 1 < len(self.chunks) else self.output_shape[0]
+                working_array = self.io_handler.load_array_from_file(location, 1, start, end)
+                self.io_handler.write_array_to_slab(process.relabel_chunk(i, working_array), location,
+                                                    self.output_offsets[i])
+            else:
+                working_array = self.io_handler.load_array_from_file(location, 1)
+                self.io_handler.write_array_to_file(process.relabel_chunk(i, working_array), location,
+                                                    self.get_chunk_meta(i))
+        self.logger.log_completed(f"merging chunks for {process.name}")
+
+    def reassemble_output(self, locations):
+        """
+        reassembles the saved chunks into the complete output. Every chunk is placed at its position in the output
+        layout, unless a process changed the shape of the chunks (e.g. AppendImages), in which case slabs are
+        concatenated along the X-Axis
+        :param locations: the files the computed chunks were saved to, ordered by chunk index
+        :return: the complete output
+        """
+        shapes = [tuple(self.io_handler.get_original_shape(location)) for location in locations]
+        if shapes == self.output_sizes:
+            return self.io_handler.reassemble_chunks(locations, self.output_offsets, self.output_shape)
+        if self.brick_size is not None:
+            self.logger.log_error("the process list changed the shape of the bricks, which can not be reassembled, "
+                                  "remove \"brick_size\" to compute it in slabs")
+        self.logger.log_timestamp("the process list changed the shape of the chunks, concatenating them along the "
+                                  "X-Axis")
+        return self.io_handler.reassemble_chunks(locations)
+
+    def define_output_layout(self):
+        """
+        determines the shape of the complete output and the position of every chunk within it, based on the shape of
+        the input, the computed range and the scale of the images produced by the process list
+        """
+        scale = self.handler.get_output_scale()
+        x_offsets = {}
+        length = 0
+        for x_range, _, _ in self.chunks:
+            if x_range not in x_offsets:
+                x_offsets[x_range] = length
+                length += int(math.ceil((x_range[1] - x_range[0]) / scale))
+        # the starts of bricks along the Y- and Z-Axis are multiples of the rescaling factor
+        self.output_offsets = [(x_offsets[x_range], y_range[0] // scale, z_range[0] // scale)
+                               for x_range, y_range, z_range in self.chunks]
+        self.output_sizes = [tuple(int(math.ceil((end - start) / scale)) for start, end in chunk)
+                             for chunk in self.chunks]
+        self.output_shape = (length,
+                             int(math.ceil(self.input_shape_unscaled[1] / scale)),
+                             int(math.ceil(self.input_shape_unscaled[2] / scale)))
+        # chunks of the output dataset must not be shared by two slabs, so a slab never rewrites a compressed chunk
+        self.io_handler.slab_alignment = int(np.gcd.reduce(list(x_offsets.values())))
 
     def get_attr_by_name(self, key, default=None):
         """
@@ -134,6 +553,28 @@ class JsonInterpreter:
         self.logger.log_error(f'Error during input file reading: required attribute not found ({key})')
 
 
+_worker_interpreter = None
+
+
+def _init_worker(interpreter):
+    """
+    stores the JsonInterpreter of the main process in a worker process of the chunk pool
+    """
+    global _worker_interpreter
+    _worker_interpreter = interpreter
+    _worker_interpreter.io_handler.close_files()  # handles opened before the fork must not be shared
+
+
+def _execute_chunk_in_worker(i):
+    location = _worker_interpreter.execute_chunk(i)
+    return location, _worker_interpreter.chunk_summaries.get(i)
+
+
+def _compute_chunk_in_worker(i):
+    working_array = _worker_interpreter.compute_chunk(i)
+    return working_array, _worker_interpreter.chunk_summaries.get(i)
+
+
 def define_chunks(start, end, chunksize):
     """
     define start and end indexes of chunks of a given size between two integers
@@ -152,7 +593,35 @@ def define_chunks(start, end, chunksize):
     return result
 
 
+def define_bricks(box, brick_size, rescaling_factor):
+    """
+    cuts a box into bricks along all three axes
+    :param box: start and end indices along every axis of the range to be cut
+    :param brick_size: the size of the bricks along every axis, or a single size for all axes
+    :param rescaling_factor: the rescaling factor of the run, which all brick sizes are rounded up to a multiple of,
+        so every brick starts on the sampling grid of the downscaled image
+    :return: a list of the boxes of all bricks, ordered along the X-Axis first
+    """
+    if isinstance(brick_size, int):
+        brick_size = [brick_size] * 3
+    sizes = [int(math.ceil(size / rescaling_factor)) * rescaling_factor for size in brick_size]
+    ranges = [define_chunks(start, end, size) for (start, end), size in zip(box, sizes)]
+    return list(itertools.product(*ranges))
+
+
+def describe_box(box):
+    """
+    :return: a description of a box for the log
+    """
+    return ', '.join(f"{axis} {start} to {end}" for axis, (start, end) in zip('XYZ', box))
+
+
 if __name__ == '__main__':
     foo = JsonInterpreter()
-    foo.execute()
+    if foo.args.plan:
+        foo.planner.log_plan()
+    elif foo.args.calibrate:
+        foo.calibrate()
+    else:
+        foo.execute()
 
@@ -1,10 +1,17 @@
+from collections import OrderedDict
 from datetime import datetime
+import math
+import threading
 import SimpleITK as sitk
 import h5py
 import numpy as np
 import vtk
 import os
 
+from buffer_pool import BufferPool
+import storage
+from tracer import Tracer
+
 
 class IOHandler:
     """
@@ -15,12 +22,52 @@ class IOHandler:
             This list needs to be expanded to allow the reading of datasets wit different identifiers.
         logger (Logger): encapsulates the output of basic user information during computation
         no_confirm (bool): if true, all user input queries will be skipped, and their default option will be applied
+        downsampling (str): the default method used to downscale images while loading them. 'decimate' takes every
+            n-th value along all axes, 'mean', 'max' and 'min' reduce every block of n*n*n values. Defaults to
+            'decimate'.
+        read_block_bytes (int): the approximate amount of data read from disk at once while downscaling
+        storage_options (dict): overrides the storage layout of written datasets. Valid keys are 'chunks' (the chunk
+            shape, or 'auto'), 'compression' ('gzip', 'lzf' or None), 'compression_level' and 'shuffle'. Options that
+            are not defined are chosen depending on whether the image is binary (see get_dataset_options)
+        slab_alignment (int): a number of slices that the chunks of written datasets should evenly divide, so that
+            slabs written separately never share a chunk. Defaults to 0 (no alignment).
+        use_pyramids (bool): if True, downscaled images are read from a matching level of the file's pyramid (see
+            build_pyramid), if one exists. Defaults to True.
+        open_files (dict): files opened for reading during the run, by location. Files stay open until they are
+            written to or close_files is called
+        datasets (dict): the valid dataset found in each of the open files, by location
+        shapes (dict): the shape of the valid dataset of every file read during the run, by location
+        slab_cache (OrderedDict): recently loaded sections of secondary images (e.g. masks), in order of their last use
+        slab_cache_bytes (int): the maximum size of all sections in the slab cache. Defaults to 1 GiB.
+        file_lock (threading.RLock): guards the open files, datasets, shapes and the slab cache, which are used by the
+            reader and writer threads of a pipelined run as well
+        buffer_pool (BufferPool): provides the arrays chunks are read into, so chunks of the same shape reuse their
+            allocations
+        tracer (Tracer): records the duration and size of every read and write. Disabled by default.
+        storages (dict): an instance of every storage backend (see storage.py), by class. The backend of a file is
+            chosen by its extension.
     """
 
+    downsampling_modes = ['decimate', 'mean', 'max', 'min']
+
     def __init__(self, no_confirm, logger):
         self.valid_dataset_identifiers = ['data', 'original']
         self.logger = logger
         self.no_confirm = no_confirm
+        self.downsampling = 'decimate'
+        self.read_block_bytes = 256 * 2 ** 20
+        self.use_pyramids = True
+        self.storage_options = {}
+        self.slab_alignment = 0
+        self.open_files = {}
+        self.datasets = {}
+        self.shapes = {}
+        self.slab_cache = OrderedDict()
+        self.slab_cache_bytes = 2 ** 30
+        self.file_lock = threading.RLock()
+        self.buffer_pool = BufferPool()
+        self.tracer = Tracer(None, logger)
+        self.storages = {backend: backend(self) for backend in storage.backends}
         if self.no_confirm:
             logger.log_timestamp('noconfirm argument read, skipping all user input queries')
 
@@ -28,26 +75,126 @@ class IOHandler:
         """
         writes a numpy.ndarray to a given directory
         :param out_array: the array to be written to disk
-        :param output_directory: the full directory (including file name and .hdf5)
+        :param output_directory: the full directory (including file name and extension, which chooses the storage
+            backend)
         :param meta: metadata to be added in the output file
         """
         self.logger.log_timestamp(f"writing image of size {out_array.shape} to file: {output_directory}...")
 
-        with h5py.File(output_directory, 'w') as outfile:
-            outfile.create_dataset('data', shape=out_array.shape, data=out_array)
-            meta_grp = outfile.create_group('meta')
-            self.logger.log_timestamp('adding meta info')
-            for k, v in meta.items():
-                if k == 'processes':
-                    v = str(v)
-                meta_grp.attrs[k] = v
+        self.release_file(output_directory)
+        with self.tracer.span('io', 'write', file=os.path.basename(output_directory), voxels=out_array.size,
+                              bytes_written=out_array.nbytes):
+            self.get_storage(output_directory).write(output_directory, out_array, meta)
         self.logger.log_completed("image saving")
 
+    def write_chunk_checkpoint(self, location, signature, checkpoint):
+        """
+        marks a saved chunk as complete. The marker is written after the chunk itself, so a chunk interrupted while it
+        was saved is never taken for complete.
+        :param location: the file the chunk was saved to
+        :param signature: a hash of everything the chunk depends on
+        :param checkpoint: the state the processes pass on to the following chunks, as a dict of dicts of arrays by
+            process index
+        """
+        self.release_file(location)
+        self.get_storage(location).write_checkpoint(location, signature, checkpoint)
+
+    def read_meta(self, filename):
+        """
+        :param filename: a file written by write_array_to_file or create_output_file
+        :return: the metadata stored with the image, as a dict. Empty if the file has no metadata.
+        """
+        self.release_file(filename)
+        return self.get_storage(filename).read_meta(filename)
+
+    def read_chunk_checkpoint(self, location, signatures):
+        """
+        :param location: the file a chunk was saved to
+        :param signatures: the hashes a complete chunk may carry to be valid
+        :return: the state saved with the chunk (see write_chunk_checkpoint), or None if the file does not contain a
+            complete chunk with one of the signatures
+        """
+        if not os.path.isfile(location):
+            return None
+        self.release_file(location)
+        return self.get_storage(location).read_checkpoint(location, signatures)
+
+    def create_output_file(self, output_directory, shape, dtype, meta, binary=False):
+        """
+        creates a file containing an empty dataset of its final shape, that can be filled slab by slab
+        :param output_directory: the full directory (including file name and extension)
+        :param shape: the shape of the complete image
+        :param dtype: the data type of the image
+        :param meta: metadata to be added in the output file
+        :param binary: True if the image is expected to contain only two values, used to choose the storage layout
+        """
+        self.logger.log_timestamp(f"creating output of size {shape} in file: {output_directory}")
+        self.release_file(output_directory)
+        self.get_storage(output_directory).create(output_directory, shape, dtype, meta, binary)
+
+    def get_dataset_options(self, shape, dtype, binary):
+        """
+        determines the storage layout of a dataset. Datasets are chunked in slabs of whole Y-Z tiles of about 1 MiB,
+        so reading a range along the X-Axis only touches the chunks it needs. Binary images are compressed, as they
+        mostly consist of zeros, grayscale images are not compressed by default. All options can be overridden with
+        storage_options.
+        :param shape: the shape of the dataset
+        :param dtype: the data type of the dataset
+        :param binary: True if the image contains only two values
+        :return: a dict of keyword arguments for h5py.Group.create_dataset
+        """
+        itemsize = np.dtype(dtype).itemsize
+        tile = (min(256, shape[1]), min(256, shape[2]))
+        depth = max(1, 2 ** 20 // (tile[0] * tile[1] * itemsize))
+        if self.slab_alignment:
+            depth = math.gcd(depth, self.slab_alignment)
+        chunks = self.storage_options.get('chunks', 'auto')
+        if chunks == 'auto':
+            chunks = (max(1, min(depth, shape[0])),) + tile
+        elif chunks is not None:
+            chunks = tuple(min(c, s) for c, s in zip(chunks, shape))
+
+        compression = self.storage_options.get('compression', 'gzip' if binary else None)
+        options = {'chunks': chunks, 'compression': compression}
+        if compression == 'gzip':
+            options['compression_opts'] = self.storage_options.get('compression_level', 4)
+        if compression is not None:
+            options['shuffle'] = self.storage_options.get('shuffle', itemsize > 1)
+        if 0 in shape:
+            options['chunks'] = None  # empty datasets can not be chunked
+        return options
+
+    def is_binary(self, in_array):
+        """
+        :return: True if the array contains no values other than 0 and its maximum
+        """
+        if in_array.size == 0 or in_array.dtype == bool:
+            return True
+        maximum = in_array.max()
+        return not np.any((in_array != 0) & (in_array != maximum))
+
+    def write_array_to_slab(self, out_array, output_directory, offset):
+        """
+        writes a numpy.ndarray into a section of the dataset of an existing file
+        :param out_array: the array to be written to disk
+        :param output_directory: a file created by create_output_file
+        :param offset: the indices (x, y, z) of the dataset, at which the first voxel of the array is written
+        """
+        self.logger.log_timestamp(f"writing image of size {out_array.shape} at index {offset} to: {output_directory}")
+        self.release_file(output_directory)
+        with self.tracer.span('io', 'write', file=os.path.basename(output_directory), voxels=out_array.size,
+                              bytes_written=out_array.nbytes), \
+                self.get_storage(output_directory).open_for_writing(output_directory) as data:
+            if any(o + length > size for o, length, size in zip(offset, out_array.shape, data.shape)):
+                self.logger.log_error(f"image of size {out_array.shape} does not fit into the output of size "
+                                      f"{data.shape} at index {offset}")
+            data[tuple(slice(o, o + length) for o, length in zip(offset, out_array.shape))] = out_array
+
     def write_to_file(self, image, output_directory, meta):
-        self.write_array_to_file(sitk.GetArrayFromImage(image), output_directory, meta)
+        self.write_array_to_file(sitk.GetArrayViewFromImage(image), output_directory, meta)
 
     def show_3D_image(self, image):
-        self.show_3D_array(sitk.GetArrayFromImage(image))
+        self.show_3D_array(sitk.GetArrayViewFromImage(image))
 
     def show_3D_array(self, in_array):
         """
@@ -123,42 +270,339 @@ class IOHandler:
         interactor.Initialize()
         interactor.Start()
 
-    def load_array_from_file(self, filename, rescaling_factor, start_index=0, end_index=None):
+    def load_array_from_file(self, filename, rescaling_factor, start_index=0, end_index=None, downsampling=None,
+                             pooled=False, window=None):
         """
         returns a numpy.ndarray that represents a file given by directory
         :param filename: the directory to be read from
-        :param rescaling_factor: the amount of downscaling to be applied to the original image (taking every n-th
-            value along all axes
+        :param rescaling_factor: the amount of downscaling to be applied to the original image
         :param start_index: start index of the image segment to be read
         :param end_index: end index of the image segment to be read
+        :param downsampling: the method used for downscaling (see downsampling_modes). Defaults to self.downsampling
+        :param pooled: if True, the segment is read into an array of the buffer pool, which should be released to the
+            pool once it is no longer needed
+        :param window: the start and end indices along the Y- and Z-Axis of the segment, as ((start, end), (start,
+            end)) before scaling. Starts need to be multiples of the rescaling factor. Defaults to whole slices.
         :return: numpy array representing the image segment
         """
         self.logger.log_timestamp(f'loading image data at index {start_index} to {end_index} from file: {filename}')
-        with h5py.File(filename, 'r') as infile:
-            data = None
-            for identifier in self.valid_dataset_identifiers:  # search for valid keys in the file indicating a dataset
-                if identifier in infile.keys():
-                    data = infile[identifier]
-                    break
-            if not data:
-                self.logger.log_error(f'unable to extract data from input file: {filename}')
+        with self.tracer.span('io', 'read', file=os.path.basename(filename)) as record:
+            data = self.get_dataset(filename)
+            start, end, _ = slice(start_index, end_index).indices(data.shape[0])
+            window = self.clamp_window(data.shape, window)
+            slice_bytes = math.prod(e - s for s, e in window) * data.dtype.itemsize
 
             # load the desired section from the dataframe
             if rescaling_factor != 1:
-                image = data[start_index:end_index:rescaling_factor, ::rescaling_factor, ::rescaling_factor]
-                self.logger.log_timestamp(f"rescaling input by a factor of {rescaling_factor}.")
+                downsampling = downsampling or self.downsampling
+                level = self.find_pyramid_level(filename, rescaling_factor, start, end, downsampling, window)
+                if level is not None:
+                    self.logger.log_timestamp(f"reading input downscaled by a factor of {rescaling_factor} "
+                                              f"({downsampling}) from: {self.get_pyramid_name(filename)}")
+                    pyramid = self.get_file(self.get_pyramid_name(filename))
+                    scaled_window = tuple((s // rescaling_factor, -(-e // rescaling_factor)) for s, e in window)
+                    image = self.read_section(pyramid[level], start // rescaling_factor, -(-end // rescaling_factor),
+                                              pooled, scaled_window)
+                    record['bytes_read'] = image.nbytes
+                else:
+                    self.logger.log_timestamp(f"rescaling input by a factor of {rescaling_factor} ({downsampling}).")
+                    image = self.downsample_dataset(data, rescaling_factor, start, end, downsampling, pooled, window)
+                    step = rescaling_factor if downsampling == 'decimate' else 1
+                    record['bytes_read'] = len(range(start, end, step)) * slice_bytes
             else:
-                image = data[start_index:end_index]
-            self.logger.log_timestamp(f"finished loading from file. resulting image size: {image.shape}")
+                image = self.read_section(data, start, end, pooled, window)
+                record['bytes_read'] = image.nbytes
+            record['voxels'] = image.size
+        self.logger.log_timestamp(f"finished loading from file. resulting image size: {image.shape}")
+        return image
+
+    def load_cached_array(self, filename, rescaling_factor, start_index=0, end_index=None, window=None):
+        """
+        like load_array_from_file, but keeps the loaded section in the slab cache, so secondary images that are read
+        more than once per chunk are only read from disk once. The returned array must not be modified.
+        """
+        window = tuple(tuple(axis) for axis in window) if window is not None else None
+        key = (filename, rescaling_factor, start_index, end_index, self.downsampling, window)
+        with self.file_lock:
+            if key in self.slab_cache:
+                self.slab_cache.move_to_end(key)
+                self.logger.log_timestamp(f'using cached image data at index {start_index} to {end_index} of: '
+                                          f'{filename}')
+                return self.slab_cache[key]
+
+        image = self.load_array_from_file(filename, rescaling_factor, start_index, end_index, window=window)
+        if image.nbytes <= self.slab_cache_bytes:
+            image.flags.writeable = False
+            with self.file_lock:
+                self.slab_cache[key] = image
+                cache_size = sum(cached.nbytes for cached in self.slab_cache.values())
+                while cache_size > self.slab_cache_bytes:  # evict the least recently used sections
+                    _, evicted = self.slab_cache.popitem(last=False)
+                    cache_size -= evicted.nbytes
         return image
 
-    def load_from_file(self, filename, scale, start_index=None, end_index=None):
-        return sitk.GetImageFromArray(self.load_array_from_file(filename, scale, start_index, end_index))
+    def read_section(self, data, start, end, pooled, window=None):
+        """
+        reads the slices start to end of a dataset (within a window along the Y- and Z-Axis, if defined), directly into
+        an array of the buffer pool if pooled is True. Sections of memory-mapped datasets that are not pooled are
+        read-only views of the map.
+        """
+        window = self.clamp_window(data.shape, window)
+        selection = (slice(start, end),) + tuple(slice(s, e) for s, e in window)
+        if not pooled:
+            return data[selection]
+        image = self.buffer_pool.acquire((max(0, end - start),) + tuple(e - s for s, e in window), data.dtype)
+        if not image.size:
+            return image
+        if isinstance(data, np.ndarray):  # memory-mapped, the slices are copied from the page cache
+            np.copyto(image, data[selection])
+        else:
+            data.read_direct(image, selection)
+        return image
+
+    def clamp_window(self, shape, window):
+        """
+        :param shape: the shape of a dataset
+        :param window: the start and end indices along the Y- and Z-Axis, or None for whole slices
+        :return: the window limited to the dataset, as a tuple of (start, end) along the Y- and Z-Axis
+        """
+        if window is None:
+            return (0, shape[1]), (0, shape[2])
+        return tuple(slice(s, e).indices(length)[:2] for (s, e), length in zip(window, shape[1:]))
+
+    def get_file(self, filename):
+        """
+        returns a file opened for reading, which stays open for following reads
+        """
+        with self.file_lock:
+            if filename not in self.open_files:
+                self.open_files[filename] = self.get_storage(filename).open(filename)
+            return self.open_files[filename]
+
+    def get_dataset(self, filename):
+        """
+        returns the valid dataset of a file opened for reading
+        """
+        with self.file_lock:
+            if filename not in self.datasets:
+                self.datasets[filename] = self.get_storage(filename).get_dataset(self.get_file(filename), filename)
+                self.shapes[filename] = self.datasets[filename].shape
+            return self.datasets[filename]
+
+    def release_file(self, filename):
+        """
+        closes a file opened for reading and discards all cached information about it, before it is written to
+        """
+        with self.file_lock:
+            self.datasets.pop(filename, None)
+            self.shapes.pop(filename, None)
+            for key in [key for key in self.slab_cache if key[0] == filename]:
+                del self.slab_cache[key]
+            infile = self.open_files.pop(filename, None)
+            if infile is not None:
+                self.get_storage(filename).close(infile)
+
+    def get_storage(self, filename):
+        """
+        :return: the storage backend reading and writing a file, chosen by its extension (see storage.py)
+        """
+        return self.storages[storage.get_storage_class(filename)]
+
+    def close_files(self):
+        """
+        closes all files opened for reading and empties the slab cache and the buffer pool
+        """
+        with self.file_lock:
+            for filename in list(self.open_files):
+                self.release_file(filename)
+            self.slab_cache.clear()
+        self.buffer_pool.clear()
+
+    def set_downsampling(self, mode):
+        if mode not in self.downsampling_modes:
+            self.logger.log_error(f"unknown downsampling mode {mode}, valid modes are: {self.downsampling_modes}")
+        self.downsampling = mode
+
+    def downsample_dataset(self, data, rescaling_factor, start_index, end_index, mode, pooled=False, window=None):
+        """
+        reads a section of a dataset in large blocks of whole slices and downscales every block in memory, which is
+        much faster than letting h5py select every n-th value from the file
+        :param data: the dataset to be read from
+        :param rescaling_factor: the amount of downscaling
+        :param start_index: start index of the section along the X-Axis
+        :param end_index: end index of the section along the X-Axis
+        :param mode: the method used for downscaling (see downsampling_modes)
+        :param pooled: if True, the section is written to an array of the buffer pool
+        :param window: the start and end indices along the Y- and Z-Axis of the section, with starts that are multiples
+            of the rescaling factor. Defaults to whole slices.
+        :return: numpy array representing the downscaled section
+        """
+        start, end, _ = slice(start_index, end_index).indices(data.shape[0])
+        window = self.clamp_window(data.shape, window)
+        area = tuple(slice(s, e) for s, e in window)
+        out_shape = (len(range(start, end, rescaling_factor)),) \
+            + tuple(int(math.ceil((e - s) / rescaling_factor)) for s, e in window)
+        out_array = self.buffer_pool.acquire(out_shape, data.dtype) if pooled else np.empty(out_shape, dtype=data.dtype)
+
+        slice_bytes = max(1, math.prod(e - s for s, e in window) * data.dtype.itemsize)
+        block_size = max(1, self.read_block_bytes // (slice_bytes * rescaling_factor)) * rescaling_factor
+        for block_start in range(start, end, block_size):
+            block_end = min(block_start + block_size, end)
+            offset = (block_start - start) // rescaling_factor
+            if mode == 'decimate':
+                # only every n-th slice is needed, each of them is still read as a contiguous block
+                block = data[(slice(block_start, block_end, rescaling_factor),) + area]
+                reduced = block[:, ::rescaling_factor, ::rescaling_factor]
+            else:
+                reduced = self.reduce_blocks(data[(slice(block_start, block_end),) + area], rescaling_factor, mode)
+            out_array[offset:offset + reduced.shape[0]] = reduced
+        return out_array
+
+    def reduce_blocks(self, in_array, rescaling_factor, mode):
+        """
+        reduces every block of n*n*n values of an array to a single value. Blocks at the end of an axis may be smaller.
+        :param in_array: the array to be reduced
+        :param rescaling_factor: the edge length n of the blocks
+        :param mode: 'mean', 'max' or 'min'
+        :return: the reduced array, with the same data type as the input
+        """
+        reduction = {'mean': np.add, 'max': np.maximum, 'min': np.minimum}[mode]
+        result = in_array
+        counts = []
+        for axis in range(3):
+            indices = np.arange(0, result.shape[axis], rescaling_factor)
+            counts.append(np.diff(np.append(indices, result.shape[axis])))
+            if mode == 'mean':
+                result = reduction.reduceat(result, indices, axis=axis, dtype=np.float64)
+            else:
+                result = reduction.reduceat(result, indices, axis=axis)
+
+        if mode != 'mean':
+            return result
+        result /= counts[0][:, None, None] * counts[1][None, :, None] * counts[2][None, None, :]
+        if np.issubdtype(in_array.dtype, np.integer):
+            result = np.rint(result)
+        return result.astype(in_array.dtype)
 
-    def reassemble_chunks(self, files):
+    def get_pyramid_name(self, filename):
+        if self.get_storage(filename) is not self.storages[storage.Hdf5Storage]:
+            return f"{filename}.pyramid.hdf5"  # keeps the pyramids of an image stored in several formats apart
+        return f"{os.path.splitext(filename)[0]}.pyramid.hdf5"
+
+    def get_file_identity(self, filename):
+        """
+        describes a file by its location, size and modification time, to recognize data derived from an outdated file
+        :return: a dict of the attributes identifying the file
         """
-        reassembles a list of files along their x-Axis into a complete image
-        :param files: a list of file locations to be concatenated. All files must have an equal shape along ther Y- and Z-Axes
+        stat = os.stat(filename)
+        return {'source': os.path.realpath(filename), 'source_size': stat.st_size, 'source_mtime': stat.st_mtime_ns}
+
+    def get_pyramid_level_name(self, rescaling_factor, downsampling):
+        return f"level_{rescaling_factor}_{downsampling}"
+
+    def find_pyramid_level(self, filename, rescaling_factor, start_index, end_index, downsampling, window=None):
+        """
+        searches the pyramid of a file for a level that can serve a downscaled read
+        :param filename: the file to be read from
+        :param rescaling_factor: the amount of downscaling
+        :param start_index: start index of the section to be read, needs to be a multiple of the rescaling factor
+        :param end_index: end index of the section to be read. Unless the values are decimated, it needs to be a
+            multiple of the rescaling factor as well, or the end of the dataset
+        :param downsampling: the method used for downscaling
+        :param window: the start and end indices along the Y- and Z-Axis of the section, which need to meet the same
+            conditions. Defaults to whole slices.
+        :return: the name of the dataset within the pyramid file, or None if no valid level exists
+        """
+        pyramid_name = self.get_pyramid_name(filename)
+        if not self.use_pyramids or not os.path.isfile(pyramid_name):
+            return None
+        shape = self.get_original_shape(filename)
+        ranges = [(start_index, end_index)] + list(self.clamp_window(shape, window))
+        for (start, end), length in zip(ranges, shape):
+            if start % rescaling_factor != 0:
+                return None
+            if downsampling != 'decimate' and end % rescaling_factor != 0 and end != length:
+                return None
+
+        level = self.get_pyramid_level_name(rescaling_factor, downsampling)
+        pyramid = self.get_file(pyramid_name)
+        if level not in pyramid.keys():
+            return None
+        for k, v in self.get_file_identity(filename).items():
+            if pyramid.attrs.get(k) != v:
+                self.logger.log_warning(f"ignoring outdated pyramid: {pyramid_name}")
+                return None
+        return level
+
+    def build_pyramid(self, filename, factors, downsampling=None):
+        """
+        stores downscaled versions of a file in a pyramid file next to it, which load_array_from_file will read
+        downscaled sections from. The file is read once, in blocks of whole slices.
+        :param filename: the file to be downscaled
+        :param factors: the rescaling factors of the levels to be stored
+        :param downsampling: the method used for downscaling. Defaults to self.downsampling
+        """
+        downsampling = downsampling or self.downsampling
+        pyramid_name = self.get_pyramid_name(filename)
+        identity = self.get_file_identity(filename)
+        mode = 'w'
+        self.release_file(pyramid_name)
+        if os.path.isfile(pyramid_name):  # keep existing levels if they were built from the same file
+            with h5py.File(pyramid_name, 'r') as pyramid:
+                if all(pyramid.attrs.get(k) == v for k, v in identity.items()):
+                    mode = 'a'
+
+        self.logger.log_started(f"building pyramid levels {factors} ({downsampling}) of {filename}")
+        with h5py.File(pyramid_name, mode) as pyramid:
+            data = self.get_dataset(filename)
+            pyramid.attrs.update(identity)
+            levels = {}
+            for factor in factors:
+                name = self.get_pyramid_level_name(factor, downsampling)
+                if name in pyramid.keys():
+                    del pyramid[name]
+                shape = tuple(int(math.ceil(length / factor)) for length in data.shape)
+                levels[factor] = pyramid.create_dataset(name, shape=shape, dtype=data.dtype)
+
+            # every block needs to start at a multiple of all factors, so its reduced blocks line up with every level
+            alignment = int(np.lcm.reduce(list(factors)))
+            slice_bytes = data.shape[1] * data.shape[2] * data.dtype.itemsize
+            block_size = max(1, self.read_block_bytes // (slice_bytes * alignment)) * alignment
+            for block_start in range(0, data.shape[0], block_size):
+                self.logger.log_timestamp(f"downscaling slices {block_start} to {block_start + block_size}")
+                block = data[block_start:block_start + block_size]
+                for factor, level in levels.items():
+                    if downsampling == 'decimate':
+                        reduced = block[::factor, ::factor, ::factor]
+                    else:
+                        reduced = self.reduce_blocks(block, factor, downsampling)
+                    offset = block_start // factor
+                    level[offset:offset + reduced.shape[0]] = reduced
+        self.logger.log_completed(f"building pyramid of {filename}")
+
+    def find_dataset(self, infile, filename):
+        """
+        searches an open .hdf5 file for a dataset with one of the valid identifiers
+        :param infile: the open h5py.File
+        :param filename: the location of the file, for error reporting
+        :return: the dataset
+        """
+        for identifier in self.valid_dataset_identifiers:
+            if identifier in infile.keys():
+                return infile[identifier]
+        self.logger.log_error(f'unable to extract data from input file: {filename}')
+
+    def load_from_file(self, filename, scale, start_index=None, end_index=None, window=None):
+        return sitk.GetImageFromArray(self.load_cached_array(filename, scale, start_index, end_index, window))
+
+    def reassemble_chunks(self, files, offsets=None, shape=None):
+        """
+        reassembles a list of files into a complete image
+        :param files: a list of file locations to be assembled
+        :param offsets: the indices (x, y, z) within the complete image of the first voxel of every file. Defaults to
+            concatenating the files along their X-Axis, which requires all files to have an equal shape along their Y-
+            and Z-Axes
+        :param shape: the shape of the complete image. Required if offsets are defined.
         :return: a complete image containing all files from the input
         """
         self.logger.log_timestamp(f"beginning chunk reassembly from:\n {files}\n")
@@ -166,26 +610,52 @@ class IOHandler:
         if len(files) == 0:
             self.logger.log_error("no temporary files found")
 
-        result = None
-        for image_dir in files:
+        shapes = [self.get_original_shape(image_dir) for image_dir in files]
+        if offsets is None:
+            if any(file_shape[1:] != shapes[0][1:] for file_shape in shapes):
+                self.logger.log_error(f"cannot concatenate chunks of different shapes along the Y- and Z-Axes: {shapes}")
+            offsets, length = [], 0
+            for file_shape in shapes:
+                offsets.append((length, 0, 0))
+                length += file_shape[0]
+            shape = (length,) + tuple(shapes[0][1:])
+
+        # the image is allocated once and every file is read into its section
+        result = np.empty(shape, dtype=self.get_dataset(files[0]).dtype)
+        for image_dir, offset, file_shape in zip(files, offsets, shapes):
             self.logger.log_timestamp(f"processing: {image_dir}")
-            current_image_data = self.load_array_from_file(image_dir, 1)
-            if result is None:
-                result = current_image_data
-            else:
-                result = np.concatenate((result, current_image_data), axis=0)
+            result[tuple(slice(o, o + length) for o, length in zip(offset, file_shape))] = \
+                self.load_array_from_file(image_dir, 1)
+            self.release_file(image_dir)
 
         self.logger.log_timestamp(f"Assembly finished, resulting image size: {result.shape}")
         return result
 
-    def define_out_name(self, directory, name):
-        output_directory = "{}{}.hdf5".format(directory, name)
+    def define_out_name(self, directory, name, extension='.hdf5'):
+        output_directory = "{}{}{}".format(directory, name, extension)
         if os.path.isfile(output_directory):
             self.logger.log_timestamp('output file already exists, adding unique identifier...')
             unique = datetime.now().strftime("_%Y-%m-%d_%H-%M-%S")
-            output_directory = "{}{}{}.hdf5".format(directory, name, unique)
+            output_directory = "{}{}{}{}".format(directory, name, unique, extension)
         return output_directory
 
+    def get_format_extension(self, storage_format):
+        """
+        :param storage_format: the name of a storage format, one of storage.formats
+        :return: the file extension of the format
+        """
+        if storage_format not in storage.formats:
+            self.logger.log_error(f"unknown storage format {storage_format}, valid formats are: "
+                                  f"{list(storage.formats)}")
+        return storage.formats[storage_format]
+
+    def delete_file(self, filename):
+        """
+        deletes a file, including all files its storage backend keeps next to it
+        """
+        self.release_file(filename)
+        self.get_storage(filename).delete(filename)
+
     def askyesno(self, question, default):
         """
         displays a yes/no user promt in console and returns its result
@@ -221,9 +691,7 @@ class IOHandler:
         :param filename: the file to be analyzed
         :return: the shape (x, y, z) of the files main dataset
         """
-        with h5py.File(filename, 'r') as infile:
-            for identifier in self.valid_dataset_identifiers:
-                if identifier in infile.keys():
-                    return infile[identifier].shape
-        self.logger.log_error('unable to extract data shape from file')
-
+        with self.file_lock:
+            if filename not in self.shapes:
+                self.get_dataset(filename)
+            return self.shapes[filename]
@@ -2,6 +2,7 @@ import argparse
 
 import io_utils
 from logger import Logger
+from preview import PreviewRenderer
 
 if __name__ == "__main__":
     handler = io_utils.IOHandler(False, Logger())
@@ -19,8 +20,29 @@ if __name__ == "__main__":
     parser.add_argument('--s', '--scale', type=int, default=1, help='The downscaling to be applied to the image before'
                                                                     'it is being displayed')
 
+    parser.add_argument('--m', '--mode', default='decimate', choices=handler.downsampling_modes,
+                        help='the method used for downscaling: taking every n-th value (decimate), or reducing blocks '
+                             'of n*n*n values to their mean, max or min')
+
+    parser.add_argument('--preview', default=None,
+                        help='a directory to write projections and slices to as .png files instead of displaying the '
+                             'image. The file is read in slabs, so no display and little memory is needed')
+    parser.add_argument('--xs', type=int, nargs='*', default=None, help='the slices along the X-Axis to be '
+                                                                        'written by --preview')
+    parser.add_argument('--ys', type=int, nargs='*', default=None, help='the slices along the Y-Axis to be '
+                                                                        'written by --preview')
+    parser.add_argument('--zs', type=int, nargs='*', default=None, help='the slices along the Z-Axis to be '
+                                                                        'written by --preview')
+
     args = parser.parse_args()
 
-    image = handler.load_array_from_file(args.infile, args.s, args.si, args.ei)
+    if args.preview is not None:
+        handler.set_downsampling(args.m)
+        slices = None
+        if args.xs is not None or args.ys is not None or args.zs is not None:
+            slices = {'x': args.xs or [], 'y': args.ys or [], 'z': args.zs or []}
+        PreviewRenderer(handler, handler.logger).render(args.infile, args.preview, args.si, args.ei, args.s, slices)
+    else:
+        image = handler.load_array_from_file(args.infile, args.s, args.si, args.ei, args.m)
 
-    handler.show_3D_array(image)
+        handler.show_3D_array(image)
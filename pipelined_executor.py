@@ -0,0 +1,77 @@
+import queue
+import threading
+
+
+class PipelinedExecutor:
+    """
+    computes the chunks of a JsonInterpreter in order, while a background thread reads the following chunks from disk
+    and another one saves the chunks that have already been computed. The queues between the threads are bounded, so
+    no more than (2 * depth + 1) chunks are held in memory at a time.
+
+    Attributes:
+        interpreter (JsonInterpreter): defines the chunks and provides the methods to load, compute and store them
+        logger (Logger): encapsulates the output of basic user information during computation
+        depth (int): the maximum number of chunks waiting to be computed, and waiting to be saved
+        read_queue (queue.Queue): chunks that have been loaded but not yet computed
+        write_queue (queue.Queue): chunks that have been computed but not yet saved
+        locations (list): the file each chunk was saved to
+        errors (list): exceptions raised in the background threads, to be re-raised by the main thread
+    """
+
+    def __init__(self, interpreter, depth):
+        self.interpreter = interpreter
+        self.logger = interpreter.logger
+        self.depth = depth
+        self.read_queue = queue.Queue(maxsize=depth)
+        self.write_queue = queue.Queue(maxsize=depth)
+        self.locations = [None] * len(interpreter.chunks)
+        self.errors = []
+
+    def execute(self, order):
+        """
+        computes chunks of the interpreter
+        :param order: the indices of the chunks in the order they are to be computed
+        :return: the list of files the computed chunks were saved to, ordered by chunk index
+        """
+        self.logger.log_timestamp(f"computing chunks with background reading and writing (queue depth {self.depth})")
+        reader = threading.Thread(target=self.read_chunks, args=(order,), daemon=True)
+        writer = threading.Thread(target=self.write_chunks, daemon=True)
+        reader.start()
+        writer.start()
+
+        try:
+            for _ in order:
+                i, working_array = self.read_queue.get()
+                if i is None:
+                    break
+                self.write_queue.put((i, self.interpreter.process_chunk(i, working_array)))
+                del working_array
+                if self.errors:
+                    break
+        finally:
+            self.write_queue.put((None, None))
+            writer.join()
+
+        if self.errors:
+            raise self.errors[0]
+        return self.locations
+
+    def read_chunks(self, order):
+        try:
+            for i in order:
+                self.read_queue.put((i, self.interpreter.load_chunk(i)))
+        except BaseException as e:
+            self.errors.append(e)
+            self.read_queue.put((None, None))
+
+    def write_chunks(self):
+        while True:
+            i, working_array = self.write_queue.get()
+            if i is None:
+                return
+            if self.errors:
+                continue  # keep emptying the queue, so the main thread is not blocked
+            try:
+                self.locations[i] = self.interpreter.store_chunk(i, working_array)
+            except BaseException as e:
+                self.errors.append(e)
@@ -0,0 +1,114 @@
+import math
+import os
+
+import numpy as np
+from PIL import Image
+
+
+class PreviewRenderer:
+    """
+    renders a dataset into images without a display: the maximum and mean intensity projections along every axis,
+    and orthogonal slices through chosen indices. The dataset is read slab by slab along the X-Axis, and only the
+    slab and the images themselves are kept in memory, so previews of datasets larger than memory are cheap.
+
+    Attributes:
+        io_handler (IOHandler): used for reading files
+        logger (Logger): encapsulates the output of basic user information during computation
+        slab_bytes (int): the approximate size of the slabs read at a time. Defaults to 256 MiB.
+    """
+
+    axes = ['x', 'y', 'z']
+
+    def __init__(self, io_handler, logger, slab_bytes=256 * 2 ** 20):
+        self.io_handler = io_handler
+        self.logger = logger
+        self.slab_bytes = slab_bytes
+
+    def render(self, filename, directory, start_index=0, end_index=None, rescaling_factor=1, slices=None):
+        """
+        writes the projections and slices of a dataset as .png files named after the dataset
+        :param filename: the file to be rendered
+        :param directory: the directory the images are written to
+        :param start_index: the start index along the X-Axis of the range to be rendered
+        :param end_index: the end index along the X-Axis of the range to be rendered. Defaults to the end of the file.
+        :param rescaling_factor: the downscaling applied while reading
+        :param slices: a dict of lists of indices (in the file, before scaling) by axis ('x', 'y' or 'z') of the
+            slices to be rendered. Defaults to the center slice of every axis.
+        :return: the locations of the images written
+        """
+        shape = self.io_handler.get_original_shape(filename)
+        start, end, _ = slice(start_index, end_index).indices(shape[0])
+        if end <= start or shape[1] == 0 or shape[2] == 0:
+            self.logger.log_error(f"the range {(start, end)} along the X-Axis of {filename} with shape {tuple(shape)} "
+                                  f"is empty, nothing to render")
+        if slices is None:
+            slices = {'x': [(start + end) // 2], 'y': [shape[1] // 2], 'z': [shape[2] // 2]}
+        bounds = {'x': (start, end), 'y': (0, shape[1]), 'z': (0, shape[2])}
+        for axis, indices in slices.items():
+            for index in indices:
+                if not bounds[axis][0] <= index < bounds[axis][1]:
+                    self.logger.log_error(f"slice {index} along the {axis.upper()}-Axis is outside of the rendered "
+                                          f"range {bounds[axis]}")
+        scale = rescaling_factor
+        scaled = (int(math.ceil((end - start) / scale)), int(math.ceil(shape[1] / scale)),
+                  int(math.ceil(shape[2] / scale)))
+
+        dtype = self.io_handler.get_dataset(filename).dtype
+        slice_bytes = scaled[1] * scaled[2] * dtype.itemsize
+        slab = max(1, self.slab_bytes // slice_bytes) * scale
+        self.logger.log_started(f"rendering preview of {filename} in slabs of {slab} slices")
+
+        maximum = {axis: None for axis in self.axes}
+        total = {'x': np.zeros(scaled[1:], dtype=np.float64),
+                 'y': np.zeros((scaled[0], scaled[2]), dtype=np.float64),
+                 'z': np.zeros((scaled[0], scaled[1]), dtype=np.float64)}
+        sections = {(axis, index): None for axis in self.axes for index in slices.get(axis, [])}
+        for slab_start in range(start, end, slab):
+            array = self.io_handler.load_array_from_file(filename, scale, slab_start, min(slab_start + slab, end),
+                                                         pooled=True)
+            rows = slice((slab_start - start) // scale, (slab_start - start) // scale + len(array))
+            if maximum['x'] is None:
+                maximum = {'x': array.max(axis=0), 'y': np.empty((scaled[0], scaled[2]), dtype=array.dtype),
+                           'z': np.empty((scaled[0], scaled[1]), dtype=array.dtype)}
+            else:
+                np.maximum(maximum['x'], array.max(axis=0), out=maximum['x'])
+            maximum['y'][rows] = array.max(axis=1)
+            maximum['z'][rows] = array.max(axis=2)
+            total['x'] += array.sum(axis=0, dtype=np.float64)
+            total['y'][rows] = array.sum(axis=1, dtype=np.float64)
+            total['z'][rows] = array.sum(axis=2, dtype=np.float64)
+            for (axis, index), section in sections.items():
+                if axis == 'x':
+                    if slab_start <= index < slab_start + slab and (index - slab_start) // scale < len(array):
+                        sections[(axis, index)] = array[(index - slab_start) // scale].copy()
+                    continue
+                if section is None:
+                    section = np.zeros((scaled[0], scaled[2] if axis == 'y' else scaled[1]), dtype=array.dtype)
+                    sections[(axis, index)] = section
+                section[rows] = array[:, index // scale, :] if axis == 'y' else array[:, :, index // scale]
+            self.io_handler.buffer_pool.release(array)
+
+        name = os.path.splitext(os.path.basename(filename))[0]
+        images = {f"{name}_max_{axis}": maximum[axis] for axis in self.axes}
+        images.update({f"{name}_mean_{axis}": total[axis] / scaled[self.axes.index(axis)] for axis in self.axes})
+        images.update({f"{name}_slice_{axis}{index}": section for (axis, index), section in sections.items()
+                       if section is not None})
+        os.makedirs(directory, exist_ok=True)
+        locations = []
+        for image_name, image in images.items():
+            location = os.path.join(directory, f"{image_name}.png")
+            Image.fromarray(to_uint8(image)).save(location)
+            locations.append(location)
+        self.logger.log_completed(f"rendering preview, {len(locations)} images written to {directory}")
+        return locations
+
+
+def to_uint8(image):
+    """
+    :param image: a 2D array
+    :return: the array, its values scaled linearly from their minimum and maximum to the range 0 to 255
+    """
+    low, high = float(image.min()), float(image.max())
+    if high <= low:
+        return np.zeros(image.shape, dtype=np.uint8)
+    return ((image - low) * (255 / (high - low))).astype(np.uint8)
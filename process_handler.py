@@ -1,7 +1,10 @@
-import h5py
+import math
+
+import numpy as np
 import SimpleITK as sitk
 
 import processes
+from result_cache import hash_description
 
 
 class ProcessHandler:
@@ -18,35 +21,257 @@ class ProcessHandler:
         current_chunk (int): the index of the current chunk being processed (if chunking is enabled). Used to determine
             the current state by the processes
         current_shape_unscaled ((int, int, int)): the shape of the current chunk (or whole image) before downscaling
-        current_indices (int, int): start and end indexes along the X-Axis of the part of the image currently processed
+        current_indices (tuple): the box of the part of the image currently processed (including the halo, if one is
+            used), as start and end indexes along the X-, Y- and Z-Axis: ((x0, x1), (y0, y1), (z0, z1))
+        core_indices (tuple): the box of the current chunk without its halo
+        halo (int): the number of additional slices (before scaling) read on either side of every chunk along every
+            axis the chunks are cut along, so that processes with a neighbourhood kernel see the same data as they
+            would on the whole image. Defaults to 0.
+        sweep_backward (bool): True while the chunks are computed a second time in reverse order
         io_handler (IOHandler): used for reading and writing files
+        result_cache (ResultCache): stores the intermediate results of the process list, if defined. Defaults to None.
+        stages (list(list)): the processes grouped into the stages they are executed in. Runs of consecutive
+            pointwise processes form a single stage that is executed in one pass over the image.
+        fusion_block_bytes (int): the approximate size of the blocks of slices a fused stage processes at a time
+        thread_scheduler (ThreadScheduler): sets the number of threads of the SimpleITK filters of every stage, if
+            defined. Defaults to None.
     """
 
     def __init__(self, json_interpreter, process_dicts):
         self.json_interpreter = json_interpreter
         self.logger = self.json_interpreter.logger
         self.processes = [self.create_process_from_dict(p) for p in process_dicts]
+        for p in self.processes[:-1]:
+            if p.merges_chunks:
+                self.logger.log_error(f"{p.name} reconciles all chunks after they are computed and needs to be the last "
+                                      f"process")
         self.rescaling_factor = self.json_interpreter.rescaling_factor
         self.current_chunk = 0
         self.current_shape_unscaled = (0, 0, 0)
-        self.current_indices = (0, None)
+        self.current_indices = ((0, None), (0, None), (0, None))
+        self.core_indices = ((0, None), (0, None), (0, None))
+        self.halo = 0
+        self.sweep_backward = False
         self.io_handler = json_interpreter.io_handler
+        self.result_cache = None
+        self.stages = [[i] for i in range(len(self.processes))]
+        self.fusion_block_bytes = 4 * 2 ** 20
+        self.thread_scheduler = None
 
     def execute_process_list(self, in_array, chunking=False):
         """
         applies all processes to a given array, and returns a transformed array
-        :param in_array: the array to be manipulated
+        :param in_array: the array to be manipulated. It is consumed: it may be modified, or returned to the buffer pool
         :param chunking: if True, processes will treat the array as part of a larger image
-        :return: a modified array
+        :return: a modified array, taken from the buffer pool if the last process returned an image
+        """
+        keys = self.get_cache_keys(chunking)
+        first_stage = 0
+        for stage_index in reversed(range(len(self.stages))):  # resume from the longest stored prefix
+            i = self.stages[stage_index][-1]
+            cached = self.result_cache.load(keys[i]) if keys[i] is not None else None
+            if cached is not None:
+                self.logger.log_timestamp(f"resuming from the cached result of the processes up to {self.processes[i].name}")
+                in_array = cached
+                first_stage = stage_index + 1
+                break
+
+        data = in_array
+        tracer = self.io_handler.tracer
+        for stage in self.stages[first_stage:]:
+            stage_processes = [self.processes[i] for i in stage]
+            if self.thread_scheduler is not None:
+                self.thread_scheduler.apply(stage_processes)
+            if len(stage) > 1:
+                with tracer.span('process', ' + '.join(p.name for p in stage_processes), voxels=self.get_size(data)):
+                    data = self.execute_fused_stage(stage_processes, self.get_array(data), chunking)
+            else:
+                p = self.processes[stage[0]]
+                with tracer.span('process', p.name, voxels=self.get_size(data)):
+                    data = p.execute(self.get_image(data), chunking)
+                if p.show_output:
+                    self.io_handler.show_3D_image(data)
+            i = stage[-1]
+            if keys[i] is not None and i < len(self.processes) - 1:
+                self.result_cache.store(keys[i], self.get_array_view(data))
+
+        return self.get_array(data)
+
+    def get_array(self, data):
+        """
+        returns the data as a writeable array. Images are copied into an array of the buffer pool.
+        """
+        if isinstance(data, np.ndarray):
+            return data
+        view = sitk.GetArrayViewFromImage(data)
+        out_array = self.io_handler.buffer_pool.acquire(view.shape, view.dtype)
+        np.copyto(out_array, view)
+        return out_array
+
+    def get_size(self, data):
+        return data.size if isinstance(data, np.ndarray) else math.prod(data.GetSize())
+
+    def get_array_view(self, data):
+        """
+        returns a read-only view of the data, without copying images. The view must not outlive the image.
+        """
+        return data if isinstance(data, np.ndarray) else sitk.GetArrayViewFromImage(data)
+
+    def get_image(self, data):
+        """
+        returns the data as an image. Arrays are copied into a new image and returned to the buffer pool, so the next
+        chunk can be read into them.
+        """
+        if isinstance(data, sitk.Image):
+            return data
+        image = sitk.GetImageFromArray(data)
+        self.io_handler.buffer_pool.release(data)
+        return image
+
+    def define_stages(self, fusion, morphology_fusion=True):
+        """
+        groups the processes into stages. If fusion is enabled, runs of consecutive pointwise processes are combined
+        into a single stage. A process depending on statistics of its entire input always begins a new run. If
+        morphology fusion is enabled, pairs of erosion and dilation are replaced by an opening or closing.
+        :param fusion: if False, every process forms its own stage
+        :param morphology_fusion: if False, pairs of erosion and dilation are computed as they are defined
+        """
+        if morphology_fusion:
+            self.fuse_morphology()
+        self.stages = []
+        for i, p in enumerate(self.processes):
+            fusable = fusion and p.pointwise and not p.show_output
+            previous = self.processes[self.stages[-1][-1]] if self.stages else None
+            if fusable and previous is not None and previous.pointwise and not previous.show_output \
+                    and self.stages[-1][-1] == i - 1 and not p.needs_input_statistics:
+                self.stages[-1].append(i)
+            else:
+                self.stages.append([i])
+
+        for stage in self.stages:
+            if len(stage) > 1:
+                self.logger.log_timestamp(f"fusing pointwise processes: {[self.processes[i].name for i in stage]}")
+
+    def fuse_morphology(self):
+        """
+        replaces every BinaryErosion directly followed by a BinaryDilation with the same parameters by a BinaryOpening,
+        and every BinaryDilation directly followed by a BinaryErosion by a BinaryClosing, which compute the same result
+        in a single pass
+        """
+        pairs = {(processes.BinaryErosion, processes.BinaryDilation): 'BinaryOpening',
+                 (processes.BinaryDilation, processes.BinaryErosion): 'BinaryClosing'}
+        fused = []
+        for p in self.processes:
+            previous = fused[-1] if fused else None
+            fused_type = pairs.get((type(previous), type(p)))
+            if fused_type and not previous.show_output and (previous.radius, previous.foreground, previous.background) \
+                    == (p.radius, p.foreground, p.background):
+                self.logger.log_timestamp(f"fusing {previous.name} and {p.name} into {fused_type}")
+                fused[-1] = self.create_process_from_dict(
+                    {'type': fused_type, 'radius': p.radius, 'foreground': p.foreground, 'background': p.background,
+                     'show_output': p.show_output, 'cache': p.cache, 'threads': p.threads})
+            else:
+                fused.append(p)
+        self.processes = fused
+
+    def execute_fused_stage(self, stage_processes, in_array, chunking):
+        """
+        applies a run of pointwise processes to an array in a single pass: the array is processed in blocks of slices,
+        and every process is applied to a block in place before the next block is processed
+        :param stage_processes: the processes to be applied, in order
+        :param in_array: the array to be manipulated. It will be modified in place, if possible
+        :param chunking: True if the array is part of a larger image
+        :return: the modified array
+        """
+        name = ' + '.join(p.name for p in stage_processes)
+        self.logger.log_started(name)
+        for p in stage_processes:
+            if chunking and not p.chunking_optimized and not p.covered_by_halo():
+                self.logger.log_warning(f"{p.name} is not optimized for chunking, image faults may occur!")
+
+        if not in_array.flags.writeable:
+            in_array = in_array.copy()
+        contexts = [p.prepare_pointwise(in_array) for p in stage_processes]
+
+        block_size = max(1, self.fusion_block_bytes // max(1, in_array[0].nbytes if len(in_array) else 1))
+        for start in range(0, in_array.shape[0], block_size):
+            block_slice = slice(start, start + block_size)
+            block = in_array[block_slice]
+            for p, context in zip(stage_processes, contexts):
+                p.apply_pointwise(block, context, block_slice)
+
+        self.logger.log_completed(name)
+        return in_array
+
+    def get_cache_keys(self, chunking):
+        """
+        computes the address of the result of every prefix of the process list for the current part of the image. It
+        depends on the identity of the input and all other files read, the range read, the scaling and the definitions
+        of all processes up to the end of the prefix.
+        :param chunking: True if the image is part of a larger image
+        :return: a list containing a key for every process, or None where the result is not to be cached
+        """
+        if self.result_cache is None:
+            return [None] * len(self.processes)
+
+        interpreter = self.json_interpreter
+        description = {'input': self.io_handler.get_file_identity(interpreter.input_dir),
+                       'indices': self.current_indices,
+                       'rescaling_factor': self.rescaling_factor,
+                       'downsampling': self.io_handler.downsampling,
+                       'chunking': chunking,
+                       'processes': []}
+        keys = []
+        cacheable = True
+        for p in self.processes:
+            # the state that order-dependent processes pass on to the next chunk can not be restored from the cache
+            cacheable = cacheable and not (chunking and p.order_dependent) and not p.writes_files
+            description['processes'].append({'definition': p.get_definition(),
+                                             'files': [self.io_handler.get_file_identity(f)
+                                                       for f in p.get_referenced_files()]})
+            keys.append(self.result_cache.get_key(description) if cacheable and p.cache else None)
+        return keys
+
+    def get_chunk_signature(self):
+        """
+        :return: a hash of everything the result of the current chunk depends on: the input, the range read and the
+            range kept, the scaling, the pass over the chunks and the definitions of all processes (including the
+            files they read)
+        """
+        return hash_description({'input': self.io_handler.get_file_identity(self.json_interpreter.input_dir),
+                                 'indices': self.current_indices,
+                                 'core_indices': self.core_indices,
+                                 'rescaling_factor': self.rescaling_factor,
+                                 'downsampling': self.io_handler.downsampling,
+                                 'sweep_backward': self.sweep_backward,
+                                 'processes': [{'definition': p.get_definition(),
+                                                'files': [self.io_handler.get_file_identity(f)
+                                                          for f in p.get_referenced_files()]}
+                                               for p in self.processes]})
+
+    def get_checkpoint(self):
         """
-        image = sitk.GetImageFromArray(in_array)
-        for i in range(len(self.processes)):
-            p = self.processes[i]
-            image = p.execute(image, chunking)
-            if p.show_output:
-                self.io_handler.show_3D_image(image)
+        :return: the state the order-dependent processes pass on to the following chunks, by process index
+        """
+        return {str(i): p.get_checkpoint() for i, p in enumerate(self.processes) if p.order_dependent}
 
-        return sitk.GetArrayFromImage(image)
+    def restore_checkpoint(self, checkpoint):
+        """
+        restores the state saved with the current chunk by a previous run, as if the chunk had just been computed
+        :param checkpoint: the state as returned by get_checkpoint
+        """
+        for i, state in checkpoint.items():
+            self.processes[int(i)].restore_checkpoint(state)
+
+    def summarize_chunk(self, out_array):
+        """
+        collects the information that processes merging chunks need to reconcile a chunk with its neighbours
+        :param out_array: the computed chunk (without its halo)
+        :return: the summary of the last process if it merges chunks, None otherwise
+        """
+        if self.processes and self.processes[-1].merges_chunks:
+            return self.processes[-1].summarize_chunk(out_array)
+        return None
 
     def create_process_from_dict(self, process_dict):
         """
@@ -62,15 +287,127 @@ class ProcessHandler:
         instance.set_logger(self.logger)
         return instance
 
-    def set_indices(self, start, end, input_location):
-        self.current_indices = (start, end)
-        with h5py.File(input_location, 'r') as infile:
-            data = None
-            for identifier in self.io_handler.valid_dataset_identifiers:
-                if identifier in infile.keys():
-                    data = infile[identifier]
-                    self.current_shape_unscaled = (end-start, data.shape[1], data.shape[2])
-                    break
-            if not data:
-                self.logger.log_error(f'unable to extract data from input file: {input_location}')
+    def configure_halo(self, halo_setting):
+        """
+        defines the halo to be read around every chunk
+        :param halo_setting: True to derive the halo from the kernel reach of all processes, an integer to define the
+            halo (in slices of the unscaled image) explicitly, or False to disable the halo
+        """
+        if halo_setting is True:
+            halo = self.get_total_kernel_reach()
+        elif not halo_setting:
+            halo = 0
+        else:
+            halo = int(halo_setting)
+
+        # the halo needs to be a multiple of the rescaling factor to keep the sampling grid of every chunk intact
+        self.halo = int(math.ceil(halo / self.rescaling_factor)) * self.rescaling_factor
+        if self.halo > 0:
+            self.logger.log_timestamp(f"reading chunks with a halo of {self.halo} slices")
+
+    def get_total_kernel_reach(self):
+        """
+        sums up the kernel reach of all processes, converted to slices of the unscaled image
+        :return: the number of slices on either side of a chunk that influence its result
+        """
+        reach = 0
+        scale = self.rescaling_factor
+        for p in self.processes:
+            process_reach = p.get_kernel_reach()
+            if process_reach is None:
+                self.logger.log_warning(f"{p.name} depends on more than its neighbourhood, "
+                                        f"the halo can not make it chunk-correct")
+                process_reach = 0
+            reach += process_reach * scale
+            if isinstance(p, processes.RescaleToOriginal):
+                scale = 1
+        return reach
+
+    def get_output_scale(self):
+        """
+        :return: the downscaling of the image produced by the process list, relative to the input file
+        """
+        if any(isinstance(p, processes.RescaleToOriginal) for p in self.processes):
+            return 1
+        return self.rescaling_factor
+
+    def set_chunk(self, index, chunk):
+        """
+        prepares the processing of a chunk, extending its box by the halo without leaving the computed range
+        :param index: the index of the chunk within the list of all chunks
+        :param chunk: the box of the chunk (before scaling), as start and end indexes along every axis
+        :return: the box that needs to be read for this chunk
+        """
+        self.current_chunk = index
+        self.core_indices = chunk
+        box = self.get_read_range(chunk)
+        self.set_indices(box)
+        return box
+
+    def get_read_range(self, chunk):
+        interpreter = self.json_interpreter
+        shape = interpreter.input_shape_unscaled
+        bounds = [(interpreter.start_index, interpreter.end_index), (0, shape[1]), (0, shape[2])]
+        return tuple((max(start - self.halo, low), min(end + self.halo, high))
+                     for (start, end), (low, high) in zip(chunk, bounds))
+
+    def crop_halo(self, out_array):
+        """
+        removes the halo from a processed chunk
+        :param out_array: the processed chunk including its halo
+        :return: a view of the array that only contains the core of the chunk
+        """
+        if self.halo == 0:
+            return out_array
+        scale = self.get_output_scale()
+        return out_array[tuple(self.get_core_slice(scale, axis) for axis in range(3))]
+
+    def get_core_slice(self, scale, axis=0):
+        """
+        :param scale: the downscaling of the chunk relative to the input file
+        :param axis: the axis of the range
+        :return: the range of the current chunk along an axis that belongs to its core (without its halo)
+        """
+        lead = (self.core_indices[axis][0] - self.current_indices[axis][0]) // scale
+        length = int(math.ceil((self.core_indices[axis][1] - self.core_indices[axis][0]) / scale))
+        return slice(lead, lead + length)
+
+    def get_scale_before(self, process):
+        """
+        :param process: a process of the process list
+        :return: the downscaling of the image the process is applied to, relative to the input file
+        """
+        preceding = self.processes[:self.processes.index(process)]
+        if any(isinstance(p, processes.RescaleToOriginal) for p in preceding):
+            return 1
+        return self.rescaling_factor
+
+    def get_handoff_index(self, process):
+        """
+        returns the slice of the current chunk that corresponds to the first slice read for the next chunk (or the
+        last slice read for the previous chunk, during the backward sweep). Used by processes that pass their state
+        from one chunk to the next.
+        :param process: the process passing its state on, the index is given at the scale of its input
+        :return: an index along the X-Axis of the current (scaled) chunk
+        """
+        scale = self.get_scale_before(process)
+        chunks = self.json_interpreter.chunks
+        if self.sweep_backward:
+            if self.halo == 0 or self.current_chunk == 0:
+                return 0
+            previous_end = self.get_read_range(chunks[self.current_chunk - 1])[0][1]
+            return (previous_end - 1 - self.current_indices[0][0]) // scale
+
+        if self.halo == 0 or self.current_chunk + 1 >= len(chunks):
+            return -1
+        next_start = self.get_read_range(chunks[self.current_chunk + 1])[0][0]
+        return (next_start - self.current_indices[0][0]) // scale
+
+    def set_indices(self, box):
+        """
+        :param box: the box of the part of the image to be processed (before scaling), as start and end indexes along
+            every axis
+        """
+        self.current_indices = tuple(box)
+        self.current_shape_unscaled = tuple(end - start for start, end in box)
 
@@ -1,8 +1,12 @@
+import math
+import os
 import sys
 
 import SimpleITK as sitk
 import numpy as np
 
+from quantification import SliceQuantifier
+
 
 class Process:
     """
@@ -15,6 +19,25 @@ class Process:
             Defaults to False.
         chunking_optimized (bool, optional): If False, an alert will be printed to the console when a process is
             calculated using chunking. Defaults to True.
+        order_dependent (bool): If True, the result for a chunk depends on the state left by the previous chunk, so
+            chunks have to be computed one after another and in order. Defaults to False.
+        backward_sweep (bool): If True, all chunks are computed a second time in reverse order after the first pass, so
+            an order-dependent process can pass its state from later chunks back to earlier ones. Defaults to False.
+        merges_chunks (bool): If True, the chunks computed by this process are reconciled after all chunks are
+            computed (see summarize_chunk, merge_chunk_summaries and relabel_chunk). Defaults to False.
+        cache (bool, optional): If False, the result of the process list up to this process is never stored in the
+            result cache. Defaults to True.
+        writes_files (bool): If True, the process writes files besides its result, so no result of the process list
+            including it is taken from the result cache. Defaults to False.
+        pointwise (bool): If True, every output voxel only depends on the same voxel of the input (and of secondary
+            images), so consecutive pointwise processes can be fused into a single pass over the image (see
+            prepare_pointwise and apply_pointwise). Defaults to False.
+        needs_input_statistics (bool): If True, the pointwise process depends on statistics of its entire input, so
+            it can only be the first process of a fused pass. Defaults to False.
+        memory_per_voxel (float, optional): the peak memory used by the process in bytes per voxel of its input, e.g.
+            measured from a performance trace. Overrides the estimate used to plan the size of chunks.
+        threads (int, optional): the number of threads used by the SimpleITK filters of the process, limited by the
+            share of the thread budget of its worker. Overrides the number chosen by the ThreadScheduler.
         master (ProcessHandler): a reference this instances creating Processhandler.
         logger (Logger): encapsulates the output of basic user information during computation
     """
@@ -24,6 +47,15 @@ class Process:
         self.name = self.get_attr_by_name('type')  # definition of a required key
         self.show_output = self.get_attr_by_name('show_output', False)  # definition of an optional key
         self.chunking_optimized = chunking_optimized
+        self.order_dependent = False
+        self.backward_sweep = False
+        self.merges_chunks = False
+        self.cache = self.get_attr_by_name('cache', True)
+        self.writes_files = False
+        self.pointwise = False
+        self.needs_input_statistics = False
+        self.memory_per_voxel = self.description.get('memory_per_voxel')
+        self.threads = self.description.get('threads')
         self.master = None
         self.logger = None
 
@@ -43,7 +75,7 @@ class Process:
         """
         self.logger.log_started(self.name)
         if enable_chunking:
-            if not self.chunking_optimized:
+            if not self.chunking_optimized and not self.covered_by_halo():
                 self.logger.log_warning(f"{self.name} is not optimized for chunking, image faults may occur!")
             result = self.calculate_chunk(input_image)
         else:
@@ -55,6 +87,78 @@ class Process:
             self.master.io_handler.show_3D_image(result)
         return result
 
+    def get_kernel_reach(self):
+        """
+        returns the number of neighbouring slices along the X-Axis (in the scale of the working image) that influence a
+        single output slice. Used to determine the halo that is read around every chunk. Processes that depend on the
+        entire image (or on previous chunks) return None, as no finite halo can make them chunk-correct.
+        :return: the reach of this process' kernel, or None if the process is not local
+        """
+        return 0
+
+    def get_definition(self):
+        """
+        :return: the description of the process without the options that only affect how it is executed, not its
+            result
+        """
+        return {key: value for key, value in self.description.items()
+                if key not in ('show_output', 'cache', 'memory_per_voxel', 'threads')}
+
+    def get_checkpoint(self):
+        """
+        returns the state an order-dependent process passes on to the following chunks. It is saved with every chunk,
+        so an interrupted run can be resumed after the last saved chunk (see restore_checkpoint).
+        :return: a dict of arrays
+        """
+        return {}
+
+    def restore_checkpoint(self, checkpoint):
+        """
+        restores the state saved with a chunk that is not computed again. Called for the saved chunks in the order
+        they were computed.
+        :param checkpoint: the state as returned by get_checkpoint after the chunk was computed
+        """
+        pass
+
+    def get_memory_footprint(self, itemsize):
+        """
+        :param itemsize: the size of a voxel of the input in bytes
+        :return: the peak memory used while executing this process in bytes per voxel of its input (including the
+            input and output images), and the size of a voxel of the output in bytes
+        """
+        per_voxel, output_itemsize = self.estimate_memory_footprint(itemsize)
+        if self.memory_per_voxel is not None:
+            per_voxel = self.memory_per_voxel
+        return per_voxel, output_itemsize
+
+    def estimate_memory_footprint(self, itemsize):
+        """
+        estimates the memory used by this process, see get_memory_footprint. Should be overridden by processes that
+        create intermediate images, change the data type or read further images.
+        """
+        return 2 * itemsize, itemsize
+
+    def get_referenced_itemsize(self, default):
+        """
+        :param default: the size of a voxel of files that do not exist yet
+        :return: the summed size in bytes of a voxel of all referenced files
+        """
+        io_handler = self.master.io_handler
+        return sum(io_handler.get_dataset(location).dtype.itemsize if os.path.isfile(location) else default
+                   for location in self.get_referenced_files())
+
+    def covered_by_halo(self):
+        """
+        :return: True if the chunks are read with a halo and this process' kernel reach can be covered by it
+        """
+        return self.master.halo > 0 and self.get_kernel_reach() is not None
+
+    def get_referenced_files(self):
+        """
+        :return: the locations of all files (other than the input) that the result of this process depends on
+        """
+        return []
+
     def calculate(self, input_image):
         """
         processes an image according to a given image manipulation
@@ -72,6 +176,55 @@ class Process:
         """
         return self.calculate(input_image)
 
+    def prepare_pointwise(self, in_array):
+        """
+        loads everything needed to apply this process voxel by voxel to the current image or chunk. Only called for
+        pointwise processes.
+        :param in_array: the input of the fused pass this process is part of
+        :return: the context passed to apply_pointwise
+        """
+        return None
+
+    def apply_pointwise(self, block, context, block_slice):
+        """
+        applies this process in place to a block of slices of the current image or chunk. Only called for pointwise
+        processes. Needs to produce the same result as calculate.
+        :param block: a view of the slices to be processed
+        :param context: the result of prepare_pointwise
+        :param block_slice: the position of the block along the X-Axis of the image
+        """
+        pass
+
+    def summarize_chunk(self, out_array):
+        """
+        extracts the information needed to reconcile a computed chunk with its neighbours. Only called for processes
+        that merge chunks.
+        :param out_array: the computed chunk (without its halo)
+        :return: a picklable summary of the chunk
+        """
+        return None
+
+    def merge_chunk_summaries(self, summaries):
+        """
+        reconciles all chunks after they have been computed. Only called for processes that merge chunks.
+        :param summaries: the results of summarize_chunk for all chunks, in order
+        """
+        pass
+
+    def relabel_chunk(self, index, out_array):
+        """
+        applies the result of merge_chunk_summaries to a computed chunk. Only called for processes that merge chunks.
+        :param index: the index of the chunk
+        :param out_array: the computed chunk, as it was saved
+        :return: the reconciled chunk
+        """
+        return out_array
+
+    def check_shape(self, in_array, second_array, location):
+        if in_array.shape != second_array.shape:
+            self.logger.log_error(f"{self.name}: image of shape {second_array.shape} read from {location} does not "
+                                  f"match the input of shape {in_array.shape}")
+
     def get_attr_by_name(self, attr_name, default=None):
         """
         retrieves a property from the JSON-object that created this process. Is also used to define the Keys that are
@@ -102,6 +255,15 @@ class SmoothingGaussianFilter(Process):
         super().__init__(description)
         self.sigma = self.get_attr_by_name('sigma')
 
+    def get_kernel_reach(self):
+        # the recursive gaussian has an infinite impulse response, so the halo truncates it: beyond 6 sigma its
+        # contribution is below one grey value, but a few voxels of a chunked result may still round differently
+        return int(math.ceil(6 * self.sigma))
+
+    def estimate_memory_footprint(self, itemsize):
+        # the filter computes in float32, and needs a second float32 buffer for the separable passes
+        return 2 * itemsize + 8, itemsize
+
     def calculate(self, input_image):
         pixel_id = input_image.GetPixelID()
 
@@ -116,59 +278,217 @@ class SmoothingGaussianFilter(Process):
 
 class ConnectedThresholding(Process):
     """
-    applies a connected Thresholding (region growth) on an image or chunk. If chunking is enabled, the seeds for every
-    chunk following the first one will be calculated from the last slice of the previous one.
+    applies a connected Thresholding (region growth) on an image or chunk. If chunking is enabled, the region found in
+    the last slice of the previous chunk is passed on as the seed region of the following one.
+    With backward_sweep enabled, the chunks are computed a second time in reverse order, seeding every chunk with the
+    region found in the first slice of its successor as well, so regions that only connect to a seed through a later
+    chunk are not lost.
     """
 
     def __init__(self, description):
         super().__init__(description)
+        self.order_dependent = True
         self.lower = self.get_attr_by_name('lower')
         self.upper = self.get_attr_by_name('upper')
         self.seeds = self.get_attr_by_name('seeds')
         self.replacevalue = self.get_attr_by_name('replacevalue', 1)
+        self.backward_sweep = self.get_attr_by_name('backward_sweep', False)
+        self.seed_face = None
+        self.forward_faces = {}
+
+    def get_kernel_reach(self):
+        return None
+
+    def estimate_memory_footprint(self, itemsize):
+        # binary mask (uint8), labels (uint32), selected region as array and as image (uint8)
+        return itemsize + 7, 1
 
     def calculate(self, input_image):
-        self.seeds = self.parse_seeds(self.seeds, self.master.rescaling_factor)
         return sitk.ConnectedThreshold(image1=input_image,
-                                       seedList=self.seeds,
+                                       seedList=self.parse_seeds(self.seeds, self.master.get_scale_before(self)),
                                        lower=self.lower,
                                        upper=self.upper,
                                        replaceValue=self.replacevalue)
 
     def calculate_chunk(self, input_image):
-        if self.master.current_chunk == 0:
-            self.seeds = self.parse_seeds(self.seeds, self.master.rescaling_factor)
-        result = sitk.ConnectedThreshold(image1=input_image,
-                                         seedList=self.seeds,
-                                         lower=self.lower,
-                                         upper=self.upper,
-                                         replaceValue=self.replacevalue)
-
-        self.update_seeds(sitk.GetArrayFromImage(result[:, :, -1]))
-        self.logger.log_timestamp(f"{len(self.seeds)} seeds defined for the next chunk")
-        return result
+        chunk = self.master.current_chunk
+        seeds = self.parse_seeds(self.seeds, self.master.get_scale_before(self)) if chunk == 0 else []
+        faces = []
+        if self.master.sweep_backward:
+            if chunk in self.forward_faces:
+                faces.append((0, self.forward_faces[chunk]))
+            if self.seed_face is not None and chunk + 1 < len(self.master.json_interpreter.chunks):
+                faces.append((-1, self.seed_face))
+        elif chunk > 0 and self.seed_face is not None:
+            faces.append((0, self.seed_face))
+            if self.backward_sweep:
+                self.forward_faces[chunk] = self.seed_face
+
+        result = self.grow_region(input_image, seeds, faces)
+        self.seed_face = result[self.master.get_handoff_index(self)] != 0
+        self.logger.log_timestamp(f"{np.count_nonzero(self.seed_face)} seed voxels defined for the next chunk")
+        return self.master.get_image(result)
+
+    def grow_region(self, input_image, seeds, faces):
+        """
+        selects all connected regions within the threshold that contain a seed point or a voxel of a seed region
+        :param input_image: the image to be processed
+        :param seeds: a list of seed points (x, y, z) in SimpleITK index order
+        :param faces: a list of tuples containing an index along the X-Axis and a boolean mask of the same shape as
+            a slice of the image, marking the seed region within that slice
+        :return: an array of the buffer pool containing replacevalue for every selected voxel and 0 everywhere else
+        """
+        in_range = sitk.BinaryThreshold(input_image, self.lower, self.upper, 1, 0)
+        label_image = sitk.ConnectedComponent(in_range)
+        labels = sitk.GetArrayViewFromImage(label_image)
+
+        selected = [np.asarray([labels[z, y, x] for (x, y, z) in seeds
+                                if z < labels.shape[0] and y < labels.shape[1] and x < labels.shape[2]],
+                               dtype=labels.dtype)]
+        for index, face in faces:
+            selected.append(labels[index][face])
+        selected = np.unique(np.concatenate(selected))
+
+        lookup = np.zeros(int(labels.max()) + 1, dtype=np.uint8)
+        lookup[selected[selected != 0]] = self.replacevalue
+        return np.take(lookup, labels, out=self.master.io_handler.buffer_pool.acquire(labels.shape, lookup.dtype))
+
+    def get_checkpoint(self):
+        checkpoint = {}
+        if self.seed_face is not None:
+            checkpoint['seed_face'] = self.seed_face
+        if not self.master.sweep_backward and self.master.current_chunk in self.forward_faces:
+            checkpoint['forward_face'] = self.forward_faces[self.master.current_chunk]
+        return checkpoint
+
+    def restore_checkpoint(self, checkpoint):
+        self.seed_face = checkpoint.get('seed_face')
+        if 'forward_face' in checkpoint:
+            self.forward_faces[self.master.current_chunk] = checkpoint['forward_face']
 
     def parse_seeds(self, seeds, scale):
         return [(int(x / scale), int(y / scale), int(z / scale)) for (x, y, z) in seeds]
 
-    def update_seeds(self, last_slice):
-        seeds = []
-        len_x, len_y = last_slice.shape
-        for x in range(len_x):
-            for y in range(len_y):
-                if last_slice[x, y] == self.replacevalue:
-                    seeds.append((y, x, 0))
-        self.seeds = seeds
+
+class ConnectedComponents(Process):
+    """
+    labels all connected regions of a binary image with a unique ID. If chunking is enabled, every chunk is labelled
+    independently (so chunks may be computed in parallel). Once all chunks are computed, labels that touch across the
+    border of two chunks are merged with a union-find, and every chunk is relabelled with consecutive global IDs.
+    Needs to be the last process of the process list when chunking is enabled.
+    """
+
+    def __init__(self, description):
+        super().__init__(description)
+        self.merges_chunks = True
+        self.fully_connected = self.get_attr_by_name('fully_connected', False)
+        self.lookup_tables = []
+
+    def estimate_memory_footprint(self, itemsize):
+        # the labels are uint32, and the filter keeps a second label buffer while relabeling
+        return itemsize + 8, 4
+
+    def calculate(self, input_image):
+        labeling = sitk.ConnectedComponentImageFilter()
+        labeling.SetFullyConnected(self.fully_connected)
+        result = labeling.Execute(input_image)
+        self.logger.log_timestamp(f"{labeling.GetObjectCount()} connected components found")
+        return result
+
+    def summarize_chunk(self, out_array):
+        return int(out_array.max()), out_array[0].copy(), out_array[-1].copy()
+
+    def merge_chunk_summaries(self, summaries):
+        label_counts = [count for (count, _, _) in summaries]
+        offsets = np.concatenate(([0], np.cumsum(label_counts)))
+        parent = np.arange(offsets[-1] + 1, dtype=np.int64)
+
+        def find(label):
+            root = label
+            while parent[root] != root:
+                root = parent[root]
+            while parent[label] != root:  # path compression
+                parent[label], label = root, parent[label]
+            return root
+
+        for i in range(len(summaries) - 1):
+            for a, b in self.get_touching_labels(summaries[i][2], summaries[i + 1][1]):
+                root_a, root_b = find(a + offsets[i]), find(b + offsets[i + 1])
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+
+        roots = parent
+        while True:  # every label points to a smaller one, so pointer jumping converges to the roots
+            next_roots = roots[roots]
+            if np.array_equal(next_roots, roots):
+                break
+            roots = next_roots
+        _, global_labels = np.unique(roots, return_inverse=True)  # the background keeps ID 0, as it is its own root
+        global_labels = global_labels.astype(np.uint32)
+        self.lookup_tables = [global_labels[np.r_[0, offsets[i] + 1:offsets[i + 1] + 1]]
+                              for i in range(len(summaries))]
+        self.logger.log_timestamp(f"{int(global_labels.max())} connected components found in {len(summaries)} chunks")
+
+    def get_touching_labels(self, last_face, first_face):
+        """
+        finds all pairs of labels that touch across the border of two chunks
+        :param last_face: the last slice of the first chunk
+        :param first_face: the first slice of the following chunk
+        :return: an array of unique pairs of (local) labels
+        """
+        shifts = [(0, 0)]
+        if self.fully_connected:
+            shifts = [(dy, dz) for dy in (-1, 0, 1) for dz in (-1, 0, 1)]
+
+        pairs = []
+        len_y, len_z = last_face.shape
+        for dy, dz in shifts:
+            a = last_face[max(dy, 0):len_y + min(dy, 0), max(dz, 0):len_z + min(dz, 0)]
+            b = first_face[max(-dy, 0):len_y + min(-dy, 0), max(-dz, 0):len_z + min(-dz, 0)]
+            touching = (a != 0) & (b != 0)
+            pairs.append(np.stack((a[touching], b[touching]), axis=1).astype(np.int64))
+        return np.unique(np.concatenate(pairs), axis=0)
+
+    def relabel_chunk(self, index, out_array):
+        return np.take(self.lookup_tables[index], out_array)
 
 
 class InvertIntensity(Process):
+    """
+    rescales the intensity of an image to the range 0 to 255 and inverts it
+    """
 
     def __init__(self, description):
         super().__init__(description, False)
+        self.pointwise = True
+        self.needs_input_statistics = True
+
+    def get_kernel_reach(self):
+        # the intensity rescaling depends on the minimum and maximum of the entire image
+        return None
+
+    def estimate_memory_footprint(self, itemsize):
+        return 3 * itemsize, itemsize
 
     def calculate(self, input_image):
         return sitk.InvertIntensity(sitk.RescaleIntensity(input_image))
 
+    def prepare_pointwise(self, in_array):
+        # computes the linear transformation the same way as itk::RescaleIntensityImageFilter
+        minimum, maximum = (float(in_array.min()), float(in_array.max())) if in_array.size else (0., 0.)
+        if minimum != maximum:
+            factor = 255. / (maximum - minimum)
+        elif maximum != 0:
+            factor = 255. / maximum
+        else:
+            factor = 0.
+        return factor, -minimum * factor
+
+    def apply_pointwise(self, block, context, block_slice):
+        factor, offset = context
+        rescaled = np.clip(np.trunc(block * factor + offset), 0, 255)
+        np.subtract(255, rescaled, out=block, casting='unsafe')
+
 
 class MaskImage(Process):
 
@@ -177,24 +497,46 @@ class MaskImage(Process):
         self.offset = self.get_attr_by_name('offset', 0)
         self.mask_location = self.get_attr_by_name('mask_location')
         self.mask_downscale = self.get_attr_by_name('mask_downscale', 1)
+        self.pointwise = True
+
+    def get_referenced_files(self):
+        return [self.mask_location]
+
+    def estimate_memory_footprint(self, itemsize):
+        return 2 * itemsize + self.get_referenced_itemsize(1), itemsize
 
     def calculate(self, input_image):
-        start_index, end_index = self.master.current_indices
+        (start_index, end_index), *window = self.master.current_indices
         mask = self.master.io_handler.load_from_file(self.mask_location, self.mask_downscale,
-                                                     start_index - self.offset, end_index - self.offset)
+                                                     start_index - self.offset, end_index - self.offset, window)
         return sitk.Mask(input_image, mask)
 
+    def prepare_pointwise(self, in_array):
+        (start_index, end_index), *window = self.master.current_indices
+        mask = self.master.io_handler.load_cached_array(self.mask_location, self.mask_downscale,
+                                                        start_index - self.offset, end_index - self.offset, window)
+        self.check_shape(in_array, mask, self.mask_location)
+        return mask
+
+    def apply_pointwise(self, block, context, block_slice):
+        block[context[block_slice] == 0] = 0
+
 
 class BinaryErosion(Process):
 
     def __init__(self, description):
         super().__init__(description, False)
         self.radius = self.get_attr_by_name('radius')
+        self.foreground = self.get_attr_by_name('foreground', 255)
+        self.background = self.get_attr_by_name('background', 0)
+
+    def get_kernel_reach(self):
+        return int(self.radius)
 
     def calculate(self, input_image):
         erode_filter = sitk.BinaryErodeImageFilter()
-        erode_filter.SetBackgroundValue(0)
-        erode_filter.SetForegroundValue(255)
+        erode_filter.SetBackgroundValue(self.background)
+        erode_filter.SetForegroundValue(self.foreground)
         erode_filter.SetKernelRadius(self.radius)
         return erode_filter.Execute(input_image)
 
@@ -204,21 +546,102 @@ class BinaryDilation(Process):
     def __init__(self, description):
         super().__init__(description, False)
         self.radius = self.get_attr_by_name('radius')
+        self.foreground = self.get_attr_by_name('foreground', 255)
+        self.background = self.get_attr_by_name('background', 0)
+
+    def get_kernel_reach(self):
+        return int(self.radius)
 
     def calculate(self, input_image):
         dilate_filter = sitk.BinaryDilateImageFilter()
-        dilate_filter.SetBackgroundValue(0)
-        dilate_filter.SetForegroundValue(255)
+        dilate_filter.SetBackgroundValue(self.background)
+        dilate_filter.SetForegroundValue(self.foreground)
         dilate_filter.SetKernelRadius(self.radius)
         return dilate_filter.Execute(input_image)
 
 
+class BinaryOpening(Process):
+    """
+    removes all parts of the foreground that a ball of the given radius does not fit into. Gives the same result as
+    BinaryErosion followed by BinaryDilation, but both steps are computed from a distance transform, so the
+    computation time does not depend on the radius.
+    """
+
+    def __init__(self, description):
+        super().__init__(description, False)
+        self.radius = self.get_attr_by_name('radius')
+        self.foreground = self.get_attr_by_name('foreground', 255)
+        self.background = self.get_attr_by_name('background', 0)
+
+    def get_kernel_reach(self):
+        return 2 * int(self.radius)
+
+    def estimate_memory_footprint(self, itemsize):
+        # input image, result array and image, two boolean masks and a float32 distance map
+        return 3 * itemsize + 6, itemsize
+
+    def calculate(self, input_image):
+        in_array = sitk.GetArrayViewFromImage(input_image)
+        result = self.master.io_handler.buffer_pool.acquire(in_array.shape, in_array.dtype)
+        np.copyto(result, in_array)
+        self.erode(result)
+        self.dilate(result)
+        return self.master.get_image(result)
+
+    def erode(self, array):
+        """
+        sets every foreground voxel closer to a non-foreground voxel than the radius to the background value, like
+        BinaryErosion. Voxels outside the image count as foreground.
+        :param array: the array to be eroded in place
+        """
+        foreground = array == self.foreground
+        array[foreground & self.dilate_mask(~foreground)] = self.background
+
+    def dilate(self, array):
+        """
+        sets every voxel closer to a foreground voxel than the radius to the foreground value, like BinaryDilation
+        :param array: the array to be dilated in place
+        """
+        array[self.dilate_mask(array == self.foreground)] = self.foreground
+
+    def dilate_mask(self, mask):
+        """
+        :param mask: a boolean array
+        :return: a boolean array marking all voxels within the radius of any voxel of the mask
+        """
+        if not mask.any():
+            return mask
+        distance_map = sitk.SignedMaurerDistanceMap(sitk.GetImageFromArray(mask.view(np.uint8)), insideIsPositive=False,
+                                                    squaredDistance=True, useImageSpacing=False)
+        # the ball used by BinaryErosion and BinaryDilation contains all offsets up to a squared length of r * (r + 1)
+        radius = int(self.radius)
+        return mask | (sitk.GetArrayViewFromImage(distance_map) <= radius * (radius + 1))
+
+
+class BinaryClosing(BinaryOpening):
+    """
+    fills all parts of the background that a ball of the given radius does not fit into. Gives the same result as
+    BinaryDilation followed by BinaryErosion, with a computation time that does not depend on the radius.
+    """
+
+    def calculate(self, input_image):
+        in_array = sitk.GetArrayViewFromImage(input_image)
+        result = self.master.io_handler.buffer_pool.acquire(in_array.shape, in_array.dtype)
+        np.copyto(result, in_array)
+        self.dilate(result)
+        self.erode(result)
+        return self.master.get_image(result)
+
+
 class MeanFilter(Process):
 
     def __init__(self, description):
         super().__init__(description)
         self.radius = self.get_attr_by_name('radius')
 
+    def get_kernel_reach(self):
+        return int(self.radius)
+
     def calculate(self, input_image):
         image_filter = sitk.MeanImageFilter()
         image_filter.SetRadius(int(self.radius))
@@ -230,41 +653,104 @@ class OtsuThresholding(Process):
     def __init__(self, description):
         super().__init__(description, False)
 
+    def get_kernel_reach(self):
+        return None
+
+    def estimate_memory_footprint(self, itemsize):
+        return itemsize + 1, 1
+
     def calculate(self, input_image):
         return sitk.OtsuThreshold(input_image)
 
 
 class RescaleToOriginal(Process):
     """
-    rescales the image or chunk to its original size
+    rescales the image or chunk to its original size. By default every voxel is repeated along all axes (nearest
+    neighbour). With interpolation set to "linear", the output is interpolated linearly between the voxel centers,
+    which is better suited for non-binary images. The output is computed in slabs of slab_size slices, each written
+    straight into a buffer of the exact target shape.
     """
 
+    def __init__(self, description):
+        super().__init__(description)
+        self.interpolation = self.get_attr_by_name('interpolation', 'nearest')
+        self.slab_size = self.get_attr_by_name('slab_size', 64)
+        if self.interpolation not in ('nearest', 'linear'):
+            print(f"could not instantiate process {self.name}: unknown interpolation {self.interpolation}")
+            sys.exit()
+
+    def get_kernel_reach(self):
+        # linear interpolation reads the neighbouring voxel on either side
+        return 1 if self.interpolation == 'linear' else 0
+
+    def estimate_memory_footprint(self, itemsize):
+        # the output is rescaling_factor ** 3 times larger, and held both as an array and as an image
+        return itemsize + 2 * self.master.rescaling_factor ** 3 * itemsize, itemsize
+
     def calculate(self, input_image):
-        start, end = self.master.current_indices
-        data_shape_orig = self.master.json_interpreter.input_shape_unscaled
-        target_shape = (end - start, data_shape_orig[1], data_shape_orig[2] )
-        return self.rescale(input_image, target_shape)
+        return self.rescale(input_image, self.master.current_shape_unscaled)
 
     def calculate_chunk(self, input_image):
-        shape_orig = self.master.json_interpreter.input_shape_unscaled
-        current_chunk = self.master.current_indices
-        target_shape = (current_chunk[1] - current_chunk[0], shape_orig[1], shape_orig[2])
-        return self.rescale(input_image, target_shape)
+        return self.rescale(input_image, self.master.current_shape_unscaled)
 
     def rescale(self, input_image, target_shape):
-        self.logger.log_timestamp(f"rescaling to target shape {target_shape}")
-        in_array = sitk.GetArrayFromImage(input_image)
+        self.logger.log_timestamp(f"rescaling to target shape {target_shape} ({self.interpolation} interpolation)")
+        in_array = sitk.GetArrayViewFromImage(input_image)
         rescaling_factor = self.master.rescaling_factor
-        rescale_volume = (rescaling_factor, rescaling_factor, rescaling_factor)
-        self.logger.log_timestamp(f"applying kronecker product with shape: {rescale_volume}")
-        out_array = np.kron(in_array, np.ones(rescale_volume, in_array.dtype))
-
         for i in range(3):
-            if out_array.shape[i] < target_shape[i]:
+            if in_array.shape[i] * rescaling_factor < target_shape[i]:
                 self.logger.log_error("invalid rescaling factor: output dimension is smaller than target dimension")
-        out_array = out_array[0:target_shape[0], 0:target_shape[1], 0:target_shape[2]]
-        out_image = sitk.GetImageFromArray(out_array)
-        return out_image
+
+        out_array = self.master.io_handler.buffer_pool.acquire(target_shape, in_array.dtype)
+        for offset, slab in self.iter_rescaled_slabs(in_array, target_shape, rescaling_factor):
+            out_array[offset:offset + slab.shape[0]] = slab
+        return self.master.get_image(out_array)
+
+    def iter_rescaled_slabs(self, in_array, target_shape, rescaling_factor):
+        """
+        upscales an array slab by slab, so the full result never needs to exist more than once
+        :param in_array: the downscaled array
+        :param target_shape: the shape of the upscaled array
+        :param rescaling_factor: the factor the array was downscaled by
+        :return: a generator of tuples containing the index along the X-Axis of the slab and the upscaled slab
+        """
+        if self.interpolation == 'nearest':
+            indices = [np.arange(target_shape[i]) // rescaling_factor for i in range(3)]
+            for offset in range(0, target_shape[0], self.slab_size):
+                slab = in_array[indices[0][offset:offset + self.slab_size]]
+                slab = np.take(slab, indices[1], axis=1)
+                yield offset, np.take(slab, indices[2], axis=2)
+            return
+
+        weights = [self.get_linear_weights(in_array.shape[i], target_shape[i], rescaling_factor) for i in range(3)]
+        for offset in range(0, target_shape[0], self.slab_size):
+            lower, upper, weight = (w[offset:offset + self.slab_size] for w in weights[0])
+            slab = self.interpolate_axis(in_array, 0, (lower, upper, weight))
+            slab = self.interpolate_axis(slab, 1, weights[1])
+            slab = self.interpolate_axis(slab, 2, weights[2])
+            if np.issubdtype(in_array.dtype, np.integer):
+                info = np.iinfo(in_array.dtype)
+                slab = np.clip(np.rint(slab), info.min, info.max)
+            yield offset, slab.astype(in_array.dtype)
+
+    def get_linear_weights(self, in_length, out_length, rescaling_factor):
+        """
+        maps the voxel centers of an upscaled axis onto the axis of the downscaled array
+        :return: the indices of the lower and upper neighbour of every output voxel, and the weight of the upper one
+        """
+        position = (np.arange(out_length, dtype=np.float32) + 0.5) / rescaling_factor - 0.5
+        position = np.clip(position, 0, in_length - 1)
+        lower = np.floor(position).astype(np.intp)
+        upper = np.minimum(lower + 1, in_length - 1)
+        return lower, upper, (position - lower).astype(np.float32)
+
+    def interpolate_axis(self, array, axis, weights):
+        lower, upper, weight = weights
+        shape = [1, 1, 1]
+        shape[axis] = len(weight)
+        lower_values = np.take(array, lower, axis=axis).astype(np.float32)
+        upper_values = np.take(array, upper, axis=axis)
+        return lower_values + (upper_values - lower_values) * weight.reshape(shape)
 
 
 class AppendImages(Process):
@@ -278,8 +764,18 @@ class AppendImages(Process):
         super().__init__(description)
         self.image_locations = self.get_attr_by_name("images")
 
+    def get_referenced_files(self):
+        return self.image_locations
+
+    def get_kernel_reach(self):
+        return None
+
+    def estimate_memory_footprint(self, itemsize):
+        # the size of the appended images is not related to the input
+        return 3 * itemsize, itemsize
+
     def calculate(self, input_image):
-        result = sitk.GetArrayFromImage(input_image)
+        result = sitk.GetArrayViewFromImage(input_image)
         for location in self.image_locations:
             self.logger.log_timestamp(f"processing: {location}")
             current_image_data = self.master.io_handler.load_array_from_file(location, 1)
@@ -299,10 +795,16 @@ class Thresholding(Process):
         super().__init__(description)
         self.lower = self.get_attr_by_name("lower")
         self.upper = self.get_attr_by_name("upper")
+        self.pointwise = True
 
     def calculate(self, input_image):
         return sitk.Threshold(input_image, self.lower, self.upper, 0)
 
+    def apply_pointwise(self, block, context, block_slice):
+        # sitk casts the thresholds to the pixel type of the image before comparing
+        lower, upper = np.array([self.lower, self.upper]).astype(block.dtype)
+        block[(block < lower) | (block > upper)] = 0
+
 
 class GrayScaleDilation(Process):
 
@@ -310,8 +812,11 @@ class GrayScaleDilation(Process):
         super().__init__(description)
         self.radius = self.get_attr_by_name('radius')
 
+    def get_kernel_reach(self):
+        return int(self.radius)
+
     def calculate(self, input_image):
-        return sitk.GrayscaleDilate(input_image, self.radius)
+        return sitk.GrayscaleDilate(input_image, [int(self.radius)] * 3)
 
 
 class GrayScaleErosion(Process):
@@ -320,8 +825,11 @@ class GrayScaleErosion(Process):
         super().__init__(description)
         self.radius = self.get_attr_by_name('radius')
 
+    def get_kernel_reach(self):
+        return int(self.radius)
+
     def calculate(self, input_image):
-        return sitk.GrayscaleErode(input_image, self.radius)
+        return sitk.GrayscaleErode(input_image, [int(self.radius)] * 3)
 
 
 class LogicalOr(Process):
@@ -329,28 +837,118 @@ class LogicalOr(Process):
     def __init__(self, description):
         super().__init__(description)
         self.image_location = self.get_attr_by_name('image_location')
+        self.pointwise = True
+
+    def get_referenced_files(self):
+        return [self.image_location]
+
+    def estimate_memory_footprint(self, itemsize):
+        return 2 * itemsize + self.get_referenced_itemsize(itemsize), itemsize
 
     def calculate(self, input_image):
         second_image = self.master.io_handler.load_from_file(self.image_location, self.master.rescaling_factor,
-                                                             self.master.current_indices[0],
-                                                             self.master.current_indices[1])
+                                                             *self.master.current_indices[0],
+                                                             self.master.current_indices[1:])
 
         return sitk.Or(input_image, second_image)
 
+    def prepare_pointwise(self, in_array):
+        second_array = self.master.io_handler.load_cached_array(self.image_location, self.master.rescaling_factor,
+                                                                *self.master.current_indices[0],
+                                                                self.master.current_indices[1:])
+        self.check_shape(in_array, second_array, self.image_location)
+        if in_array.dtype != second_array.dtype:
+            self.logger.log_error(f"{self.name}: data type {second_array.dtype} of {self.image_location} does not match "
+                                  f"the input data type {in_array.dtype}")
+        return second_array
+
+    def apply_pointwise(self, block, context, block_slice):
+        np.bitwise_or(block, context[block_slice], out=block)
+
 
 class LogicalAnd(Process):
 
     def __init__(self, description):
         super().__init__(description)
         self.image_location = self.get_attr_by_name('image_location')
+        self.pointwise = True
+
+    def get_referenced_files(self):
+        return [self.image_location]
+
+    def estimate_memory_footprint(self, itemsize):
+        return 2 * itemsize + self.get_referenced_itemsize(itemsize), itemsize
 
     def calculate(self, input_image):
         second_image = self.master.io_handler.load_from_file(self.image_location, self.master.rescaling_factor,
-                                                             self.master.current_indices[0],
-                                                             self.master.current_indices[1])
+                                                             *self.master.current_indices[0],
+                                                             self.master.current_indices[1:])
 
         return sitk.And(input_image, second_image)
 
+    def prepare_pointwise(self, in_array):
+        second_array = self.master.io_handler.load_cached_array(self.image_location, self.master.rescaling_factor,
+                                                                *self.master.current_indices[0],
+                                                                self.master.current_indices[1:])
+        self.check_shape(in_array, second_array, self.image_location)
+        if in_array.dtype != second_array.dtype:
+            self.logger.log_error(f"{self.name}: data type {second_array.dtype} of {self.image_location} does not match "
+                                  f"the input data type {in_array.dtype}")
+        return second_array
+
+    def apply_pointwise(self, block, context, block_slice):
+        np.bitwise_and(block, context[block_slice], out=block)
+
+
+class Quantification(Process):
+    """
+    measures the area, centroid and bounding box of the connected components of every slice of a segmented image,
+    tracks them from slice to slice and writes them to a CSV table (see SliceQuantifier). Passes its input on
+    unchanged. If chunking is enabled, only the core of every chunk is quantified, and the chunks are computed in
+    order, so every slice is written once and tracks continue across chunks.
+    """
+
+    def __init__(self, description):
+        super().__init__(description)
+        self.order_dependent = True
+        self.writes_files = True
+        self.quantifier = SliceQuantifier(self.get_attr_by_name('table'), self.get_attr_by_name('fully_connected', False),
+                                          self.description.get('value'))
+
+    def estimate_memory_footprint(self, itemsize):
+        return itemsize, itemsize
+
+    def calculate(self, input_image):
+        self.quantifier.start()
+        self.quantify(input_image, slice(None), self.master.current_indices[0][0])
+        return input_image
+
+    def calculate_chunk(self, input_image):
+        if any(p.backward_sweep for p in self.master.processes):
+            self.logger.log_error(f"{self.name} can not follow a process with a backward sweep, quantify its output "
+                                  f"with quantify.py instead")
+        if self.master.current_chunk == 0:
+            self.quantifier.start()
+        core = self.master.get_core_slice(self.master.get_scale_before(self))
+        self.quantify(input_image, core, self.master.core_indices[0][0])
+        return input_image
+
+    def quantify(self, input_image, core, first_slice):
+        """
+        :param input_image: the image or chunk
+        :param core: the range of slices of the image to be quantified
+        :param first_slice: the index of the first slice of the range in the input file
+        """
+        array = sitk.GetArrayViewFromImage(input_image)
+        count = self.quantifier.quantify(array[core], first_slice, self.master.get_scale_before(self))
+        self.logger.log_timestamp(f"{count} components written to {self.quantifier.location}")
+
+    def get_checkpoint(self):
+        return self.quantifier.get_state()
+
+    def restore_checkpoint(self, checkpoint):
+        self.quantifier.set_state(checkpoint)
+
 
 """   
 
@@ -0,0 +1,170 @@
+import csv
+import os
+
+import numpy as np
+import SimpleITK as sitk
+
+
+class SliceQuantifier:
+    """
+    measures the connected components of every slice (along the X-Axis) of a segmented image, and tracks them from
+    slice to slice. The image is passed in consecutive sections (e.g. chunks), and only the labels of the last slice are
+    kept between them, so the memory needed does not depend on the length of the image.
+
+    every component is written to a table as a row of: the index of its slice, its track, the track it split off from
+    (if it starts a new track by splitting off from a component of the previous slice, -1 otherwise), its area (in
+    voxels), its centroid and its bounding box (inclusive, along the Y- and Z-Axis). A component continues the track of
+    the component of the previous slice it overlaps most. If several components overlap the same component of the
+    previous slice, the one with the largest overlap continues its track and the others start new tracks.
+
+    Attributes:
+        location (str): the CSV file the table is written to
+        fully_connected (bool, optional): if True, voxels touching diagonally are connected. Defaults to False.
+        value (int, optional): the value of the segment to be quantified. Defaults to None (all non-zero voxels).
+        previous_labels (np.ndarray): the labels of the last slice quantified, or None
+        previous_tracks (np.ndarray): the track of every label of the last slice quantified (0 for the background)
+        track_count (int): the number of tracks started so far
+        table_size (int): the size of the table in bytes after the last slice quantified. Rows written beyond it (e.g.
+            by an interrupted run) are discarded before new rows are written.
+    """
+
+    columns = ['slice', 'track', 'parent', 'area', 'centroid_y', 'centroid_z', 'y_min', 'y_max', 'z_min', 'z_max']
+
+    def __init__(self, location, fully_connected=False, value=None):
+        self.location = location
+        self.fully_connected = fully_connected
+        self.value = value
+        self.previous_labels = None
+        self.previous_tracks = None
+        self.track_count = 0
+        self.table_size = 0
+
+    def start(self):
+        """
+        creates the table, containing only its header, and forgets all tracks
+        """
+        with open(self.location, 'w', newline='') as table:
+            csv.writer(table).writerow(self.columns)
+            self.table_size = table.tell()
+        self.previous_labels = None
+        self.previous_tracks = None
+        self.track_count = 0
+
+    def quantify(self, array, first_slice, step=1):
+        """
+        measures the components of consecutive slices and appends them to the table
+        :param array: the slices to be quantified, following the slices quantified before
+        :param first_slice: the index of the first slice, as written to the table
+        :param step: the difference of the indices of two consecutive slices (e.g. the rescaling factor)
+        :return: the number of components found
+        """
+        rows = 0
+        if os.path.getsize(self.location) > self.table_size:
+            os.truncate(self.location, self.table_size)
+        with open(self.location, 'a', newline='') as table:
+            writer = csv.writer(table)
+            for i, section in enumerate(array):
+                labels, count = self.label_slice(section)
+                tracks, parents = self.track_slice(labels, count)
+                measures = self.measure_slice(labels, count)
+                index = np.full(count, first_slice + i * step)
+                writer.writerows(zip(index, tracks[1:], parents[1:], *measures))
+                self.previous_labels, self.previous_tracks = labels, tracks
+                rows += count
+            self.table_size = table.tell()
+        return rows
+
+    def label_slice(self, section):
+        """
+        :param section: a single slice of the image
+        :return: the labels of the components of the slice (numbered from 1 in raster order) and their number
+        """
+        mask = section != 0 if self.value is None else section == self.value
+        labeling = sitk.ConnectedComponentImageFilter()
+        labeling.SetFullyConnected(self.fully_connected)
+        label_image = labeling.Execute(sitk.GetImageFromArray(mask.view(np.uint8)))
+        return sitk.GetArrayFromImage(label_image), labeling.GetObjectCount()
+
+    def measure_slice(self, labels, count):
+        """
+        :param labels: the labels of a slice
+        :param count: the number of labels
+        :return: arrays of the area, the centroid (y, z) and the bounding box (y_min, y_max, z_min, z_max) of every
+            label, in order of the labels
+        """
+        flat = labels.ravel()
+        foreground = np.flatnonzero(flat)
+        y, z = np.divmod(foreground, labels.shape[1])
+        foreground_labels = flat[foreground]
+        area = np.bincount(foreground_labels, minlength=count + 1)[1:]
+        centroid_y = np.bincount(foreground_labels, weights=y, minlength=count + 1)[1:] / np.maximum(area, 1)
+        centroid_z = np.bincount(foreground_labels, weights=z, minlength=count + 1)[1:] / np.maximum(area, 1)
+        if count == 0:
+            return area, centroid_y, centroid_z, area, area, area, area
+
+        # after a stable sort by label, the voxels of every label form a run in raster order
+        order = np.argsort(foreground_labels, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(area)[:-1]))
+        y, z = y[order], z[order]
+        ends = starts + area - 1
+        return (area, np.round(centroid_y, 2), np.round(centroid_z, 2), y[starts], y[ends],
+                np.minimum.reduceat(z, starts), np.maximum.reduceat(z, starts))
+
+    def track_slice(self, labels, count):
+        """
+        assigns every component of a slice to a track, by its overlap with the components of the previous slice
+        :param labels: the labels of the slice
+        :param count: the number of labels
+        :return: the track of every label and the track every label split off from (-1 if none), both indexed by label
+            (index 0 belongs to the background)
+        """
+        tracks = np.zeros(count + 1, dtype=np.int64)
+        parents = np.full(count + 1, -1, dtype=np.int64)
+        if self.previous_labels is not None and count > 0:
+            overlap = (self.previous_labels != 0) & (labels != 0)
+            pairs, sizes = np.unique(self.previous_labels[overlap].astype(np.int64) * (count + 1) + labels[overlap],
+                                     return_counts=True)
+            previous, current = np.divmod(pairs, count + 1)
+            # the previous component every component overlaps most
+            order = np.lexsort((-sizes, current))
+            first = order[get_run_starts(current[order])]
+            current, previous, sizes = current[first], previous[first], sizes[first]
+            # the component continuing every previous component's track is the one overlapping it most
+            order = np.lexsort((-sizes, previous))
+            starts = get_run_starts(previous[order])
+            continuing, splitting = order[starts], order[~starts]
+            tracks[current[continuing]] = self.previous_tracks[previous[continuing]]
+            parents[current[splitting]] = self.previous_tracks[previous[splitting]]
+
+        new = np.flatnonzero(tracks[1:] == 0) + 1
+        tracks[new] = np.arange(self.track_count + 1, self.track_count + 1 + len(new))
+        self.track_count += len(new)
+        return tracks, parents
+
+    def get_state(self):
+        """
+        :return: the state needed to continue quantifying after the last slice, as a dict of arrays
+        """
+        if self.previous_labels is None:
+            return {'counts': np.array([self.track_count, self.table_size])}
+        return {'counts': np.array([self.track_count, self.table_size]), 'previous_labels': self.previous_labels,
+                'previous_tracks': self.previous_tracks}
+
+    def set_state(self, state):
+        """
+        continues quantifying after the slice the state was taken at
+        :param state: the state as returned by get_state
+        """
+        self.track_count, self.table_size = (int(n) for n in state['counts'])
+        self.previous_labels = state.get('previous_labels')
+        self.previous_tracks = state.get('previous_tracks')
+
+
+def get_run_starts(keys):
+    """
+    :param keys: a sorted array
+    :return: a boolean array marking the first element of every run of equal keys
+    """
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = keys[1:] != keys[:-1]
+    return starts
@@ -0,0 +1,42 @@
+import argparse
+
+import io_utils
+from logger import Logger
+from quantification import SliceQuantifier
+
+if __name__ == "__main__":
+    handler = io_utils.IOHandler(False, Logger())
+
+    parser = argparse.ArgumentParser(description='measures the area, centroid and bounding box of the connected '
+                                                 'components of every slice of a segmented .hdf5 file, tracks them '
+                                                 'from slice to slice and writes them to a CSV table. The file is read '
+                                                 'in slabs, so the memory needed does not depend on its length.')
+    parser.add_argument('infile',
+                        help=f'a valid .hdf5 file that contains a dataset by the key of either: {handler.valid_dataset_identifiers}')
+
+    parser.add_argument('table', help='the location of the CSV file to be written')
+
+    parser.add_argument('--si', '--start_index', type=int, default=0,
+                        help='the start index along the X-Axis of the range to be quantified')
+    parser.add_argument('--ei', '--end_index', type=int, default=None,
+                        help='the end index along the X-Axis of the range to be quantified')
+
+    parser.add_argument('--slab', type=int, default=64, help='the number of slices read at a time')
+
+    parser.add_argument('--value', type=int, default=None,
+                        help='the value of the segment to be quantified. Defaults to all non-zero voxels')
+
+    parser.add_argument('--fully_connected', action='store_true',
+                        help='voxels touching diagonally are part of the same component')
+
+    args = parser.parse_args()
+
+    end_index = args.ei if args.ei is not None else handler.get_original_shape(args.infile)[0]
+    quantifier = SliceQuantifier(args.table, args.fully_connected, args.value)
+    quantifier.start()
+    count = 0
+    for start in range(args.si, end_index, args.slab):
+        slab = handler.load_array_from_file(args.infile, 1, start, min(start + args.slab, end_index), pooled=True)
+        count += quantifier.quantify(slab, start)
+        handler.buffer_pool.release(slab)
+    handler.logger.log_timestamp(f"{count} components in {quantifier.track_count} tracks written to {args.table}")
@@ -24,10 +24,21 @@ if __name__ == "__main__":
         configuration = json.load(json_file)
 
     out_name = configuration['file_name']
-    temp_name = "{}{}*.hdf5".format(configuration['temp_dir'], out_name)
-    out_dir = io_handler.define_out_name(configuration['image_dir'], out_name)
+    temp_name = "{}{}*{}".format(configuration['temp_dir'], out_name,
+                                 io_handler.get_format_extension(configuration.get('temp_format', 'hdf5')))
+    out_dir = io_handler.define_out_name(configuration['image_dir'], out_name,
+                                         io_handler.get_format_extension(configuration.get('output_format', 'hdf5')))
     images = list(sorted(glob.iglob(temp_name)))
-    image = io_handler.reassemble_chunks(images)
+    if configuration.get('brick_size') is None:
+        image = io_handler.reassemble_chunks(images)
+    else:
+        # bricks can not be concatenated, every brick is placed at the position stored with it
+        metas = [io_handler.read_meta(location) for location in images]
+        if not images or any('chunk_offset' not in meta for meta in metas):
+            io_handler.logger.log_error("the temporary files of a computation in bricks need to contain their position "
+                                        "in the output (\"chunk_offset\") to be reassembled")
+        image = io_handler.reassemble_chunks(images, [tuple(int(i) for i in meta['chunk_offset']) for meta in metas],
+                                             tuple(int(i) for i in metas[0]['output_shape']))
 
     if not args.nosave:
         io_handler.write_array_to_file(image, out_dir, configuration)
@@ -0,0 +1,169 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import os
+import zlib
+
+import h5py
+import numpy as np
+
+import io_utils
+from logger import Logger
+
+
+class Relayout:
+    """
+    rewrites the dataset of a .hdf5 file into a new file, stored in the layout SailFish reads fastest: chunks of whole
+    Y-Z tiles stacked along the X-Axis (see IOHandler.get_dataset_options), optionally compressed, under the dataset
+    identifier 'data'. The input is read in slabs of whole chunks. With gzip compression, the chunks of a slab are
+    compressed by a pool of threads while the next slab is read, and written to the file without passing through the
+    HDF5 filter pipeline again.
+
+    Attributes:
+        io_handler (IOHandler): provides the storage layout and builds the pyramid
+        logger (Logger): encapsulates the output of basic user information during computation
+        workers (int): the number of threads compressing chunks
+    """
+
+    def __init__(self, io_handler, workers=None):
+        self.io_handler = io_handler
+        self.logger = io_handler.logger
+        self.workers = workers or os.cpu_count() or 1
+
+    def convert(self, filename, output, dataset_name=None, binary=False):
+        """
+        :param filename: the file to be converted
+        :param output: the location of the converted file
+        :param dataset_name: the path of the dataset within the input file. Defaults to the first valid identifier.
+        :param binary: True if the image contains only two values, used to choose the default compression
+        """
+        if os.path.realpath(filename) == os.path.realpath(output):
+            self.logger.log_error("the converted file needs to be written to a different location than the input")
+
+        with h5py.File(filename, 'r') as infile, h5py.File(output, 'w') as outfile:
+            data = infile[dataset_name] if dataset_name else self.io_handler.find_dataset(infile, filename)
+            options = self.io_handler.get_dataset_options(data.shape, data.dtype, binary)
+            target = outfile.create_dataset('data', shape=data.shape, dtype=data.dtype, **options)
+            if 'meta' in infile:
+                infile.copy('meta', outfile)
+            target.attrs.update(data.attrs)
+
+            self.logger.log_started(f"converting {filename} {data.shape} to {output}, chunks {target.chunks}, "
+                                    f"compression {target.compression}")
+            if target.compression == 'gzip' and target.chunks:
+                self.copy_compressed(data, target)
+            else:
+                self.copy_slabs(data, target)
+        self.logger.log_completed(f"converting {filename}")
+
+    def get_slab_depth(self, data, target):
+        """
+        :return: the number of slices read at a time, a multiple of the depth of a chunk of the target
+        """
+        depth = target.chunks[0] if target.chunks else 1
+        slice_bytes = max(1, data.shape[1] * data.shape[2] * data.dtype.itemsize)
+        return max(1, self.io_handler.read_block_bytes // (slice_bytes * depth)) * depth
+
+    def copy_slabs(self, data, target):
+        """
+        copies the dataset slab by slab, letting HDF5 apply the filters of the target
+        """
+        depth = self.get_slab_depth(data, target)
+        for start in range(0, data.shape[0], depth):
+            self.logger.log_timestamp(f"copying slices {start} to {min(start + depth, data.shape[0])}")
+            target[start:start + depth] = data[start:start + depth]
+
+    def copy_compressed(self, data, target):
+        """
+        copies the dataset slab by slab, compressing the chunks of every slab in parallel while the next slab is read,
+        and writing the compressed chunks directly
+        """
+        depth = self.get_slab_depth(data, target)
+        level = target.compression_opts
+        shuffle = target.shuffle
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = []
+            for start in range(0, data.shape[0], depth):
+                self.logger.log_timestamp(f"compressing slices {start} to {min(start + depth, data.shape[0])}")
+                slab = data[start:start + depth]
+                # the chunks of the previous slab are written while the chunks of this slab are compressed
+                futures = [(offset, pool.submit(compress_chunk, chunk, level, shuffle))
+                           for offset, chunk in iterate_chunks(slab, start, target.chunks)]
+                for offset, future in pending:
+                    target.id.write_direct_chunk(offset, future.result())
+                pending = futures
+            for offset, future in pending:
+                target.id.write_direct_chunk(offset, future.result())
+
+
+def iterate_chunks(slab, start, chunks):
+    """
+    :param slab: a section of whole slices of the dataset, starting at a chunk boundary
+    :param start: the index along the X-Axis of the first slice of the slab
+    :param chunks: the shape of a chunk of the dataset
+    :return: tuples of the offset of every chunk within the dataset and its content, padded to the full chunk shape
+    """
+    for x, y, z in itertools.product(*(range(0, length, chunk) for length, chunk in zip(slab.shape, chunks))):
+        content = slab[x:x + chunks[0], y:y + chunks[1], z:z + chunks[2]]
+        if content.shape != tuple(chunks):
+            padded = np.zeros(chunks, dtype=slab.dtype)
+            padded[:content.shape[0], :content.shape[1], :content.shape[2]] = content
+            content = padded
+        yield (start + x, y, z), content
+
+
+def compress_chunk(chunk, level, shuffle):
+    """
+    applies the filters of a gzip-compressed dataset to a chunk, like HDF5 would
+    :param chunk: the content of the chunk
+    :param level: the gzip compression level
+    :param shuffle: if True, the bytes of all values are grouped by significance before compression
+    :return: the compressed chunk
+    """
+    data = np.ascontiguousarray(chunk)
+    if shuffle and data.dtype.itemsize > 1:
+        data = np.ascontiguousarray(data.view(np.uint8).reshape(-1, data.dtype.itemsize).T)
+    return zlib.compress(data.tobytes(), level)
+
+
+if __name__ == "__main__":
+    handler = io_utils.IOHandler(False, Logger())
+
+    parser = argparse.ArgumentParser(description='rewrites a .hdf5 file into the storage layout read fastest by this '
+                                                 'software, optionally compressed and with pyramid levels. The file '
+                                                 'is streamed in slabs, so it may be larger than memory.')
+    parser.add_argument('infile', help='the file to be converted')
+    parser.add_argument('outfile', help='the location of the converted file')
+
+    parser.add_argument('--dataset', default=None,
+                        help=f'the path of the dataset within the input file. Defaults to the first of: '
+                             f'{handler.valid_dataset_identifiers}')
+
+    parser.add_argument('--chunks', type=int, nargs=3, default=None,
+                        help='the shape of the chunks of the converted dataset. Defaults to slabs of whole Y-Z tiles')
+
+    parser.add_argument('--compression', default=None, choices=['gzip', 'lzf', 'none'],
+                        help='the compression of the converted dataset. Defaults to gzip for binary images and no '
+                             'compression otherwise')
+    parser.add_argument('--level', type=int, default=4, help='the gzip compression level')
+    parser.add_argument('--binary', action='store_true', help='the image only contains two values')
+
+    parser.add_argument('--workers', type=int, default=None,
+                        help='the number of threads compressing chunks. Defaults to the number of cores')
+
+    parser.add_argument('--levels', type=int, nargs='*', default=[],
+                        help='the rescaling factors of pyramid levels to be built for the converted file')
+    parser.add_argument('--mode', default='decimate', choices=handler.downsampling_modes,
+                        help='the method used for downscaling the pyramid levels')
+
+    args = parser.parse_args()
+
+    if args.chunks is not None:
+        handler.storage_options['chunks'] = args.chunks
+    if args.compression is not None:
+        handler.storage_options['compression'] = None if args.compression == 'none' else args.compression
+    handler.storage_options['compression_level'] = args.level
+
+    Relayout(handler, args.workers).convert(args.infile, args.outfile, args.dataset, args.binary)
+    if args.levels:
+        handler.build_pyramid(args.outfile, args.levels, args.mode)
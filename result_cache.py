@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+class ResultCache:
+    """
+    stores intermediate results of the process list on disk, so a following run with the same input and the same
+    leading processes can resume from the last stored result instead of computing it again. Results are addressed by a
+    hash of everything they depend on. When the cache grows beyond its size limit, the least recently used results
+    are deleted.
+
+    Attributes:
+        directory (str): the directory the results are stored in
+        size_limit (int): the maximum size of all stored results in bytes
+        logger (Logger): encapsulates the output of basic user information during computation
+    """
+
+    def __init__(self, directory, size_limit, logger):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.logger = logger
+        os.makedirs(self.directory, exist_ok=True)
+        self.evict()
+
+    def get_key(self, description):
+        """
+        :param description: a json-serializable object describing everything a result depends on
+        :return: the address of the result
+        """
+        return hash_description(description)
+
+    def get_location(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def load(self, key):
+        """
+        :param key: the address of a result
+        :return: the stored result, or None if it is not in the cache
+        """
+        location = self.get_location(key)
+        try:
+            result = np.load(location)
+            os.utime(location)  # marks the result as recently used
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        return result
+
+    def store(self, key, result):
+        """
+        stores a result and deletes the least recently used ones, if the size limit is exceeded
+        :param key: the address of the result
+        :param result: the array to be stored
+        """
+        if result.nbytes > self.size_limit:
+            return
+        location = self.get_location(key)
+        temp_location = f"{location}.{os.getpid()}.tmp"
+        with open(temp_location, 'wb') as outfile:
+            np.save(outfile, result)
+        os.replace(temp_location, location)  # other processes never see a partially written result
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        cache_size = sum(size for (_, size, _) in entries)
+        for _, size, name in sorted(entries):
+            if cache_size <= self.size_limit:
+                break
+            self.logger.log_timestamp(f"evicting cached result: {name}")
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            cache_size -= size
+
+
+def hash_description(description):
+    """
+    :param description: a json-serializable object
+    :return: a hash of the object, independent of the order of its keys
+    """
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
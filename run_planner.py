@@ -0,0 +1,249 @@
+import json
+import math
+import os
+
+import processes
+
+
+class RunPlanner:
+    """
+    estimates the memory and time needed to compute the process list of a JsonInterpreter, and chooses the largest
+    chunk size that fits into the available memory.
+
+    the peak memory of a chunk is estimated from the data type of the input and the footprint of every process (see
+    Process.get_memory_footprint), plus the buffers kept between processes and chunks: the array a chunk is read into,
+    the computed array, and the chunks waiting in the queues of the background reader and writer. Every worker process
+    computes its own chunk.
+
+    Attributes:
+        interpreter (JsonInterpreter): the run to be planned
+        logger (Logger): encapsulates the output of basic user information during computation
+        memory_limit (int): the memory (in bytes) the run may use
+        trace_location (str): a performance trace of a previous run, used to estimate the computation time
+    """
+
+    def __init__(self, interpreter, memory_limit_gb=None, trace_location=None):
+        self.interpreter = interpreter
+        self.logger = interpreter.logger
+        if memory_limit_gb is not None:
+            self.memory_limit = int(memory_limit_gb * 2 ** 30)
+        else:
+            self.memory_limit = int(0.8 * get_available_memory())
+        self.trace_location = trace_location
+
+    def get_slice_voxels(self):
+        """
+        :return: the number of voxels of a single slice of the input after downscaling
+        """
+        shape = self.interpreter.input_shape_unscaled
+        scale = self.interpreter.rescaling_factor
+        return int(math.ceil(shape[1] / scale)) * int(math.ceil(shape[2] / scale))
+
+    def get_input_itemsize(self):
+        return self.interpreter.io_handler.get_dataset(self.interpreter.input_dir).dtype.itemsize
+
+    def get_footprints(self):
+        """
+        follows the size of the image through the process list
+        :return: the peak memory of the processes in bytes per voxel of the chunk as it is read, the size of the output
+            in bytes per voxel of the chunk as it is read, and the size of a voxel of the output in bytes
+        """
+        handler = self.interpreter.handler
+        itemsize, voxels, peak = self.get_input_itemsize(), 1, 0
+        for p in handler.processes:
+            per_voxel, output_itemsize = p.get_memory_footprint(itemsize)
+            peak = max(peak, per_voxel * voxels)
+            if isinstance(p, processes.RescaleToOriginal):
+                voxels *= handler.rescaling_factor ** 3
+            itemsize = output_itemsize
+        return peak, voxels * itemsize, itemsize
+
+    def get_bytes_per_voxel(self):
+        """
+        estimates the peak memory of a chunk
+        :return: the peak memory in bytes per voxel of the chunk as it is read
+        """
+        peak, output_bytes, _ = self.get_footprints()
+        input_bytes = self.get_input_itemsize()
+        # a reusable buffer of the read chunk and the computed chunk stay allocated besides the running process
+        queued = 2 * self.interpreter.pipeline_depth * max(input_bytes, output_bytes)
+        return peak + input_bytes + output_bytes + queued
+
+    def get_reserved_memory(self):
+        """
+        :return: the memory (in bytes) reserved independently of the chunk size: the slab cache keeps sections of the
+            images read by the processes, up to its size limit or the size of these images
+        """
+        io_handler = self.interpreter.io_handler
+        scale = self.interpreter.rescaling_factor
+        referenced = 0
+        for p in self.interpreter.handler.processes:
+            for location in p.get_referenced_files():
+                if os.path.isfile(location):
+                    data = io_handler.get_dataset(location)
+                    referenced += math.prod(data.shape) * data.dtype.itemsize // scale ** 3
+        return min(io_handler.slab_cache_bytes, referenced)
+
+    def get_workers(self, chunk_count):
+        if any(p.order_dependent for p in self.interpreter.handler.processes):
+            return 1
+        return max(1, min(self.interpreter.workers, chunk_count))
+
+    def get_read_voxels(self, chunk):
+        """
+        :param chunk: the box of a chunk (before scaling), without its halo
+        :return: the number of voxels read for the chunk, including its halo, after downscaling
+        """
+        scale = self.interpreter.rescaling_factor
+        return math.prod(int(math.ceil((end - start) / scale))
+                         for start, end in self.interpreter.handler.get_read_range(chunk))
+
+    def estimate_chunk_memory(self, chunk):
+        """
+        :param chunk: the box of a chunk (before scaling), without its halo
+        :return: the estimated peak memory in bytes of computing a single chunk
+        """
+        return int(self.get_read_voxels(chunk) * self.get_bytes_per_voxel())
+
+    def choose_chunksize(self):
+        """
+        :return: the largest chunk size (in slices before scaling, a multiple of the rescaling factor) whose chunks
+            can be computed within the memory limit by all workers at once
+        """
+        scale = self.interpreter.rescaling_factor
+        length = self.interpreter.end_index - self.interpreter.start_index
+        available = self.memory_limit - self.get_reserved_memory()
+        slice_bytes = self.get_slice_voxels() * self.get_bytes_per_voxel()
+
+        chunksize = length
+        while chunksize >= scale:
+            workers = self.get_workers(int(math.ceil(length / chunksize)))
+            slices = int(available // (workers * slice_bytes))
+            fitting = (slices * scale - 2 * self.interpreter.handler.halo) // scale * scale
+            if fitting >= chunksize:
+                break
+            chunksize = fitting
+        if chunksize < scale:
+            self.logger.log_error(f"a single slice needs about {format_bytes(slice_bytes)} of memory, which does not "
+                                  f"fit into the limit of {format_bytes(self.memory_limit)} (including a halo of "
+                                  f"{self.interpreter.handler.halo} slices and "
+                                  f"{format_bytes(self.get_reserved_memory())} reserved for the slab cache)")
+        self.logger.log_timestamp(f"automatic chunk size: {chunksize} slices "
+                                  f"(memory limit {format_bytes(self.memory_limit)})")
+        return chunksize
+
+    def load_throughput(self):
+        """
+        reads the throughput of every process and of reading and writing from the trace of a previous run
+        :return: a dict of voxels per second by operation name, or None if no trace is available
+        """
+        if not self.trace_location or not os.path.isfile(self.trace_location):
+            return None
+        totals = {}
+        with open(self.trace_location) as trace:
+            for line in trace:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record['cat'] in ('process', 'io') and record.get('voxels'):
+                    voxels, wall = totals.get(record['name'], (0, 0))
+                    totals[record['name']] = (voxels + record['voxels'], wall + record['wall'])
+        return {name: voxels / wall for name, (voxels, wall) in totals.items() if wall > 0}
+
+    def estimate_time(self):
+        """
+        estimates the computation time from the throughput measured in a previous run
+        :return: the estimated time in seconds, or None if there is no trace of a previous run
+        """
+        throughput = self.load_throughput()
+        if throughput is None:
+            return None
+        interpreter = self.interpreter
+        chunks = interpreter.chunks if interpreter.chunking else [interpreter.get_full_box()]
+        scale = interpreter.rescaling_factor
+        voxels = sum(self.get_read_voxels(chunk) for chunk in chunks)
+
+        stages = [[interpreter.handler.processes[i] for i in stage] for stage in interpreter.handler.stages]
+        steps = [('read', [])] + [(' + '.join(p.name for p in stage), stage) for stage in stages] + [('write', [])]
+        seconds, missing = 0, []
+        for name, stage in steps:  # named like the operations in the trace
+            if name in throughput:
+                seconds += voxels / throughput[name]
+            else:
+                missing.append(name)
+            if any(isinstance(p, processes.RescaleToOriginal) for p in stage):
+                voxels *= scale ** 3
+        if missing:
+            self.logger.log_warning(f"no throughput measured for {', '.join(missing)}, the estimated time is too low")
+        return seconds / self.get_workers(len(chunks))
+
+    def log_plan(self):
+        """
+        logs the chunks, the estimated memory and the estimated time of the run, without computing it
+        """
+        interpreter = self.interpreter
+        lines = [f"input: {interpreter.input_dir}, shape {interpreter.input_shape_unscaled}, "
+                 f"range {interpreter.start_index} to {interpreter.end_index}, rescaling factor "
+                 f"{interpreter.rescaling_factor}",
+                 f"processes: {', '.join(p.name for p in interpreter.handler.processes)}",
+                 f"estimated peak memory: {self.get_bytes_per_voxel():.1f} bytes per voxel of a chunk"]
+        if interpreter.chunking:
+            workers = self.get_workers(len(interpreter.chunks))
+            chunk_memory = max(self.estimate_chunk_memory(chunk) for chunk in interpreter.chunks)
+            if interpreter.brick_size is not None:
+                size = [max(end - start for start, end in axis) for axis in zip(*interpreter.chunks)]
+                lines += [f"bricks: {len(interpreter.chunks)} of up to {size} voxels, halo of "
+                          f"{interpreter.handler.halo} slices, {workers} worker(s)"]
+                lines += [f"\tbrick {i}: " + ', '.join(f"{axis} {start} to {end}" for axis, (start, end)
+                                                        in zip('XYZ', chunk))
+                          for i, chunk in enumerate(interpreter.chunks)]
+            else:
+                chunksize = max(end - start for (start, end), _, _ in interpreter.chunks)
+                lines += [f"chunks: {len(interpreter.chunks)} of up to {chunksize} slices, halo of "
+                          f"{interpreter.handler.halo} slices, {workers} worker(s)"]
+                lines += [f"\tchunk {i}: index {start} to {end}"
+                          for i, ((start, end), _, _) in enumerate(interpreter.chunks)]
+            peak = workers * chunk_memory + self.get_reserved_memory()
+            lines += [f"estimated memory per chunk: {format_bytes(chunk_memory)}, in total: {format_bytes(peak)} "
+                      f"(including {format_bytes(self.get_reserved_memory())} for the slab cache)"]
+            if not interpreter.direct_write:
+                output_bytes = math.prod(interpreter.output_shape) * self.get_footprints()[2]
+                lines += [f"reassembling the output needs about {format_bytes(2 * output_bytes)}, "
+                          f"set \"direct_write\" to avoid it"]
+                peak = max(peak, 2 * output_bytes)
+        else:
+            peak = self.estimate_chunk_memory(interpreter.get_full_box()) + self.get_reserved_memory()
+            lines += [f"no chunking, estimated memory: {format_bytes(peak)}"]
+        workers = self.get_workers(len(interpreter.chunks)) if interpreter.chunking else 1
+        scheduler = interpreter.thread_scheduler
+        lines += [f"threads: {scheduler.get_share(workers)} of {scheduler.budget} per worker, "
+                  + ', '.join(f"{p.name}: {scheduler.get_threads(p, workers)}" for p in interpreter.handler.processes)]
+        exceeded = " - EXCEEDED" if peak > self.memory_limit else ""
+        lines += [f"memory limit: {format_bytes(self.memory_limit)}{exceeded}"]
+        seconds = self.estimate_time()
+        if seconds is None:
+            lines += ["estimated time: unknown (enable \"trace\" in a previous run to measure the throughput)"]
+        else:
+            lines += [f"estimated time: {seconds:.1f}s (from the throughput measured in: {self.trace_location})"]
+        self.logger.log_timestamp("run plan:\n" + '\n'.join(lines))
+
+
+def get_available_memory():
+    """
+    :return: the memory (in bytes) available to new processes, without swapping
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+
+
+def format_bytes(size):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(size) < 1024 or unit == 'GiB':
+            return f"{size:.1f} {unit}"
+        size /= 1024
@@ -0,0 +1,226 @@
+from contextlib import contextmanager
+import json
+import os
+
+import h5py
+import numpy as np
+
+
+class Hdf5Storage:
+    """
+    stores an image as the dataset 'data' of a .hdf5 file, with the metadata as attributes of a group 'meta'. Datasets
+    are chunked and optionally compressed (see IOHandler.get_dataset_options). When reading, the dataset is searched by
+    the valid identifiers of the IOHandler.
+
+    Attributes:
+        io_handler (IOHandler): provides the dataset identifiers and the storage layout
+    """
+
+    extensions = ['.hdf5', '.h5']
+
+    def __init__(self, io_handler):
+        self.io_handler = io_handler
+
+    def open(self, filename):
+        """
+        :return: the file opened for reading
+        """
+        return h5py.File(filename, 'r')
+
+    def get_dataset(self, handle, filename):
+        """
+        :param handle: the file as returned by open
+        :param filename: the location of the file, for error reporting
+        :return: the image within the file, which can be sliced along all axes
+        """
+        return self.io_handler.find_dataset(handle, filename)
+
+    def close(self, handle):
+        handle.close()
+
+    def delete(self, location):
+        os.unlink(location)
+
+    def write(self, location, out_array, meta):
+        options = self.io_handler.get_dataset_options(out_array.shape, out_array.dtype,
+                                                      self.io_handler.is_binary(out_array))
+        with h5py.File(location, 'w') as outfile:
+            outfile.create_dataset('data', shape=out_array.shape, data=out_array, **options)
+            self.write_meta(outfile, meta)
+
+    def create(self, location, shape, dtype, meta, binary):
+        options = self.io_handler.get_dataset_options(shape, dtype, binary)
+        with h5py.File(location, 'w') as outfile:
+            outfile.create_dataset('data', shape=shape, dtype=dtype, **options)
+            self.write_meta(outfile, meta)
+
+    @contextmanager
+    def open_for_writing(self, location):
+        """
+        :return: a context providing the image of an existing file, to be written to in place
+        """
+        with h5py.File(location, 'r+') as outfile:
+            yield outfile['data']
+
+    def write_meta(self, outfile, meta):
+        """
+        adds a group of metadata to an open .hdf5 file
+        :param outfile: the h5py.File to be written to
+        :param meta: the metadata to be added. process definitions are stored as strings
+        """
+        meta_grp = outfile.create_group('meta')
+        self.io_handler.logger.log_timestamp('adding meta info')
+        for k, v in meta.items():
+            if k == 'processes':
+                v = str(v)
+            meta_grp.attrs[k] = v
+
+    def read_meta(self, location):
+        with h5py.File(location, 'r') as infile:
+            return dict(infile['meta'].attrs) if 'meta' in infile else {}
+
+    def write_checkpoint(self, location, signature, checkpoint):
+        with h5py.File(location, 'a') as outfile:
+            group = outfile.require_group('checkpoint')
+            for index, state in checkpoint.items():
+                for name, value in state.items():
+                    group.create_dataset(f"{index}/{name}", data=value)
+            group.attrs['signature'] = signature
+            group.attrs['complete'] = True
+
+    def read_checkpoint(self, location, signatures):
+        try:
+            with h5py.File(location, 'r') as infile:
+                group = infile.get('checkpoint')
+                if group is None or not group.attrs.get('complete', False) \
+                        or group.attrs.get('signature') not in signatures:
+                    return None
+                return {index: {name: value[()] for name, value in state.items()} for index, state in group.items()}
+        except OSError:  # a file interrupted while it was created may not be readable at all
+            return None
+
+
+class NpyStorage:
+    """
+    stores an image as a .npy file, which is read and written through a memory map: reading a range along the X-Axis
+    maps the pages of its slices instead of copying them through a library, so slices in the page cache are read
+    without any copy. The file is never compressed. The metadata is stored in a .json file next to it, and the state of
+    a chunk checkpoint in a .npz file.
+
+    a file is always written completely to a temporary location and then moved to its final location, so arrays
+    mapped from a previous version of the file stay valid.
+
+    Attributes:
+        io_handler (IOHandler): encapsulates the output of basic user information during computation
+    """
+
+    extensions = ['.npy']
+
+    def __init__(self, io_handler):
+        self.io_handler = io_handler
+
+    def open(self, filename):
+        return np.load(filename, mmap_mode='r')
+
+    def get_dataset(self, handle, filename):
+        if handle.ndim != 3:
+            self.io_handler.logger.log_error(f'unable to extract a 3D image from input file: {filename}')
+        return handle
+
+    def close(self, handle):
+        pass  # the map is closed as soon as no array refers to it anymore
+
+    def delete(self, location):
+        """
+        deletes the image and the files stored next to it
+        """
+        for name in [location, self.get_meta_name(location), self.get_checkpoint_name(location)]:
+            if os.path.isfile(name):
+                os.unlink(name)
+
+    def write(self, location, out_array, meta):
+        self.remove_checkpoint(location)
+        partial = self.get_partial_name(location)
+        with open(partial, 'wb') as outfile:
+            np.save(outfile, out_array)
+        os.replace(partial, location)
+        self.write_meta(location, meta)
+
+    def create(self, location, shape, dtype, meta, binary):
+        self.remove_checkpoint(location)
+        partial = self.get_partial_name(location)
+        data = np.lib.format.open_memmap(partial, mode='w+', dtype=dtype, shape=tuple(shape))
+        data.flush()
+        del data
+        os.replace(partial, location)
+        self.write_meta(location, meta)
+
+    @contextmanager
+    def open_for_writing(self, location):
+        data = np.load(location, mmap_mode='r+')
+        yield data
+        data.flush()
+
+    def get_partial_name(self, location):
+        return f"{location}.partial"
+
+    def get_meta_name(self, location):
+        return f"{os.path.splitext(location)[0]}.meta.json"
+
+    def get_checkpoint_name(self, location):
+        return f"{os.path.splitext(location)[0]}.checkpoint.npz"
+
+    def write_meta(self, location, meta):
+        """
+        writes the metadata to a .json file next to the image. Values that are not valid json are stored as strings.
+        """
+        self.io_handler.logger.log_timestamp('adding meta info')
+        with open(self.get_meta_name(location), 'w') as meta_file:
+            json.dump(meta, meta_file, indent=2, default=str)
+
+    def read_meta(self, location):
+        if not os.path.isfile(self.get_meta_name(location)):
+            return {}
+        with open(self.get_meta_name(location)) as meta_file:
+            return json.load(meta_file)
+
+    def remove_checkpoint(self, location):
+        if os.path.isfile(self.get_checkpoint_name(location)):
+            os.unlink(self.get_checkpoint_name(location))
+
+    def write_checkpoint(self, location, signature, checkpoint):
+        # the checkpoint is only moved to its location once it is complete, its existence marks the chunk complete
+        arrays = {f"{index}/{name}": value for index, state in checkpoint.items() for name, value in state.items()}
+        partial = self.get_partial_name(self.get_checkpoint_name(location))
+        with open(partial, 'wb') as outfile:
+            np.savez(outfile, signature=np.array(signature), **arrays)
+        os.replace(partial, self.get_checkpoint_name(location))
+
+    def read_checkpoint(self, location, signatures):
+        if not os.path.isfile(location) or not os.path.isfile(self.get_checkpoint_name(location)):
+            return None
+        with np.load(self.get_checkpoint_name(location)) as saved:
+            if str(saved['signature']) not in signatures:
+                return None
+            checkpoint = {}
+            for key in saved.files:
+                if key != 'signature':
+                    index, name = key.split('/', 1)
+                    checkpoint.setdefault(index, {})[name] = saved[key]
+            return checkpoint
+
+
+backends = [Hdf5Storage, NpyStorage]
+formats = {'hdf5': '.hdf5', 'npy': '.npy'}
+
+
+def get_storage_class(filename):
+    """
+    :param filename: the location of a file
+    :return: the storage backend of the file, chosen by its extension. Files with an unknown extension are .hdf5 files.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    for backend in backends:
+        if extension in backend.extensions:
+            return backend
+    return Hdf5Storage
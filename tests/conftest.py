@@ -0,0 +1,65 @@
+import json
+import os
+import subprocess
+import sys
+
+import h5py
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def write_volume(location, array):
+    with h5py.File(location, 'w') as outfile:
+        outfile.create_dataset('data', data=array)
+    return location
+
+
+@pytest.fixture
+def volume(tmp_path):
+    """
+    a smooth grayscale volume with some noise, and its location
+    """
+    rng = np.random.default_rng(0)
+    x, y, z = np.meshgrid(np.arange(40), np.arange(24), np.arange(20), indexing='ij')
+    array = (100 + 60 * np.sin(x / 5) * np.cos(y / 4) + rng.normal(0, 10, x.shape)).clip(0, 255).astype(np.uint8)
+    return write_volume(str(tmp_path / 'volume.hdf5'), array), array
+
+
+@pytest.fixture
+def write_setup(tmp_path):
+    """
+    writes a setup file with its output and temporary files in tmp_path, and returns its location
+    """
+    def write(setup, name='result'):
+        setup = dict(setup, image_dir=f"{tmp_path}/out/", temp_dir=f"{tmp_path}/temp/", file_name=name)
+        os.makedirs(setup['image_dir'], exist_ok=True)
+        os.makedirs(setup['temp_dir'], exist_ok=True)
+        location = tmp_path / f"{name}.json"
+        location.write_text(json.dumps(setup))
+        return str(location)
+    return write
+
+
+@pytest.fixture
+def run(tmp_path, write_setup):
+    """
+    runs compute_from_json.py on a setup and returns its output
+    """
+    def run_setup(setup, name='result', args=(), answers=None):
+        """
+        :param answers: the answers to the user input queries, one per line. Defaults to their default answers.
+        """
+        location = write_setup(setup, name)
+        confirm = ['-nc'] if answers is None else []
+        result = subprocess.run([sys.executable, os.path.join(ROOT, 'compute_from_json.py'), location, *confirm,
+                                 '-nd', *args], input=answers, capture_output=True, text=True, cwd=ROOT)
+        assert result.returncode == 0 and 'Error' not in result.stdout, result.stdout[-2000:] + result.stderr[-2000:]
+        output = tmp_path / 'out' / f"{name}.hdf5"
+        if not output.is_file():
+            return None, result.stdout
+        with h5py.File(output, 'r') as outfile:
+            return outfile['data'][...], result.stdout
+    return run_setup
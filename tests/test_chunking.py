@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+
+import h5py
+import numpy as np
+
+from conftest import ROOT, write_volume
+
+
+def test_chunked_append_images(tmp_path, volume, run):
+    location, array = volume
+    appended = np.full((5,) + array.shape[1:], 7, dtype=array.dtype)
+    append_location = write_volume(str(tmp_path / 'appended.hdf5'), appended)
+    processes = [{"type": "AppendImages", "images": [append_location]}]
+
+    out, _ = run({"input_dir": location, "processes": processes, "chunking": True, "chunksize": 15})
+
+    # every chunk is extended by the appended image before the chunks are concatenated
+    expected = np.concatenate([part for start in range(0, len(array), 15)
+                               for part in (array[start:start + 15], appended)])
+    np.testing.assert_array_equal(out, expected)
+
+
+def test_bricks_match_whole_image(volume, run):
+    location, _ = volume
+    processes = [{"type": "MeanFilter", "radius": 2}, {"type": "Thresholding", "lower": 80, "upper": 150}]
+    reference, _ = run({"input_dir": location, "processes": processes}, 'reference')
+
+    out, _ = run({"input_dir": location, "processes": processes, "chunking": True, "halo": True,
+                  "brick_size": [16, 10, 12]})
+
+    np.testing.assert_array_equal(out, reference)
+
+
+def test_workers_match_serial_chunks(volume, run):
+    location, _ = volume
+    processes = [{"type": "MeanFilter", "radius": 1}, {"type": "Thresholding", "lower": 90, "upper": 200}]
+    setup = {"input_dir": location, "processes": processes, "chunking": True, "chunksize": 10, "halo": True}
+    reference, _ = run(setup, 'reference')
+
+    out, _ = run(dict(setup, workers=2))
+
+    np.testing.assert_array_equal(out, reference)
+
+
+def test_direct_write_with_workers(volume, run):
+    location, _ = volume
+    processes = [{"type": "MeanFilter", "radius": 1}]
+    setup = {"input_dir": location, "processes": processes, "chunking": True, "chunksize": 2, "halo": True}
+    reference, _ = run(setup, 'reference')
+
+    # more chunks than are submitted to the workers at once
+    out, _ = run(dict(setup, workers=2, direct_write=True))
+
+    np.testing.assert_array_equal(out, reference)
+
+
+def test_reassemble_bricks_from_temporary_files(tmp_path, volume, run):
+    location, _ = volume
+    processes = [{"type": "Thresholding", "lower": 80, "upper": 150}]
+    reference, _ = run({"input_dir": location, "processes": processes, "chunking": True,
+                        "brick_size": [16, 10, 12]}, answers='n\n')  # keeps the temporary files
+    output = tmp_path / 'out' / 'result.hdf5'
+    output.unlink()
+
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'reassemble_chunks.py'), str(tmp_path / 'result.json'),
+                             '-nd'], capture_output=True, text=True, cwd=ROOT)
+
+    assert 'Error' not in result.stdout, result.stdout[-2000:] + result.stderr[-2000:]
+    with h5py.File(output, 'r') as outfile:
+        np.testing.assert_array_equal(outfile['data'][...], reference)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from conftest import write_volume
+
+
+def assert_same_partition(labels, reference):
+    """
+    asserts that two label images define the same components, regardless of their IDs
+    """
+    np.testing.assert_array_equal(labels != 0, reference != 0)
+    pairs = np.unique(np.stack([labels.ravel(), reference.ravel()]), axis=1)
+    assert pairs.shape[1] == len(np.unique(labels)) == len(np.unique(reference))
+
+
+@pytest.mark.parametrize('fully_connected', [False, True])
+def test_chunked_labels_match_whole_image(tmp_path, run, fully_connected):
+    array = np.zeros((40, 24, 20), dtype=np.uint8)
+    array[:, 2, 2] = 255  # spans all chunks
+    array[:36, 5, 5] = array[:36, 8, 5] = array[35, 5:9, 5] = 255  # two branches only connected in the last chunk
+    array[9, 15, 15] = array[10, 16, 16] = 255  # only touching at a corner, across the border of two chunks
+    rng = np.random.default_rng(0)
+    array[:, 18:] = np.where(rng.random((40, 6, 20)) < 0.3, 255, 0)
+    location = write_volume(str(tmp_path / 'binary.hdf5'), array)
+    processes = [{"type": "ConnectedComponents", "fully_connected": fully_connected}]
+    reference, _ = run({"input_dir": location, "processes": processes}, 'reference')
+
+    out, _ = run({"input_dir": location, "processes": processes, "chunking": True, "chunksize": 10, "workers": 2})
+
+    assert_same_partition(out, reference)
+    assert (reference[9, 15, 15] == reference[10, 16, 16]) == fully_connected
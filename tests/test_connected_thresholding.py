@@ -0,0 +1,21 @@
+import numpy as np
+
+from conftest import write_volume
+
+
+def test_handoff_after_rescale_to_original(tmp_path, run):
+    # a staircase of foreground, moving by one voxel along the Y-Axis with every slice
+    array = np.zeros((30, 34, 6), dtype=np.uint8)
+    for x in range(len(array)):
+        array[x, x:x + 4] = 200
+    location = write_volume(str(tmp_path / 'staircase.hdf5'), array)
+    processes = [{"type": "RescaleToOriginal"},
+                 {"type": "ConnectedThresholding", "lower": 100, "upper": 255, "seeds": [[0, 0, 0]],
+                  "replacevalue": 255}]
+    setup = {"input_dir": location, "processes": processes, "rescaling_factor": 2}
+    reference, _ = run(setup, 'reference')
+    assert np.count_nonzero(reference[-1])
+
+    out, _ = run(dict(setup, chunking=True, chunksize=10, halo=4))
+
+    np.testing.assert_array_equal(out, reference)
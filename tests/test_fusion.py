@@ -0,0 +1,30 @@
+import numpy as np
+
+from conftest import write_volume
+
+
+def test_fused_thresholding_with_fractional_bounds(volume, run):
+    location, array = volume
+    # the voxels equal to the truncated lower bounds are kept by sitk, but lie below the bounds as floats
+    assert np.any(array == 80) and np.any(array == 100)
+    processes = [{"type": "Thresholding", "lower": 80.5, "upper": 200.7},
+                 {"type": "Thresholding", "lower": 100.2, "upper": 150.9}]
+    reference, _ = run({"input_dir": location, "processes": processes, "fuse_pointwise": False}, 'reference')
+
+    out, _ = run({"input_dir": location, "processes": processes})
+
+    np.testing.assert_array_equal(out, reference)
+
+
+
+def test_morphology_fusion_has_its_own_option(tmp_path, volume, run):
+    _, array = volume
+    location = write_volume(str(tmp_path / 'binary.hdf5'), np.where(array > 110, 255, 0).astype(np.uint8))
+    processes = [{"type": "BinaryErosion", "radius": 1}, {"type": "BinaryDilation", "radius": 1}]
+
+    fused, stdout = run({"input_dir": location, "processes": processes, "fuse_pointwise": False}, 'fused')
+    assert "into BinaryOpening" in stdout
+
+    out, stdout = run({"input_dir": location, "processes": processes, "fuse_morphology": False})
+    assert "into BinaryOpening" not in stdout
+    np.testing.assert_array_equal(out, fused)
@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('sigma', [1.0, 1.7, 4.0])
+def test_gaussian_halo_is_within_one_grey_value(volume, run, sigma):
+    location, _ = volume
+    processes = [{"type": "SmoothingGaussianFilter", "sigma": sigma}]
+    reference, _ = run({"input_dir": location, "processes": processes}, 'reference')
+
+    out, _ = run({"input_dir": location, "processes": processes, "chunking": True, "chunksize": 10, "halo": True})
+
+    # the recursive gaussian is truncated at the halo, so a few voxels may be rounded to the neighbouring grey value
+    difference = np.abs(out.astype(int) - reference.astype(int))
+    assert difference.max() <= 1
+    assert np.count_nonzero(difference) <= out.size // 1000
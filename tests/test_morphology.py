@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from conftest import write_volume
+
+
+def sitk_opening(image, radius):
+    return sitk.BinaryMorphologicalOpening(image, [radius] * 3, sitk.sitkBall, backgroundValue=0, foregroundValue=255)
+
+
+def sitk_closing(image, radius):
+    # like BinaryDilation followed by BinaryErosion, the image is not padded to protect its border
+    return sitk.BinaryMorphologicalClosing(image, [radius] * 3, sitk.sitkBall, foregroundValue=255, safeBorder=False)
+
+
+filters = {'BinaryOpening': sitk_opening, 'BinaryClosing': sitk_closing}
+
+
+@pytest.mark.parametrize('radius', [1, 2, 3])
+@pytest.mark.parametrize('process', list(filters))
+def test_distance_morphology_matches_sitk(tmp_path, volume, run, process, radius):
+    _, array = volume
+    binary = np.where(array > 110, 255, 0).astype(np.uint8)
+    location = write_volume(str(tmp_path / 'binary.hdf5'), binary)
+    expected = sitk.GetArrayFromImage(filters[process](sitk.GetImageFromArray(binary), radius))
+    processes = [{"type": process, "radius": radius}]
+
+    out, _ = run({"input_dir": location, "processes": processes}, 'whole')
+    np.testing.assert_array_equal(out, expected)
+
+    out, _ = run({"input_dir": location, "processes": processes, "chunking": True, "chunksize": 10, "halo": True})
+    np.testing.assert_array_equal(out, expected)
@@ -0,0 +1,52 @@
+import threading
+
+import numpy as np
+
+from conftest import write_volume
+from io_utils import IOHandler
+from logger import Logger
+
+
+def test_pipelined_run_with_several_masks(tmp_path, volume, run):
+    location, array = volume
+    processes = []
+    for i in range(4):
+        mask = np.zeros_like(array)
+        mask[:, i:] = 255
+        processes.append({"type": "MaskImage", "mask_location": write_volume(str(tmp_path / f'mask{i}.hdf5'), mask)})
+    setup = {"input_dir": location, "processes": processes, "chunking": True, "chunksize": 1}
+    reference, _ = run(setup, 'reference')
+
+    # the writer thread releases the written files while the masks are read and cached by the other threads
+    out, _ = run(dict(setup, pipeline_depth=3))
+
+    np.testing.assert_array_equal(out, reference)
+
+
+def test_release_file_while_sections_are_cached(tmp_path):
+    location = write_volume(str(tmp_path / 'slices.hdf5'), np.zeros((3000, 4, 4), dtype=np.uint8))
+    handler = IOHandler(True, Logger())
+    errors = []
+
+    def cache_sections():
+        try:
+            for i in range(3000):
+                handler.load_cached_array(location, 1, i, i + 1)
+        except Exception as e:
+            errors.append(e)
+
+    def release_files():
+        try:
+            for i in range(5000):
+                handler.release_file(str(tmp_path / f'chunk{i % 3}.hdf5'))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=cache_sections), threading.Thread(target=release_files)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(handler.slab_cache) == 3000
@@ -0,0 +1,16 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_preview_of_empty_range(tmp_path, volume):
+    location, _ = volume
+    directory = tmp_path / 'previews'
+
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'load_image.py'), location, '--preview', str(directory),
+                             '--si', '10', '--ei', '10'], capture_output=True, text=True, cwd=ROOT)
+
+    assert 'Error: the range (10, 10) along the X-Axis' in result.stdout
+    assert not directory.exists()
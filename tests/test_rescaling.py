@@ -0,0 +1,14 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('layout', [{"chunksize": 20}, {"brick_size": [16, 12, 12]}])
+def test_chunked_linear_upscaling_matches_whole_image(volume, run, layout):
+    location, _ = volume
+    processes = [{"type": "RescaleToOriginal", "interpolation": "linear"}]
+    setup = {"input_dir": location, "processes": processes, "rescaling_factor": 2}
+    reference, _ = run(setup, 'reference')
+
+    out, _ = run(dict(setup, chunking=True, halo=True, **layout))
+
+    np.testing.assert_array_equal(out, reference)
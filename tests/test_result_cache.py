@@ -0,0 +1,34 @@
+import numpy as np
+
+
+def test_prefix_of_process_list_is_reused(tmp_path, volume, run):
+    location, _ = volume
+    processes = [{"type": "Thresholding", "lower": 80, "upper": 200}, {"type": "MeanFilter", "radius": 1},
+                 {"type": "GrayScaleDilation", "radius": 1}]
+    extended = processes + [{"type": "Thresholding", "lower": 90, "upper": 180}]
+    cache = {"cache_dir": f"{tmp_path}/cache/"}
+    run(dict(cache, input_dir=location, processes=processes), 'first')
+
+    reference, _ = run({"input_dir": location, "processes": extended}, 'reference')
+    out, stdout = run(dict(cache, input_dir=location, processes=extended), 'extended')
+    assert "resuming from the cached result of the processes up to MeanFilter" in stdout
+    np.testing.assert_array_equal(out, reference)
+
+    edited = [dict(extended[0], lower=85)] + extended[1:]
+    reference, _ = run({"input_dir": location, "processes": edited}, 'edited_reference')
+    out, stdout = run(dict(cache, input_dir=location, processes=edited), 'edited')
+    assert "resuming from the cached result" not in stdout
+    np.testing.assert_array_equal(out, reference)
+
+
+def test_plan_does_not_evict_cached_results(tmp_path, volume, run):
+    location, _ = volume
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    (cache_dir / 'stored.npy').write_bytes(b'0' * 2 ** 20)
+    processes = [{"type": "Thresholding", "lower": 80, "upper": 200}]
+
+    run({"input_dir": location, "processes": processes, "cache_dir": f"{cache_dir}/", "cache_size_gb": 0},
+        args=('--plan',))
+
+    assert (cache_dir / 'stored.npy').exists()
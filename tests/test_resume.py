@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+import time
+
+import h5py
+import numpy as np
+
+from conftest import ROOT, write_volume
+
+
+def is_complete(location):
+    try:
+        with h5py.File(location, 'r') as chunk:
+            return 'checkpoint' in chunk and bool(chunk['checkpoint'].attrs.get('complete', False))
+    except OSError:
+        return False
+
+
+def get_complete_chunks(directory):
+    return {name: os.stat(directory / name).st_mtime_ns for name in sorted(os.listdir(directory))
+            if is_complete(directory / name)}
+
+
+def start_and_kill(location, directory, chunks):
+    """
+    starts a run and kills it as soon as the given number of chunks is saved
+    """
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'compute_from_json.py'), location, '-nd'],
+                               stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=ROOT)
+    try:
+        while len(get_complete_chunks(directory)) < chunks:
+            assert process.poll() is None, "the run finished before it was interrupted"
+            time.sleep(0.005)
+    finally:
+        process.kill()
+        process.wait()
+
+
+def test_resume_interrupted_run(tmp_path, run, write_setup):
+    array = np.random.default_rng(0).integers(0, 255, (200, 24, 20), dtype=np.uint8)
+    location = write_volume(str(tmp_path / 'volume.hdf5'), array)
+    setup = {"input_dir": location, "chunking": True, "chunksize": 1, "halo": True,
+             "processes": [{"type": "MeanFilter", "radius": 1}, {"type": "Thresholding", "lower": 90, "upper": 200}]}
+    reference, _ = run(setup, 'reference')
+    temp_dir = tmp_path / 'temp'
+
+    start_and_kill(write_setup(setup), temp_dir, 5)
+    completed = get_complete_chunks(temp_dir)
+    assert 5 <= len(completed) < 200
+
+    out, stdout = run(setup, args=('--resume',), answers='n\n')  # keeps the temporary files
+
+    np.testing.assert_array_equal(out, reference)
+    assert f"resuming: {len(completed)} of 200 chunks were already computed" in stdout
+    assert {name: mtime for name, mtime in get_complete_chunks(temp_dir).items() if name in completed} == completed
+
+
+def test_resume_with_changed_processes(tmp_path, volume, run):
+    location, _ = volume
+    setup = {"input_dir": location, "chunking": True, "chunksize": 10,
+             "processes": [{"type": "Thresholding", "lower": 90, "upper": 200}]}
+    run(setup, answers='n\n')
+    (tmp_path / 'out' / 'result.hdf5').unlink()
+
+    changed = dict(setup, processes=[{"type": "Thresholding", "lower": 100, "upper": 200}])
+    reference, _ = run(changed, 'reference')
+    out, stdout = run(changed, args=('--resume',))
+
+    assert "resuming: 0 of 4 chunks were already computed" in stdout
+    np.testing.assert_array_equal(out, reference)
@@ -0,0 +1,15 @@
+import json
+
+
+def test_calibrate_skips_processes_writing_files(tmp_path, volume, run):
+    location, _ = volume
+    table = tmp_path / 'table.csv'
+    processes = [{"type": "Thresholding", "lower": 80, "upper": 150},
+                 {"type": "Quantification", "table": str(table)}]
+
+    _, stdout = run({"input_dir": location, "processes": processes}, args=('--calibrate',))
+
+    assert not table.exists()
+    assert 'Quantification writes files and is not calibrated' in stdout
+    profile = json.loads((tmp_path / 'out' / 'result.threads.json').read_text())
+    assert list(profile) == ['Thresholding']
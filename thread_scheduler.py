@@ -0,0 +1,145 @@
+import json
+import os
+import time
+
+import SimpleITK as sitk
+
+
+class ThreadScheduler:
+    """
+    distributes a budget of threads over the SimpleITK filters of a run. Every worker process gets an equal share of
+    the budget, and every stage runs with the number of threads defined for its processes, or with the smallest
+    number of threads that reaches close to the best time measured by a calibration of the process, or with the whole
+    share of its worker.
+
+    the calibration records the scaling curve of every process: the time per megavoxel of the process with 1, 2, 4, ...
+    threads up to the budget. With these curves, the number of workers can be chosen so that the cores are used by
+    concurrent chunks instead of by filters that do not scale.
+
+    Attributes:
+        budget (int): the number of threads the whole run may use
+        workers (int): the number of chunks computed at the same time, sharing the budget
+        profile_location (str): the file the calibrated scaling curves are stored in
+        profile (dict): the seconds per megavoxel of every process (by name) for every calibrated number of threads
+        tolerance (float): the fraction by which a process may be slower than with the best number of threads, if it
+            needs fewer threads for it. Defaults to 0.1.
+        logger (Logger): encapsulates the output of basic user information during computation
+    """
+
+    def __init__(self, budget, profile_location, logger, tolerance=0.1):
+        self.budget = max(1, int(budget))
+        self.workers = 1
+        self.profile_location = profile_location
+        self.tolerance = tolerance
+        self.logger = logger
+        self.profile = {}
+        if profile_location is not None and os.path.isfile(profile_location):
+            with open(profile_location) as profile_file:
+                self.profile = {name: {int(threads): seconds for threads, seconds in curve.items()}
+                                for name, curve in json.load(profile_file).items()}
+
+    def set_workers(self, workers):
+        self.workers = max(1, int(workers))
+
+    def get_share(self, workers=None):
+        """
+        :param workers: the number of workers sharing the budget. Defaults to the workers of the run.
+        :return: the number of threads available to a single worker
+        """
+        return max(1, self.budget // (workers or self.workers))
+
+    def get_threads(self, process, workers=None):
+        """
+        :param process: a Process
+        :param workers: the number of workers sharing the budget. Defaults to the workers of the run.
+        :return: the number of threads the process is to be executed with
+        """
+        share = self.get_share(workers)
+        if process.threads is not None:
+            return max(1, min(int(process.threads), share))
+        curve = {threads: seconds for threads, seconds in self.profile.get(process.name, {}).items() if threads <= share}
+        if not curve:
+            return share
+        best = min(curve.values())
+        return min(threads for threads, seconds in curve.items() if seconds <= best * (1 + self.tolerance))
+
+    def apply(self, stage_processes):
+        """
+        sets the number of threads used by all SimpleITK filters created afterwards
+        :param stage_processes: the processes of the stage to be executed
+        :return: the number of threads
+        """
+        threads = max(self.get_threads(p) for p in stage_processes)
+        sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(threads)
+        return threads
+
+    def estimate_seconds(self, process, threads):
+        """
+        :return: the calibrated seconds per megavoxel of a process with the largest calibrated number of threads not
+            above the given one, or None if the process was not calibrated
+        """
+        curve = {t: seconds for t, seconds in self.profile.get(process.name, {}).items() if t <= threads}
+        return curve[max(curve)] if curve else None
+
+    def choose_workers(self, processes):
+        """
+        chooses the number of workers with the highest throughput, based on the calibrated scaling curves
+        :param processes: the process list of the run
+        :return: the number of workers
+        """
+        if any(p.order_dependent for p in processes):
+            return 1
+        if not all(p.name in self.profile for p in processes):
+            self.logger.log_warning("not all processes are calibrated, computing a single chunk at a time "
+                                    "(run with --calibrate to measure the scaling of the processes)")
+            return 1
+        best_workers, best_throughput = 1, 0
+        for workers in range(1, self.budget + 1):
+            seconds = sum(self.estimate_seconds(p, self.get_threads(p, workers)) for p in processes)
+            throughput = workers / seconds if seconds > 0 else float('inf')
+            if throughput > best_throughput * (1 + self.tolerance):
+                best_workers, best_throughput = workers, throughput
+        self.logger.log_timestamp(f"automatic number of workers: {best_workers} with {self.get_share(best_workers)} "
+                                  f"thread(s) each")
+        return best_workers
+
+    def calibrate(self, handler, in_array):
+        """
+        executes every process of the handler on the given array with 1, 2, 4, ... threads up to the budget, and
+        stores the measured time per megavoxel in the profile. Every process is applied to the output of the previous
+        one, computed with the whole budget. Processes that write files (e.g. the table of Quantification) are skipped,
+        so calibrating does not overwrite their results, and pass their input on unchanged.
+        :param handler: the ProcessHandler, with the indices of the array set
+        :param in_array: the array the processes are calibrated on
+        """
+        counts = sorted({min(2 ** i, self.budget) for i in range(self.budget.bit_length() + 1)})
+        data = in_array
+        for p in handler.processes:
+            if p.writes_files:
+                self.logger.log_warning(f"{p.name} writes files and is not calibrated")
+                continue
+            image = handler.get_image(data)  # filters never modify their input, so every run sees the same image
+            megavoxels = handler.get_size(image) / 1e6
+            curve = {}
+            for threads in counts:
+                sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(threads)
+                start = time.perf_counter()
+                data = p.execute(image)
+                curve[threads] = (time.perf_counter() - start) / megavoxels
+            self.profile[p.name] = curve
+            self.logger.log_timestamp(f"calibrated {p.name}: " + ', '.join(f"{threads} thread(s) {seconds:.3f}s"
+                                                                          for threads, seconds in curve.items())
+                                      + " per megavoxel")
+        sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(self.budget)
+        with open(self.profile_location, 'w') as profile_file:
+            json.dump(self.profile, profile_file, indent=2)
+        self.logger.log_timestamp(f"thread profile written to: {self.profile_location}")
+
+
+def get_available_cores():
+    """
+    :return: the number of cores the run may be scheduled on
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
@@ -0,0 +1,132 @@
+import argparse
+from contextlib import contextmanager
+import json
+import os
+import re
+import resource
+import threading
+import time
+
+CHUNK_INDEX = re.compile(r'_[0-9]+(?=\.[^.]+$)')  # the index in the name of a temporary chunk file
+
+
+class Tracer:
+    """
+    records the cost of every process, chunk and file operation of a run in a trace file of JSON lines, one record per
+    operation, and summarizes the trace at the end of the run. Worker processes append to the same file.
+
+    every record contains the category ('process', 'chunk' or 'io') and name of the operation, the chunk it belongs to
+    (or None), the process id, its start (in seconds since the tracer was created), its wall time and CPU time (in
+    seconds, the CPU time of all threads of the process), the increase of the peak resident memory of the process
+    during the operation (in KiB), and where known the number of voxels processed and of bytes read or written.
+
+    Attributes:
+        location (str): the trace file, or None if tracing is disabled
+        logger (Logger): encapsulates the output of basic user information during computation
+        start_time (float): the wall clock time the tracer was created at
+        context (threading.local): the chunk the current thread is working on
+    """
+
+    def __init__(self, location, logger):
+        self.location = location
+        self.logger = logger
+        self.start_time = time.time()
+        self.context = threading.local()
+        self.file_descriptor = None
+        if self.location is not None:
+            # every record is appended with a single write, so records of threads and worker processes never interleave
+            self.file_descriptor = os.open(self.location, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+            self.logger.log_timestamp(f"writing performance trace to: {self.location}")
+
+    @property
+    def enabled(self):
+        return self.file_descriptor is not None
+
+    def set_chunk(self, chunk):
+        """
+        assigns all following operations of the calling thread to a chunk
+        :param chunk: the index of the chunk, or None
+        """
+        self.context.chunk = chunk
+
+    @contextmanager
+    def span(self, category, name, **fields):
+        """
+        measures the operation executed within the context and appends its record to the trace
+        :param category: the kind of operation ('process', 'chunk' or 'io')
+        :param name: the name of the operation
+        :param fields: additional values to be recorded (e.g. voxels, bytes_read, bytes_written)
+        :return: the record, to which values known only after the operation can be added
+        """
+        if not self.enabled:
+            yield fields
+            return
+
+        wall, cpu, peak = time.perf_counter(), time.process_time(), self.get_peak_rss()
+        start = time.time() - self.start_time
+        try:
+            yield fields
+        finally:
+            record = {'cat': category, 'name': name, 'chunk': getattr(self.context, 'chunk', None),
+                      'pid': os.getpid(), 'start': round(start, 6), 'wall': round(time.perf_counter() - wall, 6),
+                      'cpu': round(time.process_time() - cpu, 6), 'rss_delta_kb': self.get_peak_rss() - peak}
+            record.update(fields)
+            os.write(self.file_descriptor, (json.dumps(record, default=int) + '\n').encode())
+
+    def get_peak_rss(self):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def close(self):
+        """
+        logs a summary of the trace and closes the trace file
+        """
+        if not self.enabled:
+            return
+        os.close(self.file_descriptor)
+        self.file_descriptor = None
+        with open(self.location) as trace:
+            records = [json.loads(line) for line in trace if line.strip()]
+        self.logger.log_timestamp(f"performance summary ({len(records)} records in {self.location}):\n"
+                                  f"{summarize_trace(records)}")
+
+
+def summarize_trace(records):
+    """
+    aggregates the records of a trace per operation
+    :param records: the records of a trace, as written by Tracer
+    :return: a table as a string, operations ordered by their total wall time
+    """
+    totals = {}
+    for record in records:
+        name = record['name']
+        if 'file' in record:  # the temporary files of all chunks are summarized together
+            name = f"{name} {re.sub(CHUNK_INDEX, '_#', record['file'])}"
+        total = totals.setdefault((record['cat'], name), {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'rss_delta_kb': 0,
+                                                         'voxels': 0, 'bytes_read': 0, 'bytes_written': 0,
+                                                         'max_wall': 0.0, 'max_chunk': None})
+        total['count'] += 1
+        total['wall'] += record['wall']
+        total['cpu'] += record['cpu']
+        total['rss_delta_kb'] = max(total['rss_delta_kb'], record['rss_delta_kb'])
+        for field in ['voxels', 'bytes_read', 'bytes_written']:
+            total[field] += record.get(field, 0)
+        if record['wall'] >= total['max_wall']:
+            total['max_wall'], total['max_chunk'] = record['wall'], record['chunk']
+
+    lines = [f"{'category':<9}{'operation':<42}{'count':>7}{'wall [s]':>11}{'cpu [s]':>11}{'max rss +MiB':>14}"
+             f"{'Mvoxel/s':>10}{'read MiB':>10}{'written MiB':>13}{'slowest chunk':>15}"]
+    for (category, name), total in sorted(totals.items(), key=lambda item: -item[1]['wall']):
+        rate = total['voxels'] / total['wall'] / 1e6 if total['wall'] > 0 and total['voxels'] else 0
+        slowest = '' if total['max_chunk'] is None else f"{total['max_chunk']} ({total['max_wall']:.2f}s)"
+        lines.append(f"{category:<9}{name[:41]:<42}{total['count']:>7}{total['wall']:>11.2f}{total['cpu']:>11.2f}"
+                     f"{total['rss_delta_kb'] / 1024:>14.1f}{rate:>10.1f}{total['bytes_read'] / 2 ** 20:>10.1f}"
+                     f"{total['bytes_written'] / 2 ** 20:>13.1f}{slowest:>15}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='summarizes a performance trace written during a computation.')
+    parser.add_argument('trace', help='the location of the trace file')
+    args = parser.parse_args()
+    with open(args.trace) as trace_file:
+        print(summarize_trace([json.loads(line) for line in trace_file if line.strip()]))